@@ -0,0 +1,157 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Chat rerun benchmark
+# Starts page_mockup_v3.py with `streamlit run`, opens a chat page over the same websocket the browser uses
+# and sends chat messages, reporting for each one the wall time until the script run finishes and the number
+# of bytes / deltas the server sent back. Messages are listing-fact questions that the intent router answers
+# locally, so no OpenAI calls are made and the numbers are Streamlit's own rerun cost.
+# If the chat input belongs to a fragment the message is sent as a fragment rerun, like the browser does.
+# With --noop it sends reruns that change nothing instead (what any widget interaction costs at minimum),
+# on the chat page or with --page home on the home page.
+#
+# Usage: python bench_chat_rerun.py [--messages 8] [--rev HEAD~1] [--noop] [--page home]
+# --rev benchmarks page_mockup_v3.py as of that git revision instead of the working tree.
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from tornado.ioloop import IOLoop
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(HERE, "page_mockup_v3.py")
+
+LISTING_ID = "medford-1a"
+QUESTIONS = ["Are pets allowed?", "What is the move in cost?", "What is the move in date?", "How many people can live there?"]
+DONE = (ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_server(port: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout = 1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit("streamlit did not start")
+
+
+# Sends one rerun request and reads messages until the run finishes.
+# Returns (wall ms, bytes received, deltas received, chat input element id, chat input fragment id)
+async def rerun(ws, query: str, message: str | None, chat_input_id: str | None, fragment_id: str | None):
+    back = BackMsg()
+    back.rerun_script.query_string = query
+    if message is not None:
+        widget = back.rerun_script.widget_states.widgets.add()
+        widget.id = chat_input_id
+        widget.string_trigger_value.data = message
+        if fragment_id:
+            back.rerun_script.fragment_id = fragment_id
+
+    started = time.perf_counter()
+    await ws.write_message(back.SerializeToString(), binary = True)
+    received = deltas = 0
+    while True:
+        # Acknowledge right away; otherwise Linux's delayed ACKs add ~40ms to every measurement
+        if hasattr(socket, "TCP_QUICKACK"):
+            ws.stream.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        raw = await ws.read_message()
+        if raw is None:
+            raise SystemExit("websocket closed")
+        received += len(raw)
+        msg = ForwardMsg()
+        msg.ParseFromString(raw)
+        kind = msg.WhichOneof("type")
+        if kind == "delta":
+            deltas += 1
+            if msg.delta.new_element.WhichOneof("type") == "chat_input":
+                chat_input_id = msg.delta.new_element.chat_input.id
+                fragment_id = msg.delta.fragment_id or None
+        elif kind == "script_finished" and msg.script_finished in DONE:
+            return (time.perf_counter() - started) * 1000, received, deltas, chat_input_id, fragment_id
+
+
+async def bench(port: int, messages: int, page: str, noop: bool) -> list[tuple]:
+    ws = await websocket_connect(f"ws://127.0.0.1:{port}/_stcore/stream", subprotocols = ["streamlit"])
+    query = f"page=chat&id={LISTING_ID}" if page == "chat" else ""
+    _, _, _, chat_input_id, fragment_id = await rerun(ws, query, None, None, None)
+    if chat_input_id is None and not noop:
+        raise SystemExit("no chat input on the chat page")
+    rows = []
+    for i in range(messages):
+        if noop:
+            ms, received, deltas, _, _ = await rerun(ws, query, None, None, None)
+            rows.append((ms, received, deltas, False))
+            continue
+        ms, received, deltas, chat_input_id, fragment_id = await rerun(
+            ws, query, QUESTIONS[i % len(QUESTIONS)], chat_input_id, fragment_id)
+        rows.append((ms, received, deltas, fragment_id is not None))
+    ws.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure the cost of sending a chat message (or of a no-op rerun)")
+    parser.add_argument("--messages", type = int, default = 8)
+    parser.add_argument("--rev", help = "git revision of page_mockup_v3.py to benchmark (default: working tree)")
+    parser.add_argument("--noop", action = "store_true", help = "send reruns that change nothing instead of messages")
+    parser.add_argument("--page", choices = ["chat", "home"], default = "chat")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = APP_PATH
+        if args.rev:
+            app = os.path.join(tmp, "page_mockup_v3.py")
+            with open(app, "wb") as f:
+                f.write(subprocess.run(["git", "show", f"{args.rev}:page_mockup_v3.py"], cwd = HERE,
+                                       capture_output = True, check = True).stdout)
+        port = free_port()
+        env = dict(
+            os.environ,
+            PYTHONPATH = HERE,
+            LISTINGS_PATH = os.path.join(tmp, "listings.sqlite3"),
+            LLM_CACHE_PATH = os.path.join(tmp, "llm_cache.sqlite3"),
+            OUTBOX_PATH = os.path.join(tmp, "outbox.sqlite3"),
+            SHOWINGS_PATH = os.path.join(tmp, "showings.sqlite3"),
+            CONVERSATIONS_PATH = os.path.join(tmp, "conversations.sqlite3"),
+            USAGE_PATH = os.path.join(tmp, "usage.sqlite3"),
+            OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "sk-bench"),
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", app, "--server.headless", "true", "--server.port", str(port),
+             "--browser.gatherUsageStats", "false"],
+            cwd = HERE, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL,
+        )
+        try:
+            wait_for_server(port)
+            rows = IOLoop.current().run_sync(lambda: bench(port, args.messages, args.page, args.noop), timeout = 300)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{'message':>7} | {'wall':>9} {'bytes':>9} {'deltas':>7} | rerun")
+    for i, (ms, received, deltas, scoped) in enumerate(rows, 1):
+        print(f"{i:>7} | {ms:>7.1f}ms {received:>9,} {deltas:>7} | {'fragment' if scoped else 'whole app'}")
+    # The first message is the coldest; report the median of the rest
+    warm = sorted(rows[1:] or rows)
+    mid = warm[len(warm) // 2]
+    print(f"median | {mid[0]:>7.1f}ms {mid[1]:>9,} {mid[2]:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Conversation replay benchmark
+# Replays a corpus of renter conversations (cassettes/bench_corpus.json) through the chat page of
+# page_mockup_v3.py with Streamlit's AppTest, so every turn goes through the real routing, history windowing,
+# generate_reply / classify_showing_confirmation and prompt building. OpenAI is answered from a cassette (see
+# cassettes.py) in sequence mode, so edited prompts still get the recorded responses and the run is
+# deterministic and free. The app's clock is pinned to BENCH_NOW_ISO, so unchanged requests match the
+# cassette exactly on any day.
+# Reports per conversation the OpenAI calls made (by call type), their input tokens (~4 characters per token,
+# the app's own estimate) and wall time, and compares them with a baseline: exits with status 1 when calls or
+# input tokens grow by more than --threshold, or wall time by more than --time-threshold, or a call had no
+# recorded response.
+#
+# Usage: python bench_conversations.py                      replay and compare with the baseline
+#        python bench_conversations.py --update-baseline    replay and save the results as the new baseline
+#        python bench_conversations.py --record [--mock]    re-record the cassette against OpenAI (needs
+#                                                           OPENAI_API_KEY) or against mock_services.py
+# The committed cassette was recorded against mock_services.py, so its replies are the mock's scripted ones: the
+# bench guards the app's own calls, prompts and token counts, not reply quality. Re-record it against OpenAI
+# for real replies.
+
+import argparse
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(HERE, "page_mockup_v3.py")
+CORPUS_PATH = os.path.join(HERE, "cassettes", "bench_corpus.json")
+CASSETTE_FILE = os.path.join(HERE, "cassettes", "bench_conversations.json")
+BASELINE_PATH = os.path.join(HERE, "cassettes", "bench_baseline.json")
+# "Now" for the app during the bench (APP_NOW_ISO), so the dated parts of each request (the classifier's
+# REFERENCE_NOW_ISO, the free showing slots) match the recording on any day
+BENCH_NOW_ISO = "2030-05-10T09:00:00-04:00"
+
+
+# Runs one conversation and waits for each turn's background classifier. Returns its wall time in seconds
+def run_conversation(conversation: dict, timeout: float) -> float:
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout = timeout)
+    at.query_params["page"] = "chat"
+    at.query_params["id"] = conversation["listing_id"]
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"{conversation['name']}: {at.exception[0].message}")
+    future_key = f"chat_history_{conversation['listing_id']}_classifier_future"
+
+    wall = 0.0
+    for message in conversation["messages"]:
+        started = time.perf_counter()
+        at.chat_input[0].set_value(message).run()
+        deadline = time.monotonic() + timeout
+        while at.session_state[future_key] is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+            at.run()
+        wall += time.perf_counter() - started
+        if at.exception:
+            raise RuntimeError(f"{conversation['name']}: {at.exception[0].message}")
+    return wall
+
+
+# Flags every metric that grew past its threshold. Returns the failure messages
+def compare(results: dict, baseline: dict, threshold: float, time_threshold: float) -> list[str]:
+    failures = []
+    for name, result in results.items():
+        if result["misses"]:
+            failures.append(f"{name}: {result['misses']} calls had no recorded response")
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, limit in (("calls", threshold), ("input_tokens", threshold), ("wall_ms", time_threshold)):
+            if result[metric] > base[metric] * (1 + limit):
+                failures.append(f"{name}: {metric} {result[metric]} vs baseline {base[metric]} (+{limit:.0%} allowed)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Replay renter conversations and check calls, tokens and time")
+    parser.add_argument("--record", action = "store_true", help = "record the cassette instead of replaying it")
+    parser.add_argument("--mock", action = "store_true", help = "record against mock_services.py instead of OpenAI")
+    parser.add_argument("--cassette", default = CASSETTE_FILE)
+    parser.add_argument("--corpus", default = CORPUS_PATH)
+    parser.add_argument("--baseline", default = BASELINE_PATH)
+    parser.add_argument("--update-baseline", action = "store_true")
+    parser.add_argument("--threshold", type = float, default = 0.05, help = "allowed growth of calls and input tokens")
+    parser.add_argument("--time-threshold", type = float, default = 1.0, help = "allowed growth of wall time")
+    parser.add_argument("--timeout", type = float, default = 60.0)
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding = "utf-8") as f:
+        corpus = json.load(f)
+
+    # Everything the app writes goes to a scratch directory; nothing is sent anywhere while replaying.
+    # Removed at exit, after the app's stores have flushed into it
+    tmp = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, tmp, True)
+    mock = None
+    os.environ.update(
+        LISTINGS_PATH = os.path.join(tmp, "listings.sqlite3"),
+        LLM_CACHE_PATH = os.path.join(tmp, "llm_cache.sqlite3"),
+        OUTBOX_PATH = os.path.join(tmp, "outbox.sqlite3"),
+        SHOWINGS_PATH = os.path.join(tmp, "showings.sqlite3"),
+        CONVERSATIONS_PATH = os.path.join(tmp, "conversations.sqlite3"),
+        USAGE_PATH = os.path.join(tmp, "usage.sqlite3"),
+        SENDGRID_API_URL = "http://127.0.0.1:9/v3/mail/send",
+        APP_NOW_ISO = BENCH_NOW_ISO,
+        CASSETTE_MODE = "record" if args.record else "replay",
+        CASSETTE_MATCH = "sequence",
+        CASSETTE_PATH = args.cassette,
+    )
+    if args.record and args.mock:
+        from bench_chat_rerun import free_port
+        port = free_port()
+        mock = subprocess.Popen([sys.executable, os.path.join(HERE, "mock_services.py"), "--port", str(port),
+                                 "--latency", "fixed:20", "--token-ms", "0"],
+                                stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        os.environ.update(OPENAI_API_KEY = "sk-mock", OPENAI_BASE_URL = f"http://127.0.0.1:{port}/v1")
+        time.sleep(1)
+    elif not args.record:
+        os.environ.update(OPENAI_API_KEY = "sk-replay", OPENAI_BASE_URL = "http://127.0.0.1:9/v1")
+
+    # Imported after the environment is set, so the app sees the same cassette
+    from cassettes import load_cassette
+    meta = {"recorded_against": "mock_services.py" if args.mock else "openai"} if args.record else None
+    cassette = load_cassette(args.cassette, os.environ["CASSETTE_MODE"], "sequence", meta)
+
+    results = {}
+    try:
+        for conversation in corpus:
+            cassette.begin_scope(conversation["name"])
+            wall = run_conversation(conversation, args.timeout)
+            stats = cassette.stats.get(conversation["name"], {})
+            results[conversation["name"]] = {
+                "turns": len(conversation["messages"]),
+                "calls": stats.get("calls", 0),
+                "input_tokens": stats.get("input_tokens", 0),
+                "wall_ms": round(wall * 1000, 1),
+                "by_call_type": stats.get("by_call_type", {}),
+                "exact": stats.get("exact", 0),
+                "misses": stats.get("misses", 0),
+            }
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+
+    print(f"{'conversation':<22} {'turns':>5} {'calls':>5} {'input tok':>9} {'wall':>9} {'exact':>5}  calls by type")
+    for name, r in results.items():
+        by_type = ", ".join(f"{k} {v}" for k, v in sorted(r["by_call_type"].items()))
+        print(f"{name:<22} {r['turns']:>5} {r['calls']:>5} {r['input_tokens']:>9,} {r['wall_ms']:>7.0f}ms {r['exact']:>5}  {by_type}")
+    total_calls = sum(r["calls"] for r in results.values())
+    total_tokens = sum(r["input_tokens"] for r in results.values())
+    print(f"{'total':<22} {'':>5} {total_calls:>5} {total_tokens:>9,}")
+    print(f"cassette recorded against {cassette.meta.get('recorded_against', '?')} with prompt version "
+          f"{cassette.meta.get('prompt_version', '?')}; "
+          f"{sum(r['exact'] for r in results.values())} of {total_calls} requests matched it exactly")
+
+    if args.record:
+        print(f"recorded {args.cassette}")
+        return
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding = "utf-8") as f:
+            json.dump({name: {k: r[k] for k in ("calls", "input_tokens", "wall_ms")} for name, r in results.items()},
+                      f, indent = 2)
+            f.write("\n")
+        print(f"baseline saved to {args.baseline}")
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding = "utf-8") as f:
+            baseline = json.load(f)
+    failures = compare(results, baseline, args.threshold, args.time_threshold)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
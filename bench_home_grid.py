@@ -0,0 +1,152 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Home grid benchmark
+# Renders the home page of page_mockup_v3.py with 10, 100 and 1000 listings using Streamlit's AppTest
+# and reports render time and the number of Streamlit elements (deltas) sent, next to the old
+# layout (st.columns rows with eight st.markdown calls per card) for the same listings.
+#
+# Usage: python bench_home_grid.py [--sizes 10 100 1000] [--runs 5]
+# Each size runs in its own subprocess with its own temporary listings database.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(HERE, "page_mockup_v3.py")
+
+NEIGHBORHOODS = ["Medford", "South End", "Dedham", "Newton", "Back Bay", "Somerville", "Cambridge", "Allston"]
+
+
+# Generates n valid listings
+def fake_listings(n: int) -> list[dict]:
+    return [
+        {
+            "id": f"bench-{i}",
+            "address": f"{100 + i} Bench St",
+            "neighborhood": NEIGHBORHOODS[i % len(NEIGHBORHOODS)],
+            "rent": 2000 + (i * 37) % 4000,
+            "beds": 1 + i % 4,
+            "baths": 1 + i % 2,
+            "pets": "yes" if i % 3 else "no",
+            "maxtenants": 2 + i % 3,
+            "moveindate": f"{1 + i % 12:02d}-01-2026",
+            "moveincost": 6000 + (i * 53) % 9000,
+            "img": f"https://images.unsplash.com/photo-{i}?q=80&w=1600&auto=format&fit=crop",
+        }
+        for i in range(n)
+    ]
+
+
+# The home page as it was before pagination: two st.columns(3) rows, eight st.markdown calls per card
+def legacy_home(listings_json: str):
+    import json
+    import streamlit as st
+
+    def render_card(l):
+        with st.container(border=False):
+            st.markdown('<div class="card">', unsafe_allow_html=True)
+            st.markdown(f'<img class="thumb" src="{l["img"]}" alt="Listing photo">', unsafe_allow_html=True)
+            st.markdown(f'<div class="addr">📍 {l["address"]}</div>', unsafe_allow_html=True)
+            st.markdown(f'<div class="neigh">{l["neighborhood"]}</div>', unsafe_allow_html=True)
+            st.markdown(f'<div class="price">${l["rent"]:,}/mo</div>', unsafe_allow_html=True)
+            st.markdown('<div class="meta">🛏️ ' + str(l["beds"]) + ' bed &nbsp; • &nbsp; 🛁 ' + str(l["baths"]) + ' bath</div>', unsafe_allow_html=True)
+            st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
+            st.markdown(f'<a class="btn" href="?page=chat&id={l["id"]}" target="_self">Chat about this listing</a>', unsafe_allow_html=True)
+            st.markdown('</div>', unsafe_allow_html=True)
+
+    listings = json.loads(listings_json)
+    # The old layout only had room for six cards; keep filling rows of three so every listing renders
+    for row_start in range(0, len(listings), 3):
+        cols = st.columns(3)
+        for i, l in enumerate(listings[row_start:row_start + 3]):
+            with cols[i]:
+                render_card(l)
+
+
+# Number of elements and blocks in an AppTest tree (each one is a delta sent to the browser)
+def count_deltas(node) -> int:
+    children = getattr(node, "children", None) or {}
+    return 1 + sum(count_deltas(child) for child in children.values())
+
+
+def time_runs(at, runs: int) -> tuple[float, float]:
+    started = time.perf_counter()
+    at.run()
+    cold_ms = (time.perf_counter() - started) * 1000
+    warm = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        at.run()
+        warm.append((time.perf_counter() - started) * 1000)
+    return cold_ms, sorted(warm)[len(warm) // 2]
+
+
+# Runs inside the per-size subprocess and prints one JSON line
+def bench_one(n: int, runs: int):
+    from streamlit.testing.v1 import AppTest
+    from listing_repository import ListingRepository, LISTINGS_PATH
+
+    listings = fake_listings(n)
+    ListingRepository(LISTINGS_PATH).upsert(listings)
+
+    at = AppTest.from_file(APP_PATH, default_timeout = 120)
+    cold_ms, warm_ms = time_runs(at, runs)
+    if at.exception:
+        raise SystemExit(f"App raised: {at.exception[0].message}")
+    deltas = count_deltas(at.main)
+
+    legacy = AppTest.from_function(legacy_home, args = (json.dumps(listings),), default_timeout = 120)
+    legacy_cold_ms, legacy_warm_ms = time_runs(legacy, runs)
+    legacy_deltas = count_deltas(legacy.main)
+
+    print(json.dumps({
+        "listings": n,
+        "paged_cold_ms": round(cold_ms, 1), "paged_warm_ms": round(warm_ms, 1), "paged_deltas": deltas,
+        "legacy_cold_ms": round(legacy_cold_ms, 1), "legacy_warm_ms": round(legacy_warm_ms, 1), "legacy_deltas": legacy_deltas,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the paginated home grid against the old layout")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [10, 100, 1000])
+    parser.add_argument("--runs", type = int, default = 5, help = "warm reruns per measurement (median is reported)")
+    parser.add_argument("--one", type = int, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    if args.one is not None:
+        bench_one(args.one, args.runs)
+        return
+
+    header = f"{'listings':>8} | {'paged cold':>10} {'paged warm':>10} {'deltas':>7} | {'legacy cold':>11} {'legacy warm':>11} {'deltas':>7}"
+    print(header)
+    print("-" * len(header))
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                LISTINGS_PATH = os.path.join(tmp, "listings.sqlite3"),
+                LLM_CACHE_PATH = os.path.join(tmp, "llm_cache.sqlite3"),
+                OUTBOX_PATH = os.path.join(tmp, "outbox.sqlite3"),
+                SHOWINGS_PATH = os.path.join(tmp, "showings.sqlite3"),
+                CONVERSATIONS_PATH = os.path.join(tmp, "conversations.sqlite3"),
+                USAGE_PATH = os.path.join(tmp, "usage.sqlite3"),
+                OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "sk-bench"),
+            )
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--one", str(n), "--runs", str(args.runs)],
+                env = env, capture_output = True, text = True, check = True,
+            ).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            print(f"{r['listings']:>8} | {r['paged_cold_ms']:>8.1f}ms {r['paged_warm_ms']:>8.1f}ms {r['paged_deltas']:>7} | "
+                  f"{r['legacy_cold_ms']:>9.1f}ms {r['legacy_warm_ms']:>9.1f}ms {r['legacy_deltas']:>7}")
+    print("paged = the whole page_mockup_v3.py home page (CSS, sidebar, prompts included); legacy = the old card grid alone")
+
+
+if __name__ == "__main__":
+    main()
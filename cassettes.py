@@ -0,0 +1,243 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# OpenAI cassettes
+# Records chat completion requests and responses to a JSON "cassette" file and plays them back, so prompt and
+# history changes can be checked without calling OpenAI. call_openai sends every request through
+# Cassette.create when CASSETTE_MODE is set:
+#   CASSETTE_MODE=record  calls OpenAI as usual and appends each request and its response
+#   CASSETTE_MODE=replay  never calls OpenAI; answers from the cassette and raises CassetteMiss otherwise
+#   CASSETTE_PATH         the cassette file (default cassettes/default.json)
+#   CASSETTE_MATCH=exact      replay only requests identical to a recorded one (same prompts, same history)
+#   CASSETTE_MATCH=sequence   replay the n-th recorded call of each call type within the current scope, even
+#                             if the request changed. Used to replay a conversation through edited prompts;
+#                             identical requests are still served their own recorded response first
+# Interactions are tagged with the cassette's current scope (e.g. a benchmark conversation name), so sequence
+# matching of one conversation isn't shifted by another. Sequence replay is deterministic for one session at
+# a time only.
+# Responses are stored as whole messages (content, finish reason, usage), streamed or not; a streamed response
+# is replayed as one content chunk plus its finish and usage chunks. Long message texts (the system prompts) are
+# stored once in the file's "texts" table and referenced by hash, and the file is pretty-printed for review.
+# Cassette files carry a format version (CASSETTE_FORMAT) and metadata such as the prompt version they were
+# recorded with; files of another format version are refused.
+# Has no Streamlit dependency; the app and the benchmark share one instance per file via load_cassette.
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "off")
+CASSETTE_PATH = os.environ.get("CASSETTE_PATH", os.path.join("cassettes", "default.json"))
+CASSETTE_MATCH = os.environ.get("CASSETTE_MATCH", "exact")
+CASSETTE_FORMAT = 2
+# Message texts at least this long are stored once in the "texts" table
+shared_text_min_chars = 400
+
+
+class CassetteError(Exception):
+    pass
+
+
+# Raised in replay mode when the cassette has no response for a request
+class CassetteMiss(CassetteError):
+    pass
+
+
+# Hash of the request arguments, independent of key order
+def request_key(request: dict) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys = True, ensure_ascii = False).encode("utf-8")).hexdigest()
+
+
+def text_ref(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+# Whole-message form of a ChatCompletion
+def response_record(resp: ChatCompletion) -> dict:
+    choice = resp.choices[0]
+    return {"id": resp.id, "model": resp.model, "created": resp.created, "content": choice.message.content,
+            "finish_reason": choice.finish_reason,
+            "usage": resp.usage.model_dump(mode = "json", exclude_none = True) if resp.usage else None}
+
+
+def replay_completion(record: dict) -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": record["id"], "object": "chat.completion", "created": record["created"], "model": record["model"],
+        "choices": [{"index": 0, "finish_reason": record["finish_reason"],
+                     "message": {"role": "assistant", "content": record["content"]}}],
+        "usage": record["usage"],
+    })
+
+
+# A streamed response as one content chunk, a finish chunk and (if recorded) a usage chunk
+def replay_chunks(record: dict) -> list[ChatCompletionChunk]:
+    base = {"id": record["id"], "object": "chat.completion.chunk", "created": record["created"], "model": record["model"]}
+    chunks = [
+        {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": record["content"]}, "finish_reason": None}]},
+        {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": record["finish_reason"]}]},
+    ]
+    if record["usage"]:
+        chunks.append({**base, "choices": [], "usage": record["usage"]})
+    return [ChatCompletionChunk.model_validate(chunk) for chunk in chunks]
+
+
+# Same ~4 characters per token estimate the app uses for its budgets
+def estimate_request_tokens(request: dict) -> int:
+    return sum(len(m.get("content") or "") // 4 + 1 + 4 for m in request.get("messages") or [])
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str, match: str = "exact", meta: dict | None = None):
+        if mode not in ("record", "replay"):
+            raise CassetteError(f"unknown cassette mode {mode!r}")
+        if match not in ("exact", "sequence"):
+            raise CassetteError(f"unknown cassette match {match!r}")
+        self.path = path
+        self.mode = mode
+        self.match = match
+        self.lock = threading.Lock()
+        self.scope = ""
+        self.meta = dict(meta or {})
+        self.interactions = []
+        if os.path.exists(path):
+            with open(path, encoding = "utf-8") as f:
+                data = json.load(f)
+            if data.get("format") != CASSETTE_FORMAT:
+                raise CassetteError(f"{path} is cassette format {data.get('format')}, expected {CASSETTE_FORMAT}")
+            self.meta = {**data.get("meta", {}), **self.meta} if mode == "record" else data.get("meta", {})
+            self.interactions = [self.expand(i, data.get("texts", {})) for i in data.get("interactions", [])]
+        elif mode == "replay":
+            raise CassetteError(f"no cassette at {path}")
+        self.used = set()        # indexes of interactions already replayed
+        self.positions = {}      # (scope, call type) -> calls replayed so far in sequence mode
+        self.stats = {}          # scope -> counters, see count()
+
+    # Switches the scope new calls are recorded / replayed under. Resets the scope's sequence position; when
+    # recording, earlier interactions of the scope are dropped so re-recording replaces them
+    def begin_scope(self, scope: str):
+        with self.lock:
+            self.scope = scope
+            if self.mode == "record":
+                self.interactions = [i for i in self.interactions if i["scope"] != scope]
+            self.positions = {key: n for key, n in self.positions.items() if key[0] != scope}
+            self.used = {i for i in self.used if self.interactions[i]["scope"] != scope}
+            self.stats.pop(scope, None)
+
+    def count(self, call_type: str, request: dict, outcome: str):
+        stats = self.stats.setdefault(self.scope, {"calls": 0, "input_tokens": 0, "by_call_type": {}, "exact": 0,
+                                                   "sequence": 0, "reused": 0, "misses": 0, "recorded": 0})
+        stats["calls"] += 1
+        stats["input_tokens"] += estimate_request_tokens(request)
+        stats["by_call_type"][call_type] = stats["by_call_type"].get(call_type, 0) + 1
+        stats[outcome] += 1
+
+    # Stands in for client.chat.completions.create(**request)
+    def create(self, call_type: str, create, request: dict):
+        if self.mode == "replay":
+            record = self.find(call_type, request)["response"]
+            return iter(replay_chunks(record)) if request.get("stream") else replay_completion(record)
+
+        resp = create(**request)
+        if request.get("stream"):
+            return self.record_stream(call_type, request, resp)
+        self.record(call_type, request, response_record(resp))
+        return resp
+
+    # Passes a live stream through and records the whole message once it has been read to the end
+    def record_stream(self, call_type: str, request: dict, stream):
+        record = {"id": None, "model": request.get("model"), "created": 0, "content": "", "finish_reason": None, "usage": None}
+        for chunk in stream:
+            record.update(id = chunk.id, model = chunk.model, created = chunk.created)
+            for choice in chunk.choices:
+                record["content"] += choice.delta.content or ""
+                record["finish_reason"] = choice.finish_reason or record["finish_reason"]
+            if chunk.usage is not None:
+                record["usage"] = chunk.usage.model_dump(mode = "json", exclude_none = True)
+            yield chunk
+        self.record(call_type, request, record)
+
+    def record(self, call_type: str, request: dict, response: dict):
+        with self.lock:
+            self.interactions.append({"scope": self.scope, "call_type": call_type, "key": request_key(request),
+                                      "recorded_at": time.time(), "request": request, "response": response})
+            self.count(call_type, request, "recorded")
+            self.save()
+
+    # Exact match first (oldest unused), then, in sequence mode, the n-th recorded call of this call type in
+    # this scope; past the last one the last is reused
+    def find(self, call_type: str, request: dict) -> dict:
+        key = request_key(request)
+        with self.lock:
+            for i, interaction in enumerate(self.interactions):
+                if interaction["key"] == key and i not in self.used:
+                    self.used.add(i)
+                    self.positions[(self.scope, call_type)] = self.positions.get((self.scope, call_type), 0) + 1
+                    self.count(call_type, request, "exact")
+                    return interaction
+            if self.match == "sequence":
+                same = [i for i, interaction in enumerate(self.interactions)
+                        if interaction["scope"] == self.scope and interaction["call_type"] == call_type]
+                if same:
+                    position = self.positions.get((self.scope, call_type), 0)
+                    self.positions[(self.scope, call_type)] = position + 1
+                    self.count(call_type, request, "sequence" if position < len(same) else "reused")
+                    return self.interactions[same[min(position, len(same) - 1)]]
+            # Identical requests (e.g. a repeated classifier call) replay the last recorded copy
+            for interaction in reversed(self.interactions):
+                if interaction["key"] == key:
+                    self.count(call_type, request, "reused")
+                    return interaction
+            self.count(call_type, request, "misses")
+        raise CassetteMiss(f"no recorded {call_type} response for this request in {self.path} (scope {self.scope!r})")
+
+    # Replaces long message texts with {"text_ref": hash}, collecting them in texts
+    @staticmethod
+    def compact(interaction: dict, texts: dict) -> dict:
+        messages = []
+        for message in interaction["request"].get("messages") or []:
+            content = message.get("content")
+            if isinstance(content, str) and len(content) >= shared_text_min_chars:
+                ref = text_ref(content)
+                texts[ref] = content
+                message = {**{k: v for k, v in message.items() if k != "content"}, "text_ref": ref}
+            messages.append(message)
+        return {**interaction, "request": {**interaction["request"], "messages": messages}}
+
+    @staticmethod
+    def expand(interaction: dict, texts: dict) -> dict:
+        messages = [{**{k: v for k, v in m.items() if k != "text_ref"}, "content": texts[m["text_ref"]]} if "text_ref" in m else m
+                    for m in interaction["request"].get("messages") or []]
+        return {**interaction, "request": {**interaction["request"], "messages": messages}}
+
+    # Write then rename, so an interrupted run never leaves a truncated cassette (caller holds the lock)
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        texts = {}
+        interactions = [self.compact(i, texts) for i in self.interactions]
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding = "utf-8") as f:
+            json.dump({"format": CASSETTE_FORMAT, "meta": self.meta, "texts": texts, "interactions": interactions},
+                      f, ensure_ascii = False, indent = 1)
+            f.write("\n")
+        os.replace(tmp, self.path)
+
+
+loaded = {}
+loaded_lock = threading.Lock()
+
+
+# One Cassette per (path, mode, match) in the process. None when mode is "off"
+def load_cassette(path: str = CASSETTE_PATH, mode: str = CASSETTE_MODE, match: str = CASSETTE_MATCH,
+                  meta: dict | None = None) -> Cassette | None:
+    if mode in ("", "off"):
+        return None
+    with loaded_lock:
+        key = (os.path.abspath(path), mode, match)
+        if key not in loaded:
+            loaded[key] = Cassette(path, mode, match, meta)
+        elif meta and mode == "record":
+            loaded[key].meta.update(meta)
+        return loaded[key]
@@ -0,0 +1,261 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Local chat rules
+# Checks the chat page runs on renter messages before (or instead of) calling OpenAI:
+#   pre-gate       skip the showing classifier until an email and a date/time have appeared in the conversation
+#   router         answer a single listing-fact question (pets, move-in cost / date, max tenants) from the listing
+#   qualification  track occupants / pets / move in date from renter messages and check them against the listing
+# Plain functions over messages and listing dicts, with no Streamlit or OpenAI dependency, so they can be tested
+# on their own (tests/).
+
+import re
+from datetime import date, datetime
+
+# Patterns for the local pre-gate. Deliberately loose: a false match only costs one classifier call,
+# a missed match would block a real confirmation
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+TIME_RE = re.compile(
+    r"\b\d{1,2}(:\d{2})?\s*(am|pm|a\.m\.|p\.m\.)"                      # 3pm, 10:30 AM
+    r"|\b\d{1,2}:\d{2}\b"                                                 # 14:00
+    r"|\bat\s+\d{1,2}\b"                                                 # at 3
+    r"|\b(noon|midnight|tonight|today|tomorrow|weekend|next week)\b"
+    r"|\b(mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun)(day|nesday|rsday|urday|sday)?\b"
+    r"|\b(jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?\s+\d{1,2}"
+    r"|\b\d{1,2}/\d{1,2}\b",                                            # 11/4
+    re.IGNORECASE,
+)
+
+# Checks locally whether the conversation could possibly be a confirmed showing yet
+def pregate_confirmation(history: list[dict], scan_state: dict, default: dict) -> dict | None:
+    """
+    Scans only the messages added since the last call (scan_state is kept per chat and updated in place).
+    Returns a not_ready result in the shape of `default` (the app's DEFAULT_CONFIRMATION) when the renter
+    has not given an email or no date/time has been mentioned, so the LLM classifier can be skipped.
+    Returns None otherwise.
+    """
+    for msg in history[scan_state.get("scanned", 0):]:
+        content = msg.get("content") or ""
+        # The email has to come from the renter; a time can be proposed by either side
+        if msg.get("role") == "user" and EMAIL_RE.search(content):
+            scan_state["has_email"] = True
+        if TIME_RE.search(content):
+            scan_state["has_time"] = True
+    scan_state["scanned"] = len(history)
+
+    if scan_state.get("has_email") and scan_state.get("has_time"):
+        return None
+
+    missing = [name for name, flag in (("email address", scan_state.get("has_email")), ("date/time", scan_state.get("has_time"))) if not flag]
+    out = dict(default)
+    out["status"] = "not_ready"
+    out["notes"] = "local_pregate"
+    out["confidence"] = 1.0
+    out["reason"] = f"No {' or '.join(missing)} in the conversation yet."
+    return out
+
+# Local intent router for simple listing-fact questions. Each intent is a list of (pattern, weight);
+# a message's score for an intent is the sum of the weights that match, capped at 1.0
+LISTING_INTENTS = {
+    "pets": [
+        (re.compile(r"\bpets?\b|\bpet[- ]friendly\b"), 0.7),
+        (re.compile(r"\b(dogs?|cats?|puppy|kitten|animals?)\b"), 0.6),
+        (re.compile(r"\b(allow|allowed|ok|okay|policy)\b"), 0.3),
+    ],
+    "moveincost": [
+        (re.compile(r"\bmove[- ]?in (cost|costs|fee|fees)\b|\bdue at (move[- ]?in|signing)\b|\bupfront\b"), 0.8),
+        (re.compile(r"\b(deposit|first and last|broker fee|how much)\b"), 0.5),
+        (re.compile(r"\b(cost|costs|pay|owe|due|cash|total)\b"), 0.3),
+    ],
+    "moveindate": [
+        (re.compile(r"\bmove[- ]?in date\b|\bavailable (from|starting)\b|\bstart date\b"), 0.8),
+        (re.compile(r"\bwhen\b.*\b(move|available|start|lease)\b|\bavailability date\b"), 0.6),
+        (re.compile(r"\b(move[- ]?in|available)\b"), 0.2),
+    ],
+    "maxtenants": [
+        (re.compile(r"\bhow many (people|tenants|occupants|roommates|persons)\b|\bmax(imum)? (occupancy|tenants|occupants)\b"), 0.8),
+        (re.compile(r"\b(occupants|tenants|roommates|people)\b"), 0.4),
+        (re.compile(r"\b(live|living|stay|allowed)\b"), 0.3),
+    ],
+}
+# Minimum score to answer locally, and the score at which a second intent makes the message "multi-intent"
+intent_confidence_threshold = 0.8
+intent_secondary_threshold = 0.4
+# Longer messages usually carry more than a single fact question
+intent_max_words = 15
+# A negation before the intent's keyword ("I don't have pets, is that okay?") is a statement, not the question
+NEGATION_RE = re.compile(r"\b(no|not|never|without|none|don'?t|doesn'?t|didn'?t|isn'?t|aren'?t|won'?t|can'?t|wouldn'?t)\b|n't\b")
+
+# Scores each listing-fact intent for a message
+def score_listing_intents(message: str) -> dict[str, float]:
+    text = message.lower()
+    return {
+        intent: min(1.0, sum(weight for pattern, weight in patterns if pattern.search(text)))
+        for intent, patterns in LISTING_INTENTS.items()
+    }
+
+# True if a negation appears before the first keyword of the intent
+def intent_is_negated(message: str, intent: str) -> bool:
+    text = message.lower()
+    starts = [m.start() for pattern, _ in LISTING_INTENTS[intent] if (m := pattern.search(text))]
+    return bool(starts) and NEGATION_RE.search(text, 0, min(starts)) is not None
+
+# Listings store pets as "yes"/"no"
+def listing_allows_pets(listing: dict) -> bool:
+    return str(listing["pets"]).strip().lower() in ("yes", "true", "y")
+
+# Formats the listing's MM-DD-YYYY move in date for a chat reply
+def format_move_in_date(value: str) -> str:
+    try:
+        dt = datetime.strptime(value, "%m-%d-%Y")
+        return f"{dt:%B} {dt.day}, {dt.year}"
+    except (TypeError, ValueError):
+        return str(value)
+
+# Answers a single listing-fact question from the listing dict, or returns None to let the LLM reply
+def route_listing_question(user_message: str, listing: dict) -> str | None:
+    """
+    Only confident, single-intent, short questions are answered here. Anything mentioning an email
+    or a time goes to the LLM so scheduling is never handled by a template, and so does a negated
+    intent, which is usually the renter stating a fact rather than asking.
+    """
+    if len(user_message.split()) > intent_max_words or EMAIL_RE.search(user_message) or TIME_RE.search(user_message):
+        return None
+
+    scores = score_listing_intents(user_message)
+    ranked = sorted(scores.items(), key = lambda kv: kv[1], reverse = True)
+    (intent, score), (_, runner_up) = ranked[0], ranked[1]
+    if score < intent_confidence_threshold or runner_up >= intent_secondary_threshold:
+        return None
+    if intent_is_negated(user_message, intent):
+        return None
+
+    if intent == "pets":
+        if listing_allows_pets(listing):
+            return (f"Yes, pets are allowed at {listing['address']}. "
+                    "How many people would be moving in, and when would you like to come see it?")
+        return (f"Unfortunately {listing['address']} doesn't allow pets. "
+                "If that still works for you, how many people would be moving in?")
+    if intent == "moveincost":
+        return (f"The total due at move-in is ${listing['moveincost']:,}. "
+                "When are you hoping to move, and how many people would be living there?")
+    if intent == "moveindate":
+        return (f"The unit is available for move-in on {format_move_in_date(listing['moveindate'])}. "
+                "Does that timing work for you? If so, when would be a good time for a showing?")
+    if intent == "maxtenants":
+        return (f"Up to {listing['maxtenants']} people can live there. "
+                "How many would be moving in, and do you have any pets?")
+    return None
+
+# Lead qualification. A per-chat state dict is updated from each new renter message by a local extractor
+# and checked against the listing, instead of leaving the model to re-infer it from the whole transcript
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8}
+MONTHS = {m: i for i, m in enumerate(["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start = 1)}
+
+SOLO_RE = re.compile(r"\b(just|only) (me|myself)\b|\bit'?s just me\b|\bby myself\b|\bliving alone\b")
+COUPLE_RE = re.compile(r"\b(me|myself|i) and my (partner|wife|husband|girlfriend|boyfriend|fiance|fiancee|spouse|roommate|friend|sister|brother|son|daughter)\b")
+COUNT_RE = re.compile(r"\b(\d{1,2}|one|two|three|four|five|six|seven|eight) (people|persons|adults|tenants|occupants|of us)\b|\bfamily of (\d{1,2}|one|two|three|four|five|six|seven|eight)\b")
+PLUS_OTHERS_RE = re.compile(r"\b(me|myself|i) (and|plus|with) (\d{1,2}|one|two|three|four|five|six|seven) (roommates|friends|others|kids|children)\b")
+NO_PETS_RE = re.compile(r"\bno (pets?|dogs?|cats?|animals)\b|\b(don'?t|do not|dont) have (a |any )?(pets?|dogs?|cats?|animals)\b|\bpet[- ]free\b")
+# "a cat allergy" / "my dog allergy" isn't owning a pet
+HAS_PETS_RE = re.compile(r"\b(i|we) (have|own) (a |an |two |2 |one |1 |some )?(small |big |large |little |old )?(pets?|dogs?|cats?|puppy|kitten)\b(?!\s+allerg)|\b(my|our) (dogs?|cats?|pets?|puppy|kitten)\b(?!\s+allerg)")
+QUESTION_START_RE = re.compile(r"^\W*(can|could|would|will|is|are|do|does|how|what if|any chance)\b")
+MOVE_DATE_RE = re.compile(r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? (\d{1,2})(st|nd|rd|th)?\b")
+MOVE_CONTEXT_RE = re.compile(r"\b(move|moving|move-in|start|lease)\b")
+
+# Moving in more than this many days before the listing's move in date is flagged (not a hard decline)
+move_in_tolerance_days = 30
+
+def parse_count(token: str) -> int:
+    return int(token) if token.isdigit() else NUMBER_WORDS[token]
+
+def new_qualification_state() -> dict:
+    return {"scanned": 0, "occupants": None, "occupants_asked": None, "has_pets": None, "move_in": None}
+
+# True if the clause around text[pos] is a question ("can 5 people live there?") rather than a statement
+def in_question(text: str, pos: int) -> bool:
+    start = max(text.rfind(c, 0, pos) for c in ".,;!?\n") + 1
+    ends = [i for i in (text.find(c, pos) for c in ".,;!?\n") if i != -1]
+    end = min(ends) if ends else len(text)
+    return (end < len(text) and text[end] == "?") or bool(QUESTION_START_RE.search(text[start:end]))
+
+# Pulls occupants / pets / move in date out of a single renter message; a month and day without a year is the
+# next one on or after today
+def extract_qualification_facts(message: str, today: date) -> dict:
+    text = message.lower()
+    facts = {}
+
+    if m := PLUS_OTHERS_RE.search(text):
+        facts["occupants"] = parse_count(m.group(3)) + 1
+    elif m := COUNT_RE.search(text):
+        # "Can 5 people live there?" asks about a household size without stating it
+        facts["occupants_asked" if in_question(text, m.start()) else "occupants"] = parse_count(m.group(1) or m.group(3))
+    elif COUPLE_RE.search(text):
+        facts["occupants"] = 2
+    elif SOLO_RE.search(text):
+        facts["occupants"] = 1
+
+    # Negatives first so "we don't have a dog" isn't read as owning one
+    if NO_PETS_RE.search(text):
+        facts["has_pets"] = False
+    elif HAS_PETS_RE.search(text):
+        facts["has_pets"] = True
+
+    if MOVE_CONTEXT_RE.search(text) and (m := MOVE_DATE_RE.search(text)):
+        try:
+            move_in = date(today.year, MONTHS[m.group(1)], int(m.group(2)))
+            if move_in < today:
+                move_in = move_in.replace(year = today.year + 1)
+            facts["move_in"] = move_in.isoformat()
+        except ValueError:
+            pass
+
+    return facts
+
+# Applies new renter messages to the per-chat qualification state (updated in place; later answers win)
+def update_qualification(state: dict, history: list[dict], today: date) -> dict:
+    for msg in history[state.get("scanned", 0):]:
+        if msg.get("role") == "user":
+            state.update(extract_qualification_facts(msg.get("content") or "", today))
+    state["scanned"] = len(history)
+    return state
+
+# Checks the known facts against the listing. Returns (hard failures, soft concerns) as short strings
+def check_qualification(state: dict, listing: dict) -> tuple[list[str], list[str]]:
+    failures, concerns = [], []
+    if state.get("occupants") is not None and state["occupants"] > int(listing["maxtenants"]):
+        failures.append(f"allows at most {listing['maxtenants']} tenants, so it wouldn't work for a household of {state['occupants']}")
+    elif state.get("occupants") is None and (state.get("occupants_asked") or 0) > int(listing["maxtenants"]):
+        # Only asked, so the model answers it rather than a local decline
+        concerns.append(f"renter asked whether {state['occupants_asked']} people could live there; the listing allows at most {listing['maxtenants']}")
+    # Pets only come from a regex, so a mismatch goes to the model as a fact instead of a local decline
+    if state.get("has_pets") and not listing_allows_pets(listing):
+        concerns.append("renter seems to have pets but the listing doesn't allow them; confirm before declining")
+    if state.get("move_in"):
+        try:
+            available = datetime.strptime(listing["moveindate"], "%m-%d-%Y").date()
+            if (available - date.fromisoformat(state["move_in"])).days > move_in_tolerance_days:
+                concerns.append(f"renter wants to move in {state['move_in']} but the unit is available {format_move_in_date(listing['moveindate'])}")
+        except (TypeError, ValueError):
+            pass
+    return failures, concerns
+
+# Compact "known facts" block added to the reply prompt
+def qualification_facts_for_llm(state: dict, listing: dict) -> str:
+    _, concerns = check_qualification(state, listing)
+    pets = {True: "has pets", False: "no pets", None: "unknown"}[state.get("has_pets")]
+    lines = [
+        "Known facts about this renter (from their messages, do not ask again):",
+        f" - occupants: {state.get('occupants') or 'unknown'} (max allowed {listing['maxtenants']})",
+        f" - pets: {pets}",
+        f" - desired move in date: {state.get('move_in') or 'unknown'}",
+    ]
+    lines += [f" - concern: {c}" for c in concerns]
+    return "\n".join(lines)
+
+# Polite local decline when a hard requirement clearly fails, or None if the lead is still qualified
+def qualification_decline(state: dict, listing: dict) -> str | None:
+    failures, _ = check_qualification(state, listing)
+    if not failures:
+        return None
+    return (f"Thanks for letting me know. Unfortunately {listing['address']} {' and '.join(failures)}. "
+            "I'd be happy to point you toward other listings that could be a better fit, just let me know!")
@@ -0,0 +1,206 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Conversation store
+# Append-only SQLite store for chat conversations (messages plus a small JSON state: classifier result,
+# invite flags), shared by every Streamlit session in the process.
+# Writes are write-behind: append() and save_state() update the in-memory conversation right away and queue the
+# row; a background thread writes queued rows in one transaction every flush_interval seconds (or sooner when
+# flush_batch_size rows are waiting), so a chat turn never waits on disk.
+# Conversations stay in memory while in use. Ones idle for idle_eviction_seconds, or beyond
+# max_loaded_conversations (least recently used first), are dropped from the store's cache once flushed and
+# reloaded from disk the next time they are opened. A conversation a session still holds is never loaded a
+# second time: open() hands back the same object, so its message seq numbers stay in step with the disk.
+# Has no Streamlit dependency; the app shares one instance via st.cache_resource.
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+CONVERSATIONS_PATH = os.environ.get("CONVERSATIONS_PATH", ".conversations.sqlite3")
+
+flush_interval = 0.5               # seconds between background flushes
+flush_batch_size = 500             # flush early once this many rows are queued
+max_loaded_conversations = 1000    # conversations kept in memory at most
+idle_eviction_seconds = 30 * 60    # conversations untouched this long are dropped from memory
+
+
+class Conversation:
+    def __init__(self, conversation_id: str, listing_id: str, messages: list[dict], state: dict):
+        self.id = conversation_id
+        self.listing_id = listing_id
+        self.messages = messages
+        self.state = state
+        self.touched = time.monotonic()
+
+
+class ConversationStore:
+    def __init__(self, path: str = CONVERSATIONS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.loaded = OrderedDict()     # conversation id -> Conversation, least recently used first
+        self.live = weakref.WeakValueDictionary()   # conversation id -> Conversation, while anything references it
+        self.new = {}                   # conversation id -> (listing id, created at) not yet written
+        self.messages = []              # (conversation id, seq, role, content, created at) not yet written
+        self.states = {}                # conversation id -> state JSON not yet written
+        self.flushing = set()           # conversation ids with rows being written right now
+        self.wake = threading.Event()
+        self.stats = {"flushes": 0, "rows_written": 0, "loads": 0, "evictions": 0}
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "id TEXT PRIMARY KEY, listing_id TEXT NOT NULL, created_at REAL NOT NULL, "
+                "state TEXT NOT NULL DEFAULT '{}', updated_at REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+                "created_at REAL NOT NULL, PRIMARY KEY (conversation_id, seq))"
+            )
+        threading.Thread(target = self.run, name = "conversation-flusher", daemon = True).start()
+        atexit.register(self.flush)
+
+    # Commits (or rolls back) and closes; sqlite3's own context manager only commits, leaving the connection open
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout = 30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    # Puts a conversation (back) in the cache as most recently used (caller holds the lock)
+    def keep(self, conversation: Conversation):
+        self.loaded[conversation.id] = conversation
+        self.loaded.move_to_end(conversation.id)
+        self.live[conversation.id] = conversation
+
+    # Starts a new conversation for a listing with the given opening messages
+    def create(self, listing_id: str, messages: list[dict] | None = None) -> Conversation:
+        conversation = Conversation(uuid.uuid4().hex, listing_id, [], {})
+        with self.lock:
+            self.new[conversation.id] = (listing_id, time.time())
+            self.keep(conversation)
+        for message in messages or []:
+            self.append(conversation, message)
+        return conversation
+
+    # Returns the conversation from memory, or loads it from disk. None if it doesn't exist or belongs to
+    # another listing
+    def open(self, conversation_id: str, listing_id: str) -> Conversation | None:
+        with self.lock:
+            # Evicted conversations that a session still holds come back as the same object
+            conversation = self.loaded.get(conversation_id) or self.live.get(conversation_id)
+            if conversation is not None:
+                if conversation.listing_id != listing_id:
+                    return None
+                self.keep(conversation)
+                conversation.touched = time.monotonic()
+                return conversation
+
+        with self.connect() as db:
+            row = db.execute("SELECT listing_id, state FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+            if row is None or row[0] != listing_id:
+                return None
+            messages = [
+                {"role": role, "content": content}
+                for role, content in db.execute(
+                    "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY seq", (conversation_id,))
+            ]
+
+        with self.lock:
+            # Another session may have loaded it meanwhile; keep a single copy
+            conversation = (self.loaded.get(conversation_id) or self.live.get(conversation_id)
+                            or Conversation(conversation_id, listing_id, messages, json.loads(row[1])))
+            self.keep(conversation)
+            self.stats["loads"] += 1
+        self.evict()
+        return conversation
+
+    def append(self, conversation: Conversation, message: dict):
+        with self.lock:
+            seq = len(conversation.messages)
+            conversation.messages.append({"role": message["role"], "content": message["content"]})
+            conversation.touched = time.monotonic()
+            if conversation.id in self.loaded:
+                self.loaded.move_to_end(conversation.id)
+            self.messages.append((conversation.id, seq, message["role"], message["content"], time.time()))
+            pending = len(self.messages)
+        if pending >= flush_batch_size:
+            self.wake.set()
+
+    # Replaces the conversation's state; only queues a write when it actually changed
+    def save_state(self, conversation: Conversation, state: dict):
+        if state == conversation.state:
+            return
+        with self.lock:
+            conversation.state = dict(state)
+            self.states[conversation.id] = json.dumps(state, ensure_ascii = False)
+
+    # Writes everything queued so far in one transaction
+    def flush(self):
+        with self.lock:
+            new, messages, states = self.new, self.messages, self.states
+            self.new, self.messages, self.states = {}, [], {}
+            self.flushing = set(new) | set(states) | {m[0] for m in messages}
+        if not (new or messages or states):
+            return
+        now = time.time()
+        try:
+            with self.connect() as db:
+                db.executemany(
+                    "INSERT OR IGNORE INTO conversations (id, listing_id, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                    [(cid, listing_id, created, created) for cid, (listing_id, created) in new.items()],
+                )
+                db.executemany("INSERT OR IGNORE INTO messages (conversation_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)", messages)
+                db.executemany("UPDATE conversations SET state = ?, updated_at = ? WHERE id = ?",
+                               [(state, now, cid) for cid, state in states.items()])
+        except sqlite3.Error:
+            # Put the rows back so the next flush retries them (newer state wins over the one that failed)
+            with self.lock:
+                self.new = {**new, **self.new}
+                self.messages = messages + self.messages
+                self.states = {**states, **self.states}
+                self.flushing = set()
+            raise
+        with self.lock:
+            self.flushing = set()
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += len(new) + len(messages) + len(states)
+
+    # Drops idle / least recently used conversations from the cache; ones with unwritten rows are kept.
+    # Sessions still holding one keep it alive (see self.live), so it is never loaded twice
+    def evict(self):
+        now = time.monotonic()
+        with self.lock:
+            dirty = set(self.new) | set(self.states) | {m[0] for m in self.messages} | self.flushing
+            for conversation_id in list(self.loaded):
+                conversation = self.loaded[conversation_id]
+                over_limit = len(self.loaded) > max_loaded_conversations
+                if not over_limit and now - conversation.touched < idle_eviction_seconds:
+                    break
+                if conversation_id not in dirty:
+                    del self.loaded[conversation_id]
+                    self.stats["evictions"] += 1
+
+    def run(self):
+        while True:
+            self.wake.wait(flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                time.sleep(flush_interval)
+            self.evict()
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {**self.stats, "loaded": len(self.loaded), "pending": len(self.new) + len(self.messages) + len(self.states)}
@@ -0,0 +1,138 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Invite outbox
+# Durable outbox for calendar invites. The chat page only enqueues; worker threads build the ICS and send it
+# through the deliver(payload) function they were given, which raises on failure. A failed send is retried with
+# exponential backoff until outbox_max_attempts, then left as "dead" for the page to report.
+# Has no Streamlit dependency; the app shares one instance via st.cache_resource.
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", ".invite_outbox.sqlite3")
+outbox_workers = 2
+outbox_max_attempts = 5        # after this many failed sends the invite is moved to "dead"
+outbox_retry_base = 5.0        # seconds before the first retry, doubled (with jitter) on each attempt
+outbox_poll_interval = 1.0     # seconds an idle worker waits before checking for due invites again
+
+
+# Idempotency key for an invite: the same listing, email and start time always map to the same row,
+# so duplicate tabs or reruns can't send twice
+def invite_idempotency_key(listing_id: str, user_email: str, start_time_iso: str) -> str:
+    start = datetime.fromisoformat(start_time_iso).astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    raw = f"{listing_id}|{user_email.strip().lower()}|{start}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+# SQLite (WAL mode) outbox table drained by a small pool of worker threads.
+# Rows go pending -> sending -> sent, or back to pending with a backoff, or to dead after outbox_max_attempts
+class InviteOutbox:
+    def __init__(self, path: str, deliver, workers: int):
+        self.path = path
+        self.deliver = deliver
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS invite_outbox ("
+                "idempotency_key TEXT PRIMARY KEY, payload TEXT NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, last_error TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS invite_outbox_due ON invite_outbox (status, next_attempt_at)")
+            # Invites that were mid-send when the process died are retried
+            db.execute("UPDATE invite_outbox SET status = 'pending' WHERE status = 'sending'")
+        for i in range(workers):
+            threading.Thread(target = self.work, name = f"invite-outbox-{i}", daemon = True).start()
+
+    # Commits (or rolls back) and closes; sqlite3's own context manager only commits, leaving the connection open
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout = 30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    # Queues an invite. Returns False if an invite with this key already exists (nothing is queued twice)
+    def enqueue(self, idempotency_key: str, payload: dict) -> bool:
+        now = time.time()
+        with self.connect() as db:
+            cur = db.execute(
+                "INSERT OR IGNORE INTO invite_outbox (idempotency_key, payload, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, 'pending', ?, ?, ?)",
+                (idempotency_key, json.dumps(payload), now, now, now),
+            )
+        self.wakeup.set()
+        return cur.rowcount == 1
+
+    def status(self, idempotency_key: str) -> dict | None:
+        with self.connect() as db:
+            row = db.execute(
+                "SELECT status, attempts, last_error FROM invite_outbox WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+        return {"status": row[0], "attempts": row[1], "last_error": row[2]} if row else None
+
+    # Takes the oldest due pending invite and marks it as sending
+    def claim(self) -> tuple[str, dict] | None:
+        with self.lock, self.connect() as db:
+            row = db.execute(
+                "SELECT idempotency_key, payload FROM invite_outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT 1",
+                (time.time(),),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE invite_outbox SET status = 'sending', updated_at = ? WHERE idempotency_key = ?", (time.time(), row[0])
+            )
+        return row[0], json.loads(row[1])
+
+    def mark_sent(self, idempotency_key: str):
+        with self.connect() as db:
+            db.execute(
+                "UPDATE invite_outbox SET status = 'sent', attempts = attempts + 1, last_error = NULL, updated_at = ? "
+                "WHERE idempotency_key = ?",
+                (time.time(), idempotency_key),
+            )
+
+    def mark_failed(self, idempotency_key: str, error: str):
+        now = time.time()
+        with self.connect() as db:
+            attempts = db.execute(
+                "SELECT attempts FROM invite_outbox WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()[0] + 1
+            status = "dead" if attempts >= outbox_max_attempts else "pending"
+            delay = outbox_retry_base * (2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+            db.execute(
+                "UPDATE invite_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+                "WHERE idempotency_key = ?",
+                (status, attempts, now + delay, error, now, idempotency_key),
+            )
+
+    # Worker loop: send due invites until none are left, then sleep until woken or the poll interval passes
+    def work(self):
+        while True:
+            try:
+                claimed = self.claim()
+            except sqlite3.Error:
+                claimed = None
+            if claimed is None:
+                self.wakeup.wait(outbox_poll_interval)
+                self.wakeup.clear()
+                continue
+            idempotency_key, payload = claimed
+            try:
+                self.deliver(payload)
+                self.mark_sent(idempotency_key)
+            except Exception as e:
+                self.mark_failed(idempotency_key, f"{type(e).__name__}: {str(e)[:300]}")
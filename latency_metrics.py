@@ -0,0 +1,200 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Latency metrics
+# Span timings for the stages of a chat turn (reply, classifier, ICS, send) and for Streamlit reruns, kept as
+# in-process histograms per stage and listing.
+# Code wraps a stage in `with latency.span("stage", listing_id):` (or reports a duration it measured itself with
+# observe()). A span cut short by a BaseException that isn't an error (Streamlit's rerun / stop signals) is
+# not recorded, unless finish_open_spans() recorded it just before, as the app does right before st.rerun(). Each finished span goes into a Prometheus-style histogram (cumulative buckets, sum, count) and a
+# rolling window of raw samples that the sidebar turns into p50 / p95 / p99.
+# Export, both optional:
+#   METRICS_PORT=9464       serves the histograms in Prometheus text format at http://host:9464/metrics
+#   METRICS_FILE=path.prom  rewrites that text to a file every metrics_flush_interval seconds
+#                           (e.g. for node_exporter's textfile collector)
+# Has no Streamlit dependency; the app keeps one instance per process since this module is only imported once.
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = os.environ.get("METRICS_PORT")
+METRICS_FILE = os.environ.get("METRICS_FILE")
+
+metrics_flush_interval = 15.0   # seconds between rewrites of METRICS_FILE
+# Bucket upper bounds in seconds: Streamlit reruns land in the first few, OpenAI calls and sends in the rest
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+
+def label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+# A span in progress; recorded once, by finish() or when its block ends
+class SpanTimer:
+    def __init__(self, metrics, stage: str, listing: str | None):
+        self.metrics = metrics
+        self.stage = stage
+        self.listing = listing
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def finish(self, error: bool = False):
+        if not self.finished:
+            self.finished = True
+            self.metrics.observe(self.stage, time.perf_counter() - self.started, self.listing, error)
+
+
+# Spans open in the current thread / context, innermost last
+open_spans = contextvars.ContextVar("open_spans", default = ())
+
+
+class LatencyMetrics:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS, window: int = 500):
+        self.buckets = buckets
+        self.window = window
+        self.lock = threading.Lock()
+        self.histograms = {}   # (stage, listing) -> Histogram
+        self.recent = {}       # (stage, listing) and (stage, None) -> deque of the latest durations in seconds
+
+    # Records one finished span. listing is "" for work that isn't tied to a listing
+    def observe(self, stage: str, seconds: float, listing: str | None = "", error: bool = False):
+        listing = listing or ""
+        slot = 0
+        while slot < len(self.buckets) and seconds > self.buckets[slot]:
+            slot += 1
+        with self.lock:
+            histogram = self.histograms.get((stage, listing))
+            if histogram is None:
+                histogram = self.histograms[(stage, listing)] = Histogram(self.buckets)
+            histogram.counts[slot] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+            histogram.errors += error
+            for key in ((stage, listing), (stage, None)):
+                samples = self.recent.get(key)
+                if samples is None:
+                    samples = self.recent[key] = deque(maxlen = self.window)
+                samples.append(seconds)
+
+    # Times the block as one span of this stage. An exception counts as an error and is re-raised. Other
+    # BaseExceptions (Streamlit's rerun / stop signals) leave the span unrecorded unless it was finished first
+    @contextmanager
+    def span(self, stage: str, listing: str | None = ""):
+        timer = SpanTimer(self, stage, listing)
+        token = open_spans.set(open_spans.get() + (timer,))
+        try:
+            yield timer
+        except Exception:
+            timer.finish(error = True)
+            raise
+        except BaseException:
+            raise
+        else:
+            timer.finish()
+        finally:
+            open_spans.reset(token)
+
+    # Records every span open in this context as finished now, e.g. right before st.rerun() ends them early
+    def finish_open_spans(self):
+        for timer in open_spans.get():
+            timer.finish()
+
+    # p50 / p95 / p99 (ms) per stage over the rolling window, all listings together or for one listing
+    def percentiles(self, listing: str | None = None) -> list[dict]:
+        with self.lock:
+            windows = {stage: sorted(samples) for (stage, key), samples in self.recent.items() if key == listing}
+            totals = {}
+            for (stage, key), histogram in self.histograms.items():
+                if listing is None or key == listing:
+                    count, errors = totals.get(stage, (0, 0))
+                    totals[stage] = (count + histogram.count, errors + histogram.errors)
+        out = []
+        for stage in sorted(windows):
+            values = windows[stage]
+            at = lambda q: round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 1)
+            count, errors = totals.get(stage, (len(values), 0))
+            out.append({"stage": stage, "count": count, "errors": errors,
+                        "p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99)})
+        return out
+
+    # All histograms in the Prometheus text exposition format
+    def render_prometheus(self) -> str:
+        with self.lock:
+            rows = sorted((key, list(h.counts), h.sum, h.count, h.errors) for key, h in self.histograms.items())
+        lines = [
+            "# HELP chat_stage_latency_seconds Time spent in each stage of a chat turn, and in Streamlit reruns.",
+            "# TYPE chat_stage_latency_seconds histogram",
+        ]
+        for (stage, listing), counts, total, count, _ in rows:
+            labels = f'stage="{label_value(stage)}",listing="{label_value(listing)}"'
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'chat_stage_latency_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"chat_stage_latency_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"chat_stage_latency_seconds_count{{{labels}}} {count}")
+        lines += [
+            "# HELP chat_stage_errors_total Spans of each stage that ended with an exception.",
+            "# TYPE chat_stage_errors_total counter",
+        ]
+        for (stage, listing), _, _, _, errors in rows:
+            lines.append(f'chat_stage_errors_total{{stage="{label_value(stage)}",listing="{label_value(listing)}"}} {errors}')
+        return "\n".join(lines) + "\n"
+
+    # Write then rename, so a scraper never reads a half-written file
+    def write_file(self, path: str):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding = "utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp, path)
+
+    def flush_forever(self, path: str):
+        while True:
+            time.sleep(metrics_flush_interval)
+            try:
+                self.write_file(path)
+            except OSError:
+                pass
+
+    # Starts a /metrics HTTP endpoint and / or the file flusher on daemon threads
+    def start_exporters(self, port: str | int | None = METRICS_PORT, path: str | None = METRICS_FILE):
+        if port:
+            metrics = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = metrics.render_prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            server = ThreadingHTTPServer(("0.0.0.0", int(port)), MetricsHandler)
+            threading.Thread(target = server.serve_forever, name = "metrics-http", daemon = True).start()
+        if path:
+            threading.Thread(target = self.flush_forever, args = (path,), name = "metrics-file", daemon = True).start()
+
+
+latency = LatencyMetrics()
+if METRICS_PORT or METRICS_FILE:
+    latency.start_exporters()
@@ -0,0 +1,196 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Listing repository
+# SQLite-backed store for rental listings, shared by every Streamlit session in the process.
+# Lookups by id are O(1) from an in-memory index, and neighborhood / rent / beds have SQL indexes.
+# Every write bumps a version number; the in-memory cache reloads whenever the version changes.
+# Has no Streamlit dependency so scripts can use it too; the app shares one instance via st.cache_resource.
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+LISTINGS_PATH = os.environ.get("LISTINGS_PATH", ".listings.sqlite3")
+
+# How often (seconds) reads check the database for writes made by other processes. Writes through this
+# repository are seen immediately; the check costs a SQLite connection, so it isn't done on every read
+version_check_interval = 1.0
+
+# Column order for the listings table (also the order fields are validated in)
+LISTING_FIELDS = ["id", "address", "neighborhood", "rent", "beds", "baths", "pets", "maxtenants", "moveindate", "moveincost", "img", "agent"]
+OPTIONAL_FIELDS = {"img", "agent"}
+
+MOVEINDATE_RE = re.compile(r"^\d{2}-\d{2}-\d{4}$")
+
+
+# Raised when a listing doesn't match the schema
+class ListingValidationError(ValueError):
+    pass
+
+
+# Checks a listing dict against the schema and returns a normalized copy
+def validate_listing(listing: dict) -> dict:
+    missing = [f for f in LISTING_FIELDS if f not in OPTIONAL_FIELDS and listing.get(f) in (None, "")]
+    if missing:
+        raise ListingValidationError(f"Listing {listing.get('id')!r} is missing {', '.join(missing)}")
+
+    out = {f: listing.get(f) for f in LISTING_FIELDS}
+    pets = str(out["pets"]).strip().lower()
+    if pets not in ("yes", "no"):
+        raise ListingValidationError(f"Listing {out['id']!r}: pets must be 'yes' or 'no', got {out['pets']!r}")
+    out["pets"] = pets
+
+    for field in ("rent", "beds", "maxtenants", "moveincost"):
+        try:
+            out[field] = int(out[field])
+        except (TypeError, ValueError):
+            raise ListingValidationError(f"Listing {out['id']!r}: {field} must be a whole number, got {out[field]!r}")
+        if out[field] < 0 or (field == "maxtenants" and out[field] == 0):
+            raise ListingValidationError(f"Listing {out['id']!r}: {field} out of range ({out[field]})")
+    try:
+        out["baths"] = float(out["baths"])
+        if out["baths"].is_integer():
+            out["baths"] = int(out["baths"])
+    except (TypeError, ValueError):
+        raise ListingValidationError(f"Listing {out['id']!r}: baths must be a number, got {out['baths']!r}")
+
+    if not MOVEINDATE_RE.match(str(out["moveindate"])):
+        raise ListingValidationError(f"Listing {out['id']!r}: moveindate must be MM-DD-YYYY, got {out['moveindate']!r}")
+    try:
+        datetime.strptime(out["moveindate"], "%m-%d-%Y")
+    except ValueError:
+        raise ListingValidationError(f"Listing {out['id']!r}: moveindate is not a real date ({out['moveindate']})")
+
+    # Optional fields are left out of the dict when empty, so callers can use listing.get(...)
+    for field in OPTIONAL_FIELDS:
+        if not out[field]:
+            del out[field]
+    return out
+
+
+class ListingRepository:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.version = None
+        self.checked_at = 0.0
+        self.by_id = {}
+        self.ordered = []
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                "id TEXT PRIMARY KEY, address TEXT NOT NULL, neighborhood TEXT NOT NULL, rent INTEGER NOT NULL, "
+                "beds INTEGER NOT NULL, baths REAL NOT NULL, pets TEXT NOT NULL, maxtenants INTEGER NOT NULL, "
+                "moveindate TEXT NOT NULL, moveincost INTEGER NOT NULL, img TEXT, agent TEXT, "
+                "position INTEGER NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS listings_neighborhood ON listings (neighborhood)")
+            db.execute("CREATE INDEX IF NOT EXISTS listings_rent ON listings (rent)")
+            db.execute("CREATE INDEX IF NOT EXISTS listings_beds ON listings (beds)")
+            db.execute("CREATE TABLE IF NOT EXISTS listings_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            db.execute("INSERT OR IGNORE INTO listings_meta (key, value) VALUES ('version', 0)")
+
+    # Commits (or rolls back) and closes; sqlite3's own context manager only commits, leaving the connection open
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout = 30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def row_to_listing(row: sqlite3.Row) -> dict:
+        listing = {f: row[f] for f in LISTING_FIELDS if row[f] is not None}
+        if float(listing["baths"]).is_integer():
+            listing["baths"] = int(listing["baths"])
+        return listing
+
+    def current_version(self) -> int:
+        with self.connect() as db:
+            return db.execute("SELECT value FROM listings_meta WHERE key = 'version'").fetchone()[0]
+
+    # Reloads the in-memory cache if any process has written since it was built.
+    # Checks at most every version_check_interval seconds unless force is set
+    def refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and self.version is not None and now - self.checked_at < version_check_interval:
+            return
+        self.checked_at = now
+        version = self.current_version()
+        if version == self.version:
+            return
+        with self.lock:
+            with self.connect() as db:
+                db.row_factory = sqlite3.Row
+                rows = db.execute("SELECT * FROM listings ORDER BY position").fetchall()
+            self.ordered = [self.row_to_listing(r) for r in rows]
+            self.by_id = {l["id"]: l for l in self.ordered}
+            self.version = version
+
+    # Inserts or replaces listings after validating them; bumps the version once per call
+    def upsert(self, listings: list[dict]):
+        validated = [validate_listing(l) for l in listings]
+        with self.lock, self.connect() as db:
+            next_position = db.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM listings").fetchone()[0]
+            for i, l in enumerate(validated):
+                db.execute(
+                    "INSERT INTO listings (id, address, neighborhood, rent, beds, baths, pets, maxtenants, moveindate, "
+                    "moveincost, img, agent, position) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET address = excluded.address, neighborhood = excluded.neighborhood, "
+                    "rent = excluded.rent, beds = excluded.beds, baths = excluded.baths, pets = excluded.pets, "
+                    "maxtenants = excluded.maxtenants, moveindate = excluded.moveindate, moveincost = excluded.moveincost, "
+                    "img = excluded.img, agent = excluded.agent",
+                    tuple(l.get(f) for f in LISTING_FIELDS) + (next_position + i,),
+                )
+            db.execute("UPDATE listings_meta SET value = value + 1 WHERE key = 'version'")
+        self.checked_at = 0.0
+
+    def delete(self, listing_id: str):
+        with self.lock, self.connect() as db:
+            db.execute("DELETE FROM listings WHERE id = ?", (listing_id,))
+            db.execute("UPDATE listings_meta SET value = value + 1 WHERE key = 'version'")
+        self.checked_at = 0.0
+
+    # Loads the given listings only when the table is empty (first run / demo data)
+    def seed(self, listings: list[dict]):
+        with self.connect() as db:
+            empty = db.execute("SELECT COUNT(*) FROM listings").fetchone()[0] == 0
+        if empty:
+            self.upsert(listings)
+
+    def get(self, listing_id: str) -> dict | None:
+        self.refresh()
+        return self.by_id.get(listing_id)
+
+    def all(self) -> list[dict]:
+        self.refresh()
+        return self.ordered
+
+    # Filtered lookup using the SQL indexes; returns listings in their original order
+    def search(self, *, neighborhood: str | None = None, min_rent: int | None = None, max_rent: int | None = None,
+               min_beds: int | None = None) -> list[dict]:
+        clauses, args = [], []
+        if neighborhood:
+            clauses.append("neighborhood = ?")
+            args.append(neighborhood)
+        if min_rent is not None:
+            clauses.append("rent >= ?")
+            args.append(min_rent)
+        if max_rent is not None:
+            clauses.append("rent <= ?")
+            args.append(max_rent)
+        if min_beds is not None:
+            clauses.append("beds >= ?")
+            args.append(min_beds)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.connect() as db:
+            ids = [r[0] for r in db.execute(f"SELECT id FROM listings {where} ORDER BY position", args)]
+        self.refresh(force = True)
+        return [self.by_id[i] for i in ids if i in self.by_id]
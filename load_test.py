@@ -0,0 +1,255 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Chat load test
+# Starts mock_services.py and page_mockup_v3.py (`streamlit run`, pointed at the mock OpenAI and SendGrid)
+# and drives N simulated renters at once over the same websocket protocol the browser uses. Each renter opens
+# a listing's chat page and has a full conversation: a listing question, a proposed showing time and their
+# email, then keeps the page open (rerunning like the browser's polling fragments do) until the invite shows
+# as sent.
+# Runs one round per session count and reports, for each: per-turn latency (send to script run finished)
+# p50 / p95 / p99, turn throughput, time from the last message to the sent invite, confirmed renters and
+# error rate, plus the mock's call counts.
+# Every renter gets their own email and showing slot, so booking conflicts are not part of the numbers.
+#
+# Usage: python load_test.py [--sessions 1,5,10,20] [--think 1.0] [--latency lognormal:600:0.4]
+#                            [--error-rate 0] [--throttle-rate 0]
+# Other app settings (e.g. REPLY_BACKEND=combined) are passed through from the environment.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import date, datetime, timedelta
+
+from tornado.ioloop import IOLoop
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+from bench_chat_rerun import free_port, wait_for_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(HERE, "page_mockup_v3.py")
+
+LISTING_IDS = ["medford-1a", "southend-5", "dedham-74", "newton-85"]
+DONE = (ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY)
+FAILED = (ForwardMsg.FINISHED_WITH_COMPILE_ERROR,)
+
+# Showing slots handed out to renters in order: 30 minutes apart, 9:00-19:00, starting the day after tomorrow
+slot_numbers = itertools.count()
+
+
+def next_showing_slot() -> str:
+    n = next(slot_numbers)
+    day = date.today() + timedelta(days = 2 + n // 20)
+    start = datetime.combine(day, datetime.min.time()) + timedelta(hours = 9, minutes = 30 * (n % 20))
+    return start.strftime("%Y-%m-%d %H:%M")
+
+
+def renter_messages(renter: int) -> list[str]:
+    return [
+        "What is the move in cost?",
+        f"Thanks! I'd love to see the apartment. Could I come by on {next_showing_slot()}?",
+        f"Perfect, that works for me. My email is renter{renter}@loadtest.example.com",
+    ]
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+# One browser tab: a websocket session that sends reruns and remembers what it needs from the replies
+class Session:
+    def __init__(self, ws, query: str):
+        self.ws = ws
+        self.query = query
+        self.chat_input_id = None
+        self.fragment_id = None
+
+    # Sends one rerun (with a chat message if given) and reads until the run finishes.
+    # Returns (wall seconds, alert texts, exception messages) of the run
+    async def rerun(self, message: str | None = None) -> tuple[float, list[str], list[str]]:
+        back = BackMsg()
+        back.rerun_script.query_string = self.query
+        if message is not None:
+            widget = back.rerun_script.widget_states.widgets.add()
+            widget.id = self.chat_input_id
+            widget.string_trigger_value.data = message
+            if self.fragment_id:
+                back.rerun_script.fragment_id = self.fragment_id
+
+        started = time.perf_counter()
+        await self.ws.write_message(back.SerializeToString(), binary = True)
+        alerts, exceptions = [], []
+        while True:
+            if hasattr(socket, "TCP_QUICKACK"):
+                self.ws.stream.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            raw = await self.ws.read_message()
+            if raw is None:
+                raise ConnectionError("websocket closed")
+            msg = ForwardMsg()
+            msg.ParseFromString(raw)
+            kind = msg.WhichOneof("type")
+            if kind == "delta":
+                element = msg.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type == "chat_input":
+                    self.chat_input_id = element.chat_input.id
+                    self.fragment_id = msg.delta.fragment_id or None
+                elif element_type == "alert":
+                    alerts.append(element.alert.body)
+                elif element_type == "exception":
+                    exceptions.append(f"{element.exception.type}: {element.exception.message}")
+            elif kind == "page_info_changed":
+                # The app put the conversation id in the URL; send it back like the browser would
+                self.query = msg.page_info_changed.query_string
+            elif kind == "script_finished":
+                if msg.script_finished in FAILED:
+                    exceptions.append("script failed to compile")
+                if msg.script_finished in DONE or msg.script_finished in FAILED:
+                    return time.perf_counter() - started, alerts, exceptions
+
+
+# One renter's conversation. Returns {"turns": [seconds, ...], "invite_seconds", "errors": [...]}
+async def run_renter(port: int, renter: int, listing_id: str, think: float, poll: float, timeout: float) -> dict:
+    result = {"turns": [], "invite_seconds": None, "errors": []}
+    try:
+        ws = await websocket_connect(f"ws://127.0.0.1:{port}/_stcore/stream", subprotocols = ["streamlit"])
+    except OSError as e:
+        result["errors"].append(f"connect: {e}")
+        return result
+    session = Session(ws, f"page=chat&id={listing_id}")
+    try:
+        _, _, exceptions = await asyncio.wait_for(session.rerun(), timeout)
+        result["errors"] += exceptions
+        if session.chat_input_id is None:
+            result["errors"].append("no chat input on the chat page")
+            return result
+
+        for message in renter_messages(renter):
+            await asyncio.sleep(think)
+            seconds, _, exceptions = await asyncio.wait_for(session.rerun(message), timeout)
+            result["turns"].append(seconds)
+            result["errors"] += exceptions
+        sent_from = time.perf_counter()
+
+        # Keep the tab open until the invite is sent (or fails)
+        while time.perf_counter() - sent_from < timeout:
+            await asyncio.sleep(poll)
+            _, alerts, exceptions = await asyncio.wait_for(session.rerun(), timeout)
+            result["errors"] += exceptions
+            if any(alert.startswith("Sent") for alert in alerts):
+                result["invite_seconds"] = time.perf_counter() - sent_from
+                break
+            failed = [alert for alert in alerts if "fail" in alert.lower()]
+            if failed:
+                result["errors"].append(failed[0])
+                break
+        else:
+            result["errors"].append("invite not sent before the timeout")
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        result["errors"].append(f"{type(e).__name__}: {e}")
+    finally:
+        ws.close()
+    return result
+
+
+async def run_round(port: int, sessions: int, first_renter: int, args) -> tuple[list[dict], float]:
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        run_renter(port, first_renter + i, LISTING_IDS[(first_renter + i) % len(LISTING_IDS)], args.think, args.poll, args.timeout)
+        for i in range(sessions)
+    ))
+    return results, time.perf_counter() - started
+
+
+def mock_stats(port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats?reset=1", timeout = 5) as resp:
+        return json.loads(resp.read())
+
+
+def ms(seconds: float | None) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Drive concurrent simulated renters through the chat page")
+    parser.add_argument("--sessions", default = "1,5,10,20", help = "comma separated session counts, one round each")
+    parser.add_argument("--think", type = float, default = 1.0, help = "seconds a renter waits before each message")
+    parser.add_argument("--poll", type = float, default = 0.5, help = "seconds between reruns while waiting for the invite")
+    parser.add_argument("--timeout", type = float, default = 90.0, help = "seconds before a turn or the invite counts as failed")
+    parser.add_argument("--latency", default = "lognormal:600:0.4", help = "mock OpenAI latency (see mock_services.py)")
+    parser.add_argument("--token-ms", default = "15")
+    parser.add_argument("--sendgrid-latency", default = "fixed:80")
+    parser.add_argument("--error-rate", default = "0")
+    parser.add_argument("--throttle-rate", default = "0")
+    args = parser.parse_args()
+    rounds = [int(n) for n in args.sessions.split(",") if n.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mock_port, app_port = free_port(), free_port()
+        mock = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "mock_services.py"), "--port", str(mock_port), "--latency", args.latency,
+             "--token-ms", args.token_ms, "--sendgrid-latency", args.sendgrid_latency, "--error-rate", args.error_rate,
+             "--throttle-rate", args.throttle_rate],
+            stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL,
+        )
+        env = dict(
+            os.environ,
+            PYTHONPATH = HERE,
+            LISTINGS_PATH = os.path.join(tmp, "listings.sqlite3"),
+            LLM_CACHE_PATH = os.path.join(tmp, "llm_cache.sqlite3"),
+            OUTBOX_PATH = os.path.join(tmp, "outbox.sqlite3"),
+            SHOWINGS_PATH = os.path.join(tmp, "showings.sqlite3"),
+            CONVERSATIONS_PATH = os.path.join(tmp, "conversations.sqlite3"),
+            USAGE_PATH = os.path.join(tmp, "usage.sqlite3"),
+            OPENAI_API_KEY = "sk-mock",
+            OPENAI_BASE_URL = f"http://127.0.0.1:{mock_port}/v1",
+            SENDGRID_API_KEY = "SG.mock",
+            SENDGRID_FROM_EMAIL = "agent@loadtest.example.com",
+            SENDGRID_API_URL = f"http://127.0.0.1:{mock_port}/v3/mail/send",
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless", "true", "--server.port", str(app_port),
+             "--browser.gatherUsageStats", "false"],
+            cwd = HERE, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL,
+        )
+        try:
+            wait_for_server(app_port)
+            mock_stats(mock_port)
+            print(f"{'sessions':>8} | {'turns':>5} {'p50':>7} {'p95':>7} {'p99':>7} {'turns/s':>8} | "
+                  f"{'invites':>7} {'inv p50':>8} {'inv p95':>8} | {'errors':>6} {'err %':>6} | mock calls / emails")
+            renter = 0
+            for sessions in rounds:
+                results, wall = IOLoop.current().run_sync(lambda: run_round(app_port, sessions, renter, args),
+                                                          timeout = args.timeout * 10)
+                renter += sessions
+                stats = mock_stats(mock_port)
+                turns = [s for r in results for s in r["turns"]]
+                invites = [r["invite_seconds"] for r in results if r["invite_seconds"] is not None]
+                failed = [r for r in results if r["errors"]]
+                print(f"{sessions:>8} | {len(turns):>5} {ms(percentile(turns, 0.5)):>7} {ms(percentile(turns, 0.95)):>7} "
+                      f"{ms(percentile(turns, 0.99)):>7} {len(turns) / wall:>8.2f} | {len(invites):>3}/{sessions:<3} "
+                      f"{ms(percentile(invites, 0.5)):>8} {ms(percentile(invites, 0.95)):>8} | {len(failed):>6} "
+                      f"{100 * len(failed) / sessions:>5.1f}% | {stats.get('chat_completions', 0)} / {stats.get('emails', 0)}")
+                for r in failed[:3]:
+                    print(f"         error: {r['errors'][0][:160]}")
+        finally:
+            server.terminate()
+            mock.terminate()
+            server.wait()
+            mock.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Mock OpenAI and SendGrid services
+# A local stand-in for the two APIs the app calls, so it can be load tested without spending API quota:
+#   POST /v1/chat/completions  OpenAI-compatible chat completions, streamed (SSE) or not, with usage.
+#                              JSON-mode calls get scripted JSON: the showing classifier returns ready once a
+#                              renter message has an email and a "YYYY-MM-DD HH:MM" time, and the combined
+#                              backend gets {"reply", "confirmation"}. Other calls get a canned reply.
+#   POST /v3/mail/send         SendGrid v3 mail/send: checks the payload shape and answers 202
+#   GET  /stats                request counters as JSON (GET /stats?reset=1 zeroes them)
+# Response times are drawn from a configurable distribution, and a share of OpenAI calls can be made to fail
+# with 429 or 500 to exercise the app's retries and circuit breaker.
+#
+# Usage: python mock_services.py [--port 8765] [--latency lognormal:600:0.4] [--token-ms 15]
+#                                [--sendgrid-latency fixed:80] [--error-rate 0] [--throttle-rate 0]
+# then start the app with OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+#                         SENDGRID_API_URL=http://127.0.0.1:8765/v3/mail/send
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import zoneinfo
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+# Showing times the mock classifier understands, read as local time in SHOWING_TZ
+SHOWING_TIME_RE = re.compile(r"\b(\d{4}-\d{2}-\d{2})(?:T|\s+at\s+|\s+)(\d{1,2}:\d{2})\b")
+SHOWING_TZ = "America/New_York"
+
+CANNED_REPLY = ("Thanks for reaching out! The apartment is still available. How many people would be moving in, "
+                "and what day and time would work for a showing? Please also share the email address for the invite.")
+
+
+# Parses "fixed:MS", "uniform:LOW_MS:HIGH_MS" or "lognormal:MEDIAN_MS:SIGMA" into a function returning seconds
+def latency_sampler(spec: str):
+    kind, *args = spec.split(":")
+    values = [float(a) for a in args]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        return lambda: values[0] * random.lognormvariate(0, values[1]) / 1000
+    raise argparse.ArgumentTypeError(f"bad latency spec {spec!r} (fixed:MS, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA)")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+# Scripted classifier output: confirmed once the renter has given an email and a time
+def classify(messages: list[dict]) -> dict:
+    renter = " ".join(m.get("content") or "" for m in messages if m.get("role") == "user")
+    emails = EMAIL_RE.findall(renter)
+    times = SHOWING_TIME_RE.findall(renter)
+    if not (emails and times):
+        return {"version": "1.0", "ready": False, "status": "not_ready", "user_email": emails[-1] if emails else None,
+                "confidence": 0.9, "reason": "mock: waiting for an email and a time"}
+    day, clock = times[-1]
+    start = datetime.fromisoformat(f"{day}T{clock.zfill(5)}").replace(tzinfo = zoneinfo.ZoneInfo(SHOWING_TZ))
+    return {"version": "1.0", "ready": True, "status": "confirmed", "user_email": emails[-1],
+            "start_time_iso": start.isoformat(timespec = "seconds"), "end_time_iso": None, "timezone": SHOWING_TZ,
+            "confidence": 0.95, "reason": "mock: renter gave an email and a time"}
+
+
+def completion_content(body: dict) -> str:
+    messages = body.get("messages") or []
+    if (body.get("response_format") or {}).get("type") != "json_object":
+        return CANNED_REPLY
+    system = " ".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    if '"reply"' in system:
+        return json.dumps({"reply": CANNED_REPLY, "confirmation": classify(messages)})
+    return json.dumps(classify(messages))
+
+
+class MockServices:
+    def __init__(self, latency, token_delay: float, sendgrid_latency, error_rate: float, throttle_rate: float):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.sendgrid_latency = sendgrid_latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + n
+
+    def handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, payload: dict | None, headers: dict | None = None):
+                body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                if payload is not None:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/stats":
+                    self.send_json(404, {"error": "not found"})
+                    return
+                with services.lock:
+                    stats = dict(services.stats)
+                    if "reset=1" in self.path:
+                        services.stats = {}
+                self.send_json(200, stats)
+
+            def do_POST(self):
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                except json.JSONDecodeError:
+                    self.send_json(400, {"error": {"message": "invalid JSON body"}})
+                    return
+                path = self.path.split("?")[0]
+                if path.endswith("/chat/completions"):
+                    self.chat_completion(body)
+                elif path.endswith("/mail/send"):
+                    self.mail_send(body)
+                else:
+                    self.send_json(404, {"error": {"message": f"unknown path {path}"}})
+
+            def chat_completion(self, body: dict):
+                services.count("chat_completions")
+                roll = random.random()
+                if roll < services.throttle_rate:
+                    services.count("throttled")
+                    self.send_json(429, {"error": {"message": "mock rate limit", "type": "rate_limit_error"}},
+                                   {"Retry-After": "1"})
+                    return
+                if roll < services.throttle_rate + services.error_rate:
+                    services.count("errors")
+                    self.send_json(500, {"error": {"message": "mock server error", "type": "server_error"}})
+                    return
+
+                content = completion_content(body)
+                prompt_tokens = sum(estimate_tokens(m.get("content") or "") + 4 for m in body.get("messages") or [])
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(content),
+                         "total_tokens": prompt_tokens + estimate_tokens(content), "prompt_tokens_details": {"cached_tokens": 0}}
+                base = {"id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": body.get("model", "mock")}
+                time.sleep(services.latency())
+
+                if not body.get("stream"):
+                    services.count("prompt_tokens", prompt_tokens)
+                    self.send_json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [
+                        {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]})
+                    return
+
+                services.count("streams")
+                services.count("prompt_tokens", prompt_tokens)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = content.split(" ")
+                for i, word in enumerate(words):
+                    delta = {"content": word if i == len(words) - 1 else word + " "}
+                    self.write_event({**base, "object": "chat.completion.chunk",
+                                      "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                    time.sleep(services.token_delay)
+                self.write_event({**base, "object": "chat.completion.chunk",
+                                  "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    self.write_event({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+                self.write_chunk(b"data: [DONE]\n\n")
+                self.write_chunk(b"")
+
+            def write_event(self, payload: dict):
+                self.write_chunk(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+
+            def write_chunk(self, data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def mail_send(self, body: dict):
+                services.count("mail_send_requests")
+                personalizations = body.get("personalizations")
+                if not (isinstance(personalizations, list) and personalizations and body.get("from") and body.get("content")):
+                    services.count("mail_send_rejected")
+                    self.send_json(400, {"errors": [{"message": "personalizations, from and content are required"}]})
+                    return
+                time.sleep(services.sendgrid_latency())
+                services.count("emails", len(personalizations))
+                self.send_json(202, None)
+
+        return Handler
+
+    def serve(self, host: str, port: int) -> ThreadingHTTPServer:
+        server = ThreadingHTTPServer((host, port), self.handler())
+        server.daemon_threads = True
+        return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Local OpenAI chat completions and SendGrid mail/send stand-ins")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--latency", type = latency_sampler, default = "lognormal:600:0.4",
+                        help = "OpenAI time to first byte: fixed:MS, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--token-ms", type = float, default = 15.0, help = "delay between streamed chunks")
+    parser.add_argument("--sendgrid-latency", type = latency_sampler, default = "fixed:80")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "share of OpenAI calls answered with 500")
+    parser.add_argument("--throttle-rate", type = float, default = 0.0, help = "share of OpenAI calls answered with 429")
+    args = parser.parse_args()
+
+    services = MockServices(args.latency, args.token_ms / 1000, args.sendgrid_latency, args.error_rate, args.throttle_rate)
+    server = services.serve(args.host, args.port)
+    print(f"mock OpenAI at http://{args.host}:{args.port}/v1, SendGrid at http://{args.host}:{args.port}/v3/mail/send", flush = True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
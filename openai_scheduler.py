@@ -0,0 +1,171 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# OpenAI request scheduler
+# One gate in front of every OpenAI call in the process, so many sessions at once queue for a moment instead
+# of all hitting the API and getting 429s.
+# Two token buckets hold the account's limits: requests per minute and tokens per minute. A call asks for one
+# request plus its estimated size (prompt estimate plus expected completion) before it is sent, and waits
+# until both buckets have room; once the response arrives its real token count is settled against the
+# estimate. A 429 from OpenAI pauses all grants for its Retry-After.
+# Waiting calls are granted by priority class (renter-facing replies first, then summaries, then the
+# classifier, then anything else), and within a class round-robin across sessions, so one busy
+# conversation can't starve the others. Calls that have waited a while move up a class (aging), so
+# classifier calls still get through during a long burst of replies.
+# The queue is bounded: a call is refused right away (SchedulerBusy) when max_waiting calls are already
+# queued or its session already has max_waiting_per_session queued, and gives up (SchedulerTimeout) after
+# its class's max wait. Callers treat both like a failed call and use their fallback.
+# Has no Streamlit dependency; the app shares one instance via st.cache_resource.
+
+import itertools
+import os
+import threading
+import time
+
+OPENAI_RPM = int(os.environ.get("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.environ.get("OPENAI_TPM", "30000"))
+
+max_waiting = 200               # calls queued at most, across all sessions
+max_waiting_per_session = 3     # calls queued at most for one session
+aging_seconds = 5.0             # a waiting call moves up one priority class per this many seconds
+
+# Priority class per call type (lower goes first) and how long a call of that class may wait
+CALL_PRIORITIES = {"reply": 0, "reply_stream": 0, "combined": 0, "summary": 1, "classifier": 2}
+DEFAULT_PRIORITY = 3
+MAX_WAIT_SECONDS = {0: 20.0, 1: 20.0, 2: 45.0, 3: 60.0}
+
+
+class SchedulerError(Exception):
+    pass
+
+
+# Raised when the queue (or the session's share of it) is full
+class SchedulerBusy(SchedulerError):
+    pass
+
+
+# Raised when a call waited longer than its class allows
+class SchedulerTimeout(SchedulerError):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `amount` is available (0 if it is now). Amounts above capacity only wait for a full bucket
+    def wait_for(self, amount: float) -> float:
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+
+class Waiter:
+    def __init__(self, seq: int, session: str, priority: int, tokens: int):
+        self.seq = seq
+        self.session = session
+        self.priority = priority
+        self.tokens = tokens
+        self.queued_at = time.monotonic()
+
+
+class OpenAIScheduler:
+    def __init__(self, rpm: int = OPENAI_RPM, tpm: int = OPENAI_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cond = threading.Condition()
+        self.waiting = []                # Waiters in arrival order
+        self.last_served = {}            # session -> monotonic time of its last grant (for round-robin)
+        self.paused_until = 0.0          # no grants before this (set by a 429)
+        self.seq = itertools.count()
+        self.stats = {"granted": 0, "busy": 0, "timeouts": 0, "throttled": 0, "waited_ms_total": 0.0, "max_wait_ms": 0.0}
+
+    # Effective class of a waiter now: its call's class, improved by one per aging_seconds waited
+    def effective_priority(self, waiter: Waiter, now: float) -> int:
+        return waiter.priority - int((now - waiter.queued_at) / aging_seconds)
+
+    # The waiter to serve next: best effective class, then the session served longest ago, then arrival order
+    def next_waiter(self, now: float) -> Waiter | None:
+        if not self.waiting:
+            return None
+        return min(self.waiting, key = lambda w: (self.effective_priority(w, now), self.last_served.get(w.session, 0.0), w.seq))
+
+    # Blocks until this call may be sent. Returns the seconds waited.
+    # Raises SchedulerBusy if the queue is full and SchedulerTimeout after the class's max wait
+    def acquire(self, call_type: str, session: str | None, tokens: int) -> float:
+        session = session or ""
+        priority = CALL_PRIORITIES.get(call_type, DEFAULT_PRIORITY)
+        with self.cond:
+            if len(self.waiting) >= max_waiting or sum(w.session == session for w in self.waiting) >= max_waiting_per_session:
+                self.stats["busy"] += 1
+                raise SchedulerBusy(f"OpenAI queue is full ({len(self.waiting)} waiting)")
+            waiter = Waiter(next(self.seq), session, priority, tokens)
+            self.waiting.append(waiter)
+            deadline = waiter.queued_at + MAX_WAIT_SECONDS.get(priority, MAX_WAIT_SECONDS[DEFAULT_PRIORITY])
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    if self.next_waiter(now) is waiter:
+                        delay = max(self.paused_until - now, self.requests.wait_for(1), self.tokens.wait_for(tokens))
+                        if delay <= 0:
+                            self.requests.level -= 1
+                            self.tokens.level -= tokens
+                            self.last_served[session] = now
+                            waited = now - waiter.queued_at
+                            self.stats["granted"] += 1
+                            self.stats["waited_ms_total"] += waited * 1000
+                            self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], waited * 1000)
+                            return waited
+                    else:
+                        # Not first in line: nothing changes for this waiter until another call is granted /
+                        # queued / settled (notify_all) or its next aging step
+                        waited = now - waiter.queued_at
+                        delay = (int(waited / aging_seconds) + 1) * aging_seconds - waited
+                    if now >= deadline:
+                        self.stats["timeouts"] += 1
+                        raise SchedulerTimeout(f"waited {now - waiter.queued_at:.1f}s for an OpenAI slot")
+                    # The first waiter sleeps until the buckets should have room; either way wake by the deadline
+                    self.cond.wait(min(max(delay, 0.001), deadline - now))
+            finally:
+                self.waiting.remove(waiter)
+                self.cond.notify_all()
+
+    # Corrects the token bucket once the real usage of a granted call is known
+    def settle(self, estimated: int, actual: int | None):
+        if actual is None:
+            return
+        with self.cond:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated - actual)
+            self.cond.notify_all()
+
+    # OpenAI answered 429: hold every grant for `seconds`
+    def throttle(self, seconds: float):
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.stats["throttled"] += 1
+            self.cond.notify_all()
+
+    def summary(self) -> dict:
+        with self.cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            granted = self.stats["granted"]
+            return {
+                "waiting": len(self.waiting),
+                "granted": granted,
+                "busy": self.stats["busy"],
+                "timeouts": self.stats["timeouts"],
+                "throttled": self.stats["throttled"],
+                "avg_wait_ms": round(self.stats["waited_ms_total"] / granted, 1) if granted else 0.0,
+                "max_wait_ms": round(self.stats["max_wait_ms"], 1),
+                "rpm_left": int(self.requests.level),
+                "tpm_left": int(self.tokens.level),
+            }
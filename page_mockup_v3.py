@@ -4,19 +4,58 @@
 # Imports packages and sets up basic page configuration.
 
 import base64
+import contextvars
+import hashlib
+import html
+import http.client
 import os 
 import json
+import numpy as np
+import pandas as pd
+import random
+import re
+import select
+import sqlite3
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import threading
+import time
 import uuid
-import urllib.request
+import urllib.parse
 import urllib.error
 import zoneinfo
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import openai
 from openai import OpenAI 
+from openai.types.chat import ChatCompletion
 from datetime import date, datetime, timezone, timedelta
 from typing import TypedDict
+from cassettes import Cassette, load_cassette
+from chat_rules import (
+    EMAIL_RE, TIME_RE, new_qualification_state, pregate_confirmation, qualification_decline, qualification_facts_for_llm,
+    route_listing_question, update_qualification
+)
+from conversation_store import CONVERSATIONS_PATH, ConversationStore
+from invite_outbox import OUTBOX_PATH, InviteOutbox, invite_idempotency_key, outbox_workers
+from listing_repository import LISTINGS_PATH, ListingRepository
+from showings import SHOWINGS_PATH, AvailabilityStore, listing_agent, showing_minutes
+from openai_scheduler import OpenAIScheduler, OPENAI_RPM, OPENAI_TPM
+from usage_ledger import USAGE_PATH, UsageLedger, usage_tagged, usage_tags
+from thumbnails import THUMBNAIL_ASPECT, THUMBNAIL_URL, THUMBNAIL_WIDTHS, ThumbnailStore
+from rerun_profiler import profiler
+from latency_metrics import latency
+
+# Per-section timings of this script run (only when PROFILE_RERUNS=1, see rerun_profiler.py)
+profiler.start()
+# Whole-run time for the "rerun" latency histogram (see latency_metrics.py)
+run_started = time.perf_counter()
 
 st.set_page_config(page_title = "bostonrentals.com (mock)", page_icon = "🏙️", layout = "wide")
 
+profiler.mark("1A imports")
+
+
 #-------------------------------------------------------------
 #-------------------------------------------------------------
 # 1B. Secrets & OpenAI Client
@@ -39,16 +78,303 @@ def get_secrets(name_env: str, *secrets_path):
     except Exception:
         return None
 
-OPENAI_API_KEY = get_secrets("OPENAI_API_KEY", "openai", "api_key")
-SENDGRID_API_KEY = get_secrets("SENDGRID_API_KEY", "sendgrid", "api_key")
-SENDGRID_FROM_EMAIL = get_secrets("SENDGRID_FROM_EMAIL", "sendgrid", "from_email")
-
-# Create OpenAI client
+# Read once per process: st.secrets is re-checked on every access, and these don't change while the app runs
+@st.cache_resource(show_spinner = False)
+def load_secrets() -> dict:
+    return {
+        "OPENAI_API_KEY": get_secrets("OPENAI_API_KEY", "openai", "api_key"),
+        "SENDGRID_API_KEY": get_secrets("SENDGRID_API_KEY", "sendgrid", "api_key"),
+        "SENDGRID_FROM_EMAIL": get_secrets("SENDGRID_FROM_EMAIL", "sendgrid", "from_email"),
+        # Optional override, e.g. a local fake endpoint for measuring timeouts/retries
+        "OPENAI_BASE_URL": get_secrets("OPENAI_BASE_URL", "openai", "base_url"),
+    }
+
+secrets = load_secrets()
+OPENAI_API_KEY = secrets["OPENAI_API_KEY"]
+SENDGRID_API_KEY = secrets["SENDGRID_API_KEY"]
+SENDGRID_FROM_EMAIL = secrets["SENDGRID_FROM_EMAIL"]
+OPENAI_BASE_URL = secrets["OPENAI_BASE_URL"]
+
+# Per-call-type timeouts (seconds) for OpenAI requests
+OPENAI_TIMEOUTS = {
+    "reply": 30.0,
+    "reply_stream": 60.0,
+    "classifier": 20.0,
+    "combined": 40.0,
+    "summary": 20.0,
+}
+# Retries on 429 / 5xx / timeouts, with jittered exponential backoff starting at retry_base_delay seconds
+openai_max_retries = 3
+retry_base_delay = 0.5
+retry_max_delay = 8.0
+# Circuit breaker: after this many failed calls in a row, skip OpenAI (canned replies) for breaker_cooldown seconds
+breaker_failure_threshold = 5
+breaker_cooldown = 30.0
+
+# Timeout for SendGrid requests (seconds)
+sendgrid_timeout = 10.0
+# SendGrid endpoint, overridable to point at a local stand-in
+SENDGRID_API_URL = os.environ.get("SENDGRID_API_URL", "https://api.sendgrid.com/v3/mail/send")
+
+# Create OpenAI client. Cached so every session and rerun shares one client and its keep-alive connection pool.
+# The SDK's own retries are off because call_openai handles them
+@st.cache_resource(show_spinner = False)
 def get_openai_client():
-    return OpenAI(api_key=OPENAI_API_KEY)
+    return OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL or None, max_retries=0)
 
 client = get_openai_client()
 
+# Raised instead of calling OpenAI while the circuit breaker is open
+class CircuitOpenError(Exception):
+    pass
+
+# Counts consecutive OpenAI failures (retryable ones only) and opens after failure_threshold of them.
+# Once cooldown has passed a single trial call is let through; success closes it again
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Half-open: let this call through and restart the cooldown in case it fails too
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+@st.cache_resource(show_spinner = False)
+def get_circuit_breaker() -> CircuitBreaker:
+    return CircuitBreaker(breaker_failure_threshold, breaker_cooldown)
+
+# Only rate limits, server errors, timeouts and dropped connections are worth retrying
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+# Backoff before retry number `attempt` (0-based): exponential with jitter, honouring Retry-After when sent
+def retry_delay(e: Exception, attempt: int) -> float:
+    delay = min(retry_max_delay, retry_base_delay * (2 ** attempt)) * random.uniform(0.5, 1.5)
+    response = getattr(e, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        delay = max(delay, min(retry_max_delay, float(retry_after)))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+# On-disk cache for deterministic OpenAI calls (opt-in per call site via call_openai(..., cache=True))
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", ".llm_cache.sqlite3")
+llm_cache_ttl = 24 * 3600                  # seconds before a cached response expires
+llm_cache_max_bytes = 50 * 1024 * 1024     # disk tier is trimmed (least recently used first) above this size
+llm_cache_memory_items = 256               # entries kept in the in-memory LRU tier
+
+# Two-tier cache of raw chat completion JSON keyed by a hash of the request (model, messages, parameters).
+# Memory tier is an LRU dict in front of a SQLite table with TTL and size-based eviction
+class LLMCache:
+    def __init__(self, path: str, ttl: float, max_bytes: int, memory_items: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def make_key(request: dict) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys = True, default = str).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self.lock:
+            if key in self.memory:
+                value, created_at = self.memory[key]
+                if now - created_at < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self.memory[key]
+
+            row = self.db.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] < self.ttl:
+                self.db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                self.db.commit()
+                self.remember(key, row[0], row[1])
+                self.stats["disk_hits"] += 1
+                return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self.lock:
+            self.remember(key, value, now)
+            self.db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+            # Drop expired rows, then least recently used rows until the table fits max_bytes
+            self.db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            while total > self.max_bytes:
+                key_old, size_old = self.db.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at LIMIT 1").fetchone()
+                self.db.execute("DELETE FROM llm_cache WHERE key = ?", (key_old,))
+                self.memory.pop(key_old, None)
+                self.stats["evictions"] += 1
+                total -= size_old
+            self.db.commit()
+
+    # Adds to the memory tier (caller holds the lock)
+    def remember(self, key: str, value: str, created_at: float):
+        self.memory[key] = (value, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last = False)
+
+@st.cache_resource(show_spinner = False)
+def get_llm_cache() -> LLMCache:
+    return LLMCache(LLM_CACHE_PATH, llm_cache_ttl, llm_cache_max_bytes, llm_cache_memory_items)
+
+# Token usage of every OpenAI call, tagged with the listing / conversation set by usage_tagged (see usage_ledger.py)
+@st.cache_resource(show_spinner = False)
+def get_usage_ledger() -> UsageLedger:
+    return UsageLedger(USAGE_PATH)
+
+# Process-wide queue in front of OpenAI: RPM / TPM token buckets, renter replies first, fair across sessions
+# (see openai_scheduler.py). Completions are estimated at this many tokens when the call doesn't set max_tokens
+completion_token_estimate = 300
+
+@st.cache_resource(show_spinner = False)
+def get_openai_scheduler() -> OpenAIScheduler:
+    return OpenAIScheduler(OPENAI_RPM, OPENAI_TPM)
+
+# Record / replay cassette for OpenAI calls when CASSETTE_MODE is record or replay, else None (see cassettes.py)
+@st.cache_resource(show_spinner = False)
+def get_cassette() -> Cassette | None:
+    return load_cassette(meta = {"prompt_version": PROMPT_VERSION, "model": model_name})
+
+# Passes a stream through, recording its usage from the final chunk (sent when stream_options include_usage is set).
+# settle, if given, is called with the stream's total tokens, or with 0 if the stream failed or was dropped
+# before its usage arrived, so the scheduler isn't left holding the estimate
+def record_stream_usage(call_type: str, model: str, stream, settle = None):
+    settled = False
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                get_usage_ledger().record(call_type, model, chunk.usage, PROMPT_VERSION)
+                if settle is not None:
+                    settle(chunk.usage.total_tokens)
+                    settled = True
+            yield chunk
+    finally:
+        if settle is not None and not settled:
+            settle(0)
+
+# Every chat completion goes through here: per-call-type timeout, retries and the circuit breaker
+def call_openai(call_type: str, *, cache: bool = False, **kwargs):
+    """
+    Same arguments as client.chat.completions.create. Raises CircuitOpenError without calling
+    OpenAI while the breaker is open, and re-raises the last error once retries are used up,
+    so callers fall back to their canned replies.
+    With cache=True (deterministic, non-streaming calls only) identical requests are served from the LLM cache.
+    Every response's usage is recorded in the usage ledger under call_type.
+    Each attempt first waits its turn in the OpenAI scheduler; a full queue or too long a wait raises
+    SchedulerBusy / SchedulerTimeout, which callers handle like any failed call.
+    While a cassette is recording or replaying, every call goes through it and the LLM cache is skipped.
+    """
+    cassette = get_cassette()
+    if cassette is not None:
+        cache = False
+        if cassette.mode == "replay":
+            # Served from the file: no breaker, retries or timeouts. A miss raises CassetteMiss
+            resp = cassette.create(call_type, None, kwargs)
+            if kwargs.get("stream"):
+                return record_stream_usage(call_type, kwargs.get("model", ""), resp)
+            get_usage_ledger().record(call_type, resp.model, resp.usage, PROMPT_VERSION)
+            return resp
+
+    if cache:
+        llm_cache = get_llm_cache()
+        cache_key = LLMCache.make_key(kwargs)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            resp = ChatCompletion.model_validate_json(cached)
+            get_usage_ledger().record(call_type, resp.model, resp.usage, PROMPT_VERSION, llm_cache_hit = True)
+            return resp
+
+    breaker = get_circuit_breaker()
+    if not breaker.allow():
+        raise CircuitOpenError("OpenAI circuit breaker is open")
+
+    timed_client = client.with_options(timeout = OPENAI_TIMEOUTS.get(call_type, 30.0))
+    scheduler = get_openai_scheduler()
+    # Sessions take turns by conversation (tagged on the chat turn); the listing tags the queue-time histogram
+    tags = usage_tags.get()
+    estimated = (sum(estimate_message_tokens(m) for m in kwargs.get("messages", []))
+                 + (kwargs.get("max_tokens") or completion_token_estimate))
+    attempt = 0
+    while True:
+        waited = scheduler.acquire(call_type, tags.get("conversation_id"), estimated)
+        latency.observe("openai_queue", waited, tags.get("listing_id"))
+        try:
+            if cassette is not None:
+                resp = cassette.create(call_type, timed_client.chat.completions.create, kwargs)
+            else:
+                resp = timed_client.chat.completions.create(**kwargs)
+        except Exception as e:
+            # The failed attempt's estimate goes back to the token bucket
+            scheduler.settle(estimated, 0)
+            if not is_retryable(e):
+                # A 400 or other client error says nothing about OpenAI's health
+                raise
+            if attempt >= openai_max_retries:
+                breaker.record_failure()
+                raise
+            delay = retry_delay(e, attempt)
+            if isinstance(e, openai.RateLimitError):
+                # Every session backs off, not just this one
+                scheduler.throttle(delay)
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        breaker.record_success()
+        if kwargs.get("stream"):
+            return record_stream_usage(call_type, kwargs.get("model", ""), resp,
+                                       lambda actual: scheduler.settle(estimated, actual))
+        get_usage_ledger().record(call_type, resp.model, resp.usage, PROMPT_VERSION)
+        scheduler.settle(estimated, resp.usage.total_tokens if resp.usage else None)
+        if cache:
+            llm_cache.put(cache_key, resp.model_dump_json())
+        return resp
+
+profiler.mark("1B secrets & client")
+
 
 #-------------------------------------------------------------
 #-------------------------------------------------------------
@@ -188,139 +514,235 @@ Never fabricate dates, times, or places. Use null if missing.
 Keep reason concise and factual, citing the exact phrase(s) you relied on.
 Be conservative: when uncertain, prefer ready: false.
 
-## Few-shot examples
-
-Example A — Confirmed acceptance of proposed slot/place and email
-
-INPUT (last messages summarized):
-Agent: “Can you do Tue Nov 4 at 3:00 PM at 123 Main St, Boston (Leasing Office)?”
-User: “Yes, that works. See you there.”
-Agent: "Great, what's a good email for me to send a calendar invitation?"
-User: "isabella.epshtein@gmail.com"
-
-OUTPUT:
-{
-"version": "1.0",
-"ready": true,
-"user_email": "isabella.epshtein@gmail.com",
-"status": "confirmed",
-"start_time_iso": "2025-11-04T15:00:00-05:00",
-"end_time_iso": null,
-"timezone": "America/New_York",
-"location_text": "123 Main St, Boston (Leasing Office)",
-"notes": "User explicitly accepted agent’s proposed time and place and provided an email address.",
-"confidence": 0.97,
-"reason": "User said 'Yes, that works. See you there' immediately after the agent proposed Tue Nov 4 3:00 PM at 123 Main St. User then provided an email address."
-}
-
-Example B — Vague time ⇒ not ready
-
-INPUT:
-User: “Tomorrow afternoon should be fine—can you send an invite?”
-
-OUTPUT:
-{
-"version": "1.0",
-"ready": false,
-"user_email": null,
-"status": "ambiguous",
-"start_time_iso": null,
-"end_time_iso": null,
-"timezone": "America/New_York",
-"location_text": null,
-"notes": "Vague ‘tomorrow afternoon’ and no email.",
-"confidence": 0.95,
-"reason": "Time is non-specific (‘tomorrow afternoon’). No email provided."
-}
-
-Example C — Proposal (user offers a concrete option, not yet accepted)
-
-INPUT:
-User: “How about Wed Nov 5 at 5:30 PM at the leasing office?”
-
-OUTPUT:
-{
-"version": "1.0",
-"ready": false,
-"user_email": null,
-"status": "proposal",
-"start_time_iso": "2025-11-05T17:30:00-05:00",
-"end_time_iso": null,
-"timezone": "America/New_York",
-"location_text": "Leasing office",
-"notes": "User proposed a slot; not yet accepted by agent.",
-"confidence": 0.9,
-"reason": "User suggested a specific time and date but no acceptance occurred."
-}
-
-Example D — Conflicting options
-
-INPUT:
-User: “I can do Tue 3 PM or Wed 5 PM. Which is better?”
-
-OUTPUT:
-{
-"version": "1.0",
-"ready": false,
-"user_email": null,
-"status": "conflict",
-"start_time_iso": null,
-"end_time_iso": null,
-"timezone": "America/New_York",
-"location_text": null,
-"notes": "Multiple candidate times; no single choice.",
-"confidence": 0.92,
-"reason": "Two different times mentioned without a final selection."
-}
+"""
 
-Example E — Email missing ⇒ not ready
+# Few-shot examples for the classifier, kept as structured fixtures. Only the few most similar to the
+# current conversation are rendered into the prompt (see select_classifier_examples)
+CLASSIFIER_EXAMPLES = [
+    {
+        "name": "Example A — Confirmed acceptance of proposed slot/place and email",
+        "input": [
+            "Agent: “Can you do Tue Nov 4 at 3:00 PM at 123 Main St, Boston (Leasing Office)?”",
+            "User: “Yes, that works. See you there.”",
+            "Agent: \"Great, what's a good email for me to send a calendar invitation?\"",
+            "User: \"isabella.epshtein@gmail.com\"",
+        ],
+        "output": {
+            "version": "1.0",
+            "ready": True,
+            "user_email": "isabella.epshtein@gmail.com",
+            "status": "confirmed",
+            "start_time_iso": "2025-11-04T15:00:00-05:00",
+            "end_time_iso": None,
+            "timezone": "America/New_York",
+            "location_text": "123 Main St, Boston (Leasing Office)",
+            "notes": "User explicitly accepted agent’s proposed time and place and provided an email address.",
+            "confidence": 0.97,
+            "reason": "User said 'Yes, that works. See you there' immediately after the agent proposed Tue Nov 4 3:00 PM at 123 Main St. User then provided an email address.",
+        },
+    },
+    {
+        "name": "Example B — Vague time ⇒ not ready",
+        "input": [
+            "User: “Tomorrow afternoon should be fine—can you send an invite?”",
+        ],
+        "output": {
+            "version": "1.0",
+            "ready": False,
+            "user_email": None,
+            "status": "ambiguous",
+            "start_time_iso": None,
+            "end_time_iso": None,
+            "timezone": "America/New_York",
+            "location_text": None,
+            "notes": "Vague ‘tomorrow afternoon’ and no email.",
+            "confidence": 0.95,
+            "reason": "Time is non-specific (‘tomorrow afternoon’). No email provided.",
+        },
+    },
+    {
+        "name": "Example C — Proposal (user offers a concrete option, not yet accepted)",
+        "input": [
+            "User: “How about Wed Nov 5 at 5:30 PM at the leasing office?”",
+        ],
+        "output": {
+            "version": "1.0",
+            "ready": False,
+            "user_email": None,
+            "status": "proposal",
+            "start_time_iso": "2025-11-05T17:30:00-05:00",
+            "end_time_iso": None,
+            "timezone": "America/New_York",
+            "location_text": "Leasing office",
+            "notes": "User proposed a slot; not yet accepted by agent.",
+            "confidence": 0.9,
+            "reason": "User suggested a specific time and date but no acceptance occurred.",
+        },
+    },
+    {
+        "name": "Example D — Conflicting options",
+        "input": [
+            "User: “I can do Tue 3 PM or Wed 5 PM. Which is better?”",
+        ],
+        "output": {
+            "version": "1.0",
+            "ready": False,
+            "user_email": None,
+            "status": "conflict",
+            "start_time_iso": None,
+            "end_time_iso": None,
+            "timezone": "America/New_York",
+            "location_text": None,
+            "notes": "Multiple candidate times; no single choice.",
+            "confidence": 0.92,
+            "reason": "Two different times mentioned without a final selection.",
+        },
+    },
+    {
+        "name": "Example E — Email missing ⇒ not ready",
+        "input": [
+            "User: “Let’s lock Mon at 10 AM. Send the invite.”",
+        ],
+        "output": {
+            "version": "1.0",
+            "ready": False,
+            "user_email": None,
+            "status": "not_ready",
+            "start_time_iso": "2025-11-03T10:00:00-05:00",
+            "end_time_iso": None,
+            "timezone": "America/New_York",
+            "location_text": None,
+            "notes": "Time set but no user email specified in thread.",
+            "confidence": 0.93,
+            "reason": "No email provided.",
+        },
+    },
+    {
+        "name": "Example F — Confirmed with earlier place reference",
+        "input": [
+            "Agent (earlier): “Showings are at 200 Boylston St, back entrance.”",
+            "Agent (later): “Does Thu Nov 6 at 2 PM work?”",
+            "User: “Perfect—see you then. Send to my email: andres.hoffman.pena@gmail.com”",
+        ],
+        "output": {
+            "version": "1.0",
+            "ready": True,
+            "user_email": "andres.hoffman.pena@gmail.com",
+            "status": "confirmed",
+            "start_time_iso": "2025-11-06T14:00:00-05:00",
+            "end_time_iso": None,
+            "timezone": "America/New_York",
+            "location_text": "200 Boylston St, back entrance",
+            "notes": "User accepted time; time and date were explicitly set earlier and not changed. User provided emal address",
+            "confidence": 0.94,
+            "reason": "User acceptance (‘Perfect—see you then’) refers to the latest proposed time and earlier specified location. User then explicitly provided an email address.",
+        },
+    },
+]
 
-INPUT:
-User: “Let’s lock Mon at 10 AM. Send the invite.”
+# Number of few-shot examples sent with each classification
+classifier_example_count = 3
+
+# Cheap transcript features used to match the conversation against the few-shot examples
+ACCEPT_RE = re.compile(r"\b(yes|works|perfect|see you|confirm|lock|sounds good)\b", re.IGNORECASE)
+VAGUE_RE = re.compile(r"\b(morning|afternoon|evening|around|sometime|should be fine)\b", re.IGNORECASE)
+PROPOSAL_RE = re.compile(r"\b(how about|what about|can we do|can you do|does .+ work)\b", re.IGNORECASE)
+
+def transcript_features(text: str) -> tuple[bool, ...]:
+    return (
+        bool(EMAIL_RE.search(text)),             # has email
+        bool(TIME_RE.search(text)),              # has time
+        len(TIME_RE.findall(text)) >= 3,         # several times mentioned (possible conflict)
+        bool(re.search(r"\bor\b", text)) and bool(TIME_RE.search(text)),  # choosing between options
+        bool(ACCEPT_RE.search(text)),            # acceptance language
+        bool(VAGUE_RE.search(text)),             # vague timing
+        bool(PROPOSAL_RE.search(text)),          # open proposal
+    )
+
+# Feature vectors of the fixtures, computed once per process
+@st.cache_data(show_spinner = False)
+def example_feature_index() -> list[tuple[bool, ...]]:
+    return [transcript_features("\n".join(example["input"])) for example in CLASSIFIER_EXAMPLES]
+
+# Picks the k examples whose features match the latest messages most closely (ties keep fixture order)
+def select_classifier_examples(history: list[dict], k: int = classifier_example_count) -> list[dict]:
+    recent_text = "\n".join(msg.get("content") or "" for msg in history[-4:])
+    features = transcript_features(recent_text)
+    scores = [sum(a == b for a, b in zip(features, example)) for example in example_feature_index()]
+    ranked = sorted(range(len(CLASSIFIER_EXAMPLES)), key = lambda i: -scores[i])
+    return [CLASSIFIER_EXAMPLES[i] for i in sorted(ranked[:k])]
+
+def render_classifier_example(example: dict) -> str:
+    return "\n".join([
+        example["name"],
+        "",
+        "INPUT:",
+        *example["input"],
+        "",
+        "OUTPUT:",
+        json.dumps(example["output"], indent = 0, ensure_ascii = False),
+    ])
+
+# Timezone of showings
+default_tz = "America/New_York"
 
-OUTPUT:
+# APP_NOW_ISO pins "now" for everything that goes into a prompt (the classifier's date, free showing slots,
+# move in years), so a recorded conversation replays with identical requests on any day
+APP_NOW_ISO = os.environ.get("APP_NOW_ISO")
+
+def local_now() -> datetime:
+    if APP_NOW_ISO:
+        return datetime.fromisoformat(APP_NOW_ISO).astimezone(zoneinfo.ZoneInfo(default_tz))
+    return datetime.now(zoneinfo.ZoneInfo(default_tz))
+
+# Adds in current date context to our classifier prompt. Compiled once per day (keyed by the date), with
+# REFERENCE_NOW_ISO at local midnight so the prompt, and the LLM cache key, stay the same all day
+@st.cache_data(show_spinner = False)
+def compile_classifier_rules(day: str) -> str:
+    now_iso = datetime.combine(date.fromisoformat(day), datetime.min.time(), zoneinfo.ZoneInfo(default_tz)).isoformat(timespec="seconds")
+    return classifier_prompt_no_today.replace("{{NOW_ISO}}", now_iso).replace("{{DEFAULT_TZ}}", default_tz)
+
+def classifier_rules() -> str:
+    return compile_classifier_rules(local_now().date().isoformat())
+
+# Full classifier prompt for a conversation: the dated rules plus the selected few-shot examples
+def build_classifier_prompt(history: list[dict]) -> str:
+    examples = "\n\n".join(render_classifier_example(e) for e in select_classifier_examples(history))
+    return classifier_rules() + "## Few-shot examples\n\n" + examples + "\n"
+
+# Estimated token count of each classifier prompt section, for spotting the big fixed costs
+def classifier_prompt_report() -> dict[str, int]:
+    report = {"rules": estimate_tokens(classifier_rules())}
+    for example in CLASSIFIER_EXAMPLES:
+        report[example["name"].split(" — ")[0]] = estimate_tokens(render_classifier_example(example))
+    return report
+
+# Defines the prompt for the combined backend, where a single call writes the reply AND classifies the conversation.
+# Sent after system_prompt and the listing facts, followed by the classifier prompt (build_classifier_prompt)
+combined_prompt = """
+## Response format for this chat (overrides everything below about output format)
+You are ALSO acting as the confirmation classifier described in the next section. For every turn:
+1. Write your next chat message to the renter exactly as described above.
+2. Classify the conversation INCLUDING the message you just wrote, following the classifier rules below.
+
+Return exactly one JSON object with these two keys and nothing else:
 {
-"version": "1.0",
-"ready": false,
-"user_email": null,
-"status": "not_ready",
-"start_time_iso": "2025-11-03T10:00:00-05:00",
-"end_time_iso": null,
-"timezone": "America/New_York",
-"location_text": null,
-"notes": "Time set but no user email specified in thread.",
-"confidence": 0.93,
-"reason": "No email provided."
+"reply": "your next chat message to the renter",
+"confirmation": { the classifier output object, using the exact schema defined below }
 }
 
-Example F — Confirmed with earlier place reference
-
-INPUT:
-Agent (earlier): “Showings are at 200 Boylston St, back entrance.”
-Agent (later): “Does Thu Nov 6 at 2 PM work?”
-User: “Perfect—see you then. Send to my email: andres.hoffman.pena@gmail.com”
+The classifier instructions below apply ONLY to the "confirmation" object. The "reply" must read like a normal message from the leasing agent.
 
-OUTPUT:
-{
-"version": "1.0",
-"ready": true,
-"user_email": "andres.hoffman.pena@gmail.com",
-"status": "confirmed",
-"start_time_iso": "2025-11-06T14:00:00-05:00",
-"end_time_iso": null,
-"timezone": "America/New_York",
-"location_text": "200 Boylston St, back entrance",
-"notes": "User accepted time; time and date were explicitly set earlier and not changed. User provided emal address",
-"confidence": 0.94,
-"reason": "User acceptance (‘Perfect—see you then’) refers to the latest proposed time and earlier specified location. User then explicitly provided an email address."
-}
+---
 """
 
-# Adds in current date context to our classifier prompt
+# Short hash of the prompt texts, stored with every usage ledger row so token use can be compared across prompt edits
+PROMPT_VERSION = hashlib.sha256("\n".join(
+    [system_prompt, classifier_prompt_no_today, combined_prompt] + [render_classifier_example(e) for e in CLASSIFIER_EXAMPLES]
+).encode("utf-8")).hexdigest()[:8]
+
+profiler.mark("1C prompts")
 
-default_tz = "America/New_York"
-NOW_ISO = datetime.now(zoneinfo.ZoneInfo(default_tz)).isoformat(timespec="seconds")
-classifier_prompt = classifier_prompt_no_today.replace("{{NOW_ISO}}", NOW_ISO).replace("{{DEFAULT_TZ}}", default_tz)
 
 #-------------------------------------------------------------
 #-------------------------------------------------------------
@@ -407,9 +829,8 @@ def make_ics_invite(
         return filename, ics
 
     
-# Define the model to use from OpenAI and timezone of showings
+# Define the model to use from OpenAI (showings use default_tz, defined with the classifier prompt above)
 model_name = "gpt-4.1"
-default_tz = "America/New_York"
 
 # Pull current date for scheduling classifier
 today = str(date.today())
@@ -429,31 +850,75 @@ DEFAULT_CONFIRMATION = {
     "reason": "Fallback due to error or invalid/empty model response.",
 }
 
+# Fail safe reply shown to the user whenever the OpenAI call fails
+REPLY_FALLBACK = "Sorry, I'm having trouble connecting. Can you please try again in a moment?"
+
+# Stream replies token-by-token in the chat page instead of waiting for the full completion
+stream_replies = True
+
+# Builds the message list for the reply bot: system prompt, listing facts, then the chat history
+def build_reply_messages(history: list[dict], listing: dict, known_facts: str | None = None) -> list[dict]:
+    # Keep the chat history (windowed to the token budget) and append the specific listing to the prompt
+    recent = fit_history(history)
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": listing_fact_for_llm(listing)}
+    ]
+    if known_facts:
+        messages.append({"role": "system", "content": known_facts})
+    messages.extend(recent)
+    return messages
+
 # Creates a reply by calling OpenAI's API based on previously defined prompt
-def generate_reply(user_message: str, history: list[dict], listing: dict) -> str:
+def generate_reply(user_message: str, history: list[dict], listing: dict, known_facts: str | None = None) -> str:
     """
-    Turns chat history of specific listing into an OpenAI chat request. 
-    History is defined as st.session_state[key] list of {role, content} messages
+    History is the conversation's list of {role, content} messages (see conversation_store.py)
     """
     try:
-        # Keep the chat history and append the specific listing to the prompt
-        recent = history
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "system", "content": listing_fact_for_llm(listing)}
-        ]
-        messages.extend(recent)
-        
-        resp = client.chat.completions.create(
+        resp = call_openai(
+            "reply",
             model = model_name,
-            messages = messages,
+            messages = build_reply_messages(history, listing, known_facts),
             temperature = 0.4,
         )
         return resp.choices[0].message.content.strip()
     except Exception as e:
         # Fail safe so that the app does not crash
-        return ("Sorry, I'm having trouble connecting. Can you please try again in a moment?")
+        return REPLY_FALLBACK
+
+# Streaming version of generate_reply for the chat page
+def generate_reply_stream(user_message: str, history: list[dict], listing: dict, known_facts: str | None = None):
+    """
+    Same request as generate_reply but with stream=True. Yields the reply text received so far
+    after every chunk, so the caller can simply re-render the latest value.
+    If the stream fails (before or partway through) the last value yielded is REPLY_FALLBACK,
+    which replaces any partial text.
+    """
+    text = ""
+    try:
+        stream = call_openai(
+            "reply_stream",
+            model = model_name,
+            messages = build_reply_messages(history, listing, known_facts),
+            temperature = 0.4,
+            stream = True,
+            stream_options = {"include_usage": True},
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                text += delta
+                yield text
+    except Exception as e:
+        # Fail safe so that the app does not crash, even if some tokens were already shown
+        yield REPLY_FALLBACK
+        return
+
+    # An empty stream is treated like a failed call
+    yield text.strip() or REPLY_FALLBACK
 
 # Creates an ammendment to the OpenAI call with the information on the current listing
 def listing_fact_for_llm(current_listing: dict) -> str:
@@ -467,6 +932,125 @@ def listing_fact_for_llm(current_listing: dict) -> str:
     ]
     return "\n".join(lines)
 
+# Enforce schema completeness & types on a parsed classifier object; fill any missing keys with defaults
+def normalize_confirmation(data: dict) -> dict:
+    out = DEFAULT_CONFIRMATION.copy()
+    out.update({
+        "version": data.get("version", "1.0"),
+        "ready": bool(data.get("ready", False)),
+        "user_email": data.get("user_email"),
+        "status": str(data.get("status", "not_ready")),
+        "start_time_iso": data.get("start_time_iso"),
+        "end_time_iso": data.get("end_time_iso"),
+        "timezone": data.get("timezone", default_tz),
+        "location_text": data.get("location_text"),
+        "notes": data.get("notes"),
+        "confidence": float(data.get("confidence", 0.0)),
+        "reason": str(data.get("reason", "No reason provided.")),
+    })
+    return out
+
+# Token budget for the chat history sent with each call. Older turns beyond it are folded into a rolling summary
+context_token_budget = 3000
+# Tokens set aside inside the budget for the summary message itself
+summary_token_reserve = 600
+# The summary boundary only moves in steps of this many messages, so the summary is reused between steps
+summary_step = 6
+# Cheaper model used only to write the rolling summary
+summary_model_name = "gpt-4.1-mini"
+
+summary_prompt = """
+You maintain a running summary of a chat between a prospective renter and a leasing agent's assistant.
+Update the existing summary with the new messages. Keep it under 150 words, as short bullet points.
+Always keep, word for word: every proposed or agreed showing date/time, every email address, number of occupants, pets, move-in date, and anything the renter accepted or rejected.
+Return only the updated summary.
+"""
+
+# Fast local token estimate (~4 characters per token plus per-message overhead). Good enough for budgeting
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def estimate_message_tokens(msg: dict) -> int:
+    return estimate_tokens(msg.get("content") or "") + 4
+
+# Rolling summaries keyed by a hash of the folded-off messages. Shared across sessions and reruns
+@st.cache_resource(show_spinner = False)
+def get_summary_cache() -> dict:
+    return {}
+
+def history_hash(messages: list[dict]) -> str:
+    return hashlib.sha256(json.dumps(messages, sort_keys = True).encode("utf-8")).hexdigest()
+
+# Messages with an email or time in them are carried into the summary verbatim for the classifier
+def verbatim_facts(messages: list[dict], limit: int = 10) -> list[str]:
+    facts = []
+    for msg in messages:
+        content = msg.get("content") or ""
+        if EMAIL_RE.search(content) or TIME_RE.search(content):
+            facts.append(f"- {msg.get('role')}: {content[:300]}")
+    return facts[-limit:]
+
+# Returns the rolling summary text for history[:cut], reusing the summary of the previous step when cached
+def rolling_summary(history: list[dict], cut: int) -> str:
+    cache = get_summary_cache()
+    key = history_hash(history[:cut])
+    if key in cache:
+        return cache[key]
+
+    # Start from the previous step's summary so only the newly folded messages are sent
+    prev_cut = max(0, cut - summary_step)
+    prev_summary = cache.get(history_hash(history[:prev_cut]), "") if prev_cut else ""
+    new_messages = history[prev_cut:cut] if prev_summary else history[:cut]
+    transcript = "\n".join(f"{m.get('role')}: {m.get('content')}" for m in new_messages)
+
+    try:
+        resp = call_openai(
+            "summary",
+            model = summary_model_name,
+            messages = [
+                {"role": "system", "content": summary_prompt},
+                {"role": "user", "content": f"Existing summary:\n{prev_summary or '(none)'}\n\nNew messages:\n{transcript}"},
+            ],
+            temperature = 0,
+        )
+        summary = (resp.choices[0].message.content or "").strip()
+    except Exception as e:
+        # Not cached, so the next call tries again. The verbatim facts still go out
+        return prev_summary
+
+    cache[key] = summary
+    return summary
+
+# Fits the chat history into context_token_budget
+def fit_history(history: list[dict]) -> list[dict]:
+    """
+    Returns history unchanged while it fits the budget. Otherwise keeps the newest messages that fit and
+    replaces everything before them with one system message holding the rolling summary plus the
+    older messages that mention an email or a time, verbatim.
+    """
+    sizes = [estimate_message_tokens(m) for m in history]
+    if sum(sizes) <= context_token_budget:
+        return list(history)
+
+    # Walk back from the newest message until the budget (minus the summary reserve) is used
+    keep_budget = context_token_budget - summary_token_reserve
+    cut, kept = len(history), 0
+    while cut > 0 and kept + sizes[cut - 1] <= keep_budget:
+        cut -= 1
+        kept += sizes[cut]
+
+    # Align the cut to a whole step so the summary doesn't change on every turn. Round up to stay inside the
+    # budget, unless that would fold the latest message; then round down and go over by less than one step
+    aligned = -(-cut // summary_step) * summary_step
+    cut = aligned if aligned < len(history) else (cut // summary_step) * summary_step
+    if cut <= 0:
+        return list(history)
+
+    lines = ["Summary of the earlier conversation:", rolling_summary(history, cut)]
+    facts = verbatim_facts(history[:cut])
+    if facts:
+        lines += ["", "Earlier messages mentioning an email or a time (verbatim):", *facts]
+    return [{"role": "system", "content": "\n".join(lines)}] + list(history[cut:])
 
 # Classifies the conversation as having a confirmed showing date and time or not
 def classify_showing_confirmation(user_message: str, history: list[dict], listing: dict) -> dict:
@@ -474,15 +1058,17 @@ def classify_showing_confirmation(user_message: str, history: list[dict], listin
     Call the LLM to decide if the conversation has a fully-confirmed showing
     (date, time, place). Returns a strict dict that ALWAYS has the same keys.
     """
-    recent = history
+    recent = fit_history(history)
 
     messages = [
-        {"role": "system", "content": classifier_prompt}
+        {"role": "system", "content": build_classifier_prompt(history)}
     ]
     messages.extend(recent)
 
     try:
-        resp = client.chat.completions.create(
+        resp = call_openai(
+            "classifier",
+            cache = True,
             model = model_name,
             messages = messages,
             temperature = 0,  # classification -> keep deterministic
@@ -502,22 +1088,7 @@ def classify_showing_confirmation(user_message: str, history: list[dict], listin
             out["reason"] = f"Invalid JSON: {raw[:200]}"
             return out
 
-        # Enforce schema completeness & types; fill any missing keys with defaults
-        out = DEFAULT_CONFIRMATION.copy()
-        out.update({
-            "version": data.get("version", "1.0"),
-            "ready": bool(data.get("ready", False)),
-            "user_email": data.get("user_email"),
-            "status": str(data.get("status", "not_ready")),
-            "start_time_iso": data.get("start_time_iso"),
-            "end_time_iso": data.get("end_time_iso"),
-            "timezone": data.get("timezone", default_tz),
-            "location_text": data.get("location_text"),
-            "notes": data.get("notes"),
-            "confidence": float(data.get("confidence", 0.0)),
-            "reason": str(data.get("reason", "No reason provided.")),
-        })
-        return out
+        return normalize_confirmation(data)
 
     except Exception as e:
         # Absolute fail-safe so your app never crashes
@@ -526,6 +1097,106 @@ def classify_showing_confirmation(user_message: str, history: list[dict], listin
         out["reason"] = f"{type(e).__name__}: {str(e)[:200]}"
         return out
 
+# Which backend answers a renter message:
+#   "two_call" - generate_reply (or its streaming version) then classify_showing_confirmation
+#   "combined" - generate_reply_and_classification, one JSON-mode call returning both
+reply_backend = os.environ.get("REPLY_BACKEND", "two_call")
+
+# Writes the reply and classifies the conversation in a single OpenAI call
+def generate_reply_and_classification(user_message: str, history: list[dict], listing: dict, known_facts: str | None = None) -> tuple[str, dict]:
+    """
+    Sends the history once with system_prompt, the listing facts, combined_prompt and the classifier prompt.
+    The model returns {"reply": ..., "confirmation": {...}} and the confirmation goes through the same
+    normalize_confirmation as the two-call path. Always returns a (reply, confirmation) pair.
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": listing_fact_for_llm(listing)},
+    ]
+    if known_facts:
+        messages.append({"role": "system", "content": known_facts})
+    messages.append({"role": "system", "content": combined_prompt + build_classifier_prompt(history)})
+    messages.extend(fit_history(history))
+
+    try:
+        resp = call_openai(
+            "combined",
+            model = model_name,
+            messages = messages,
+            temperature = 0.4,
+            response_format={"type": "json_object"},
+        )
+
+        raw = (resp.choices[0].message.content or "").strip()
+
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            out = DEFAULT_CONFIRMATION.copy()
+            out["notes"] = "combined_json_parse_error"
+            out["reason"] = f"Invalid JSON: {raw[:200]}"
+            return REPLY_FALLBACK, out
+
+        reply = str(data.get("reply") or "").strip() or REPLY_FALLBACK
+        confirmation = data.get("confirmation")
+        if not isinstance(confirmation, dict):
+            out = DEFAULT_CONFIRMATION.copy()
+            out["notes"] = "combined_missing_confirmation"
+            out["reason"] = "Model response had no confirmation object."
+            return reply, out
+
+        return reply, normalize_confirmation(confirmation)
+
+    except Exception as e:
+        # Fail safe so that the app does not crash
+        out = DEFAULT_CONFIRMATION.copy()
+        out["notes"] = "classifier_exception"
+        out["reason"] = f"{type(e).__name__}: {str(e)[:200]}"
+        return REPLY_FALLBACK, out
+
+# Run the classifier on a background thread so the reply is shown without waiting on it
+background_classifier = True
+
+# Thread pool for classifier calls. Cached so one pool is shared by every rerun and session
+@st.cache_resource(show_spinner = False)
+def get_classifier_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers = 4, thread_name_prefix = "classifier")
+
+# Submits the classifier for a chat to the background pool and returns the Future.
+# Time spent waiting for a free worker is recorded separately from the call itself
+def submit_classification(user_message: str, history: list[dict], listing: dict):
+    submitted = time.perf_counter()
+    # Copy the history so later appends on the page don't change what the classifier sees
+    history = list(history)
+
+    def run():
+        latency.observe("classify_queue", time.perf_counter() - submitted, listing["id"])
+        with latency.span("classify", listing["id"]):
+            return classify_showing_confirmation(user_message, history, listing)
+
+    # Run in a copy of this context so the classifier's usage keeps the turn's listing / conversation tags
+    return get_classifier_executor().submit(contextvars.copy_context().run, run)
+
+# Polls a pending classifier Future and picks up its result once it completes
+@st.fragment(run_every = 1)
+def poll_classifier(cls_key: str, future_key: str):
+    """
+    Only this fragment reruns while waiting. When the Future is done the result is stored
+    under cls_key and the whole app reruns so the invite step can act on it.
+    """
+    future = st.session_state.get(future_key)
+    if future is None or not future.done():
+        return
+
+    try:
+        cls_result = future.result()
+    except Exception as e:
+        cls_result = DEFAULT_CONFIRMATION
+    st.session_state[cls_key] = cls_result
+    st.session_state[future_key] = None
+    latency.finish_open_spans()
+    st.rerun()
+
 
 # Sends calendar invite by hitting SendGrid API
 def send_email_sendgrid(
@@ -539,23 +1210,17 @@ def send_email_sendgrid(
         """
         Sends a plain text email with an ics calendar attachment via SendGrid
         Raises urllib.error.HTTPError on non-2xx responses
+        Goes through the shared SendGridConnection, so sends reuse one keep-alive connection
         """
         
-        # 1. Endpoin and auth
-        url = "https://api.sendgrid.com/v3/mail/send"
-        headers = {
-            "Authorization": f"Bearer {SENDGRID_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        # 2. Build the JSON payload to sent to SendGrid
+        # 1. Build the JSON payload to sent to SendGrid
         payload = {
             "personalizations": [{"to": [{"email": to_email}]}],
             "from": {"email": from_email},
             "subject": subject,
             "content": [{"type": "text/plain", "value": body_text}],
             
-            # 3. Attach the ics (base64 encoded)
+            # 2. Attach the ics (base64 encoded)
             "attachments": [
                 {
                     "content": base64.b64encode(ics_text.encode("utf-8")).decode("utf-8"),
@@ -566,20 +1231,177 @@ def send_email_sendgrid(
             ],
         }
         
-        # 4. Make the request
-        req = urllib.request.Request(
-            url = url,
-            method = "POST",
-            headers = headers,
-            data = json.dumps(payload).encode("utf-8")
+        # 3. Send it; surfaces any HTTP errors. The timeout is on the HTTP request itself
+        get_sendgrid_connection().post(payload)
+
+# Sends SendGrid mail/send requests over one keep-alive HTTP(S) connection shared by the process.
+# Sends are serialized on the connection; each one is still its own request, since every invite is
+# different (UID, timestamp, attendee)
+class SendGridConnection:
+    def __init__(self, url: str, api_key: str | None, timeout: float):
+        parts = urllib.parse.urlsplit(url)
+        self.url = url
+        self.https = parts.scheme == "https"
+        self.host = parts.netloc
+        self.path = parts.path or "/"
+        self.api_key = api_key
+        self.timeout = timeout
+        self.conn = None
+        self.lock = threading.Lock()
+        self.metrics = {"emails": 0, "failed": 0, "reconnects": 0}
+        self.latencies_ms = deque(maxlen = 200)
+
+    def connect(self):
+        conn_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return conn_class(self.host, timeout = self.timeout)
+
+    # True if the idle connection was closed (or sent something) since its last response, so it can't be reused
+    def is_stale(self) -> bool:
+        sock = self.conn.sock
+        return sock is not None and bool(select.select([sock], [], [], 0)[0])
+
+    def close(self):
+        self.conn.close()
+        self.conn = None
+
+    # POSTs on the persistent connection. Only retries when nothing was written: a stale idle socket is
+    # replaced before sending, and CannotSendRequest is raised before the request goes out. Any error after
+    # that is raised, since the email may have been sent; the outbox's idempotency key handles the retry
+    def post(self, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        with self.lock:
+            started = time.perf_counter()
+            try:
+                for attempt in range(2):
+                    if self.conn is not None and self.is_stale():
+                        self.close()
+                        self.metrics["reconnects"] += 1
+                    if self.conn is None:
+                        self.conn = self.connect()
+                    try:
+                        self.conn.request("POST", self.path, body = body, headers = headers)
+                    except http.client.CannotSendRequest:
+                        self.close()
+                        self.metrics["reconnects"] += 1
+                        if attempt == 1:
+                            raise
+                        continue
+                    except Exception:
+                        self.close()
+                        raise
+                    try:
+                        resp = self.conn.getresponse()
+                        resp.read()
+                    except Exception:
+                        self.close()
+                        raise
+                    # SendGrid will typically return 202 on success
+                    if resp.status not in (200, 202):
+                        raise urllib.error.HTTPError(self.url, resp.status, "Unexpected Status", resp.headers, None)
+                    self.metrics["emails"] += 1
+                    return
+            except Exception:
+                self.metrics["failed"] += 1
+                raise
+            finally:
+                self.latencies_ms.append((time.perf_counter() - started) * 1000)
+
+    # Per-send latency percentiles and counters for the sidebar
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies_ms)
+        out = dict(self.metrics)
+        if latencies:
+            out["p50_ms"] = round(latencies[len(latencies) // 2], 1)
+            out["max_ms"] = round(latencies[-1], 1)
+        return out
+
+@st.cache_resource(show_spinner = False)
+def get_sendgrid_connection() -> SendGridConnection:
+    return SendGridConnection(SENDGRID_API_URL, SENDGRID_API_KEY, sendgrid_timeout)
+
+
+# Builds the ICS for a queued invite and sends it through SendGrid (raises on failure); called by the invite
+# outbox worker threads (invite_outbox.py)
+def deliver_invite(payload: dict):
+    listing_id = payload.get("listing_id", "")   # invites queued before listing ids were stored have none
+    with latency.span("make_ics_invite", listing_id):
+        ics_filename, ics_text = make_ics_invite(
+            start_time_iso = payload["start_time_iso"],
+            end_time_iso = payload["end_time_iso"],
+            title = payload["title"],
+            organizer_email = SENDGRID_FROM_EMAIL,
+            attendee_email = payload["user_email"],
+            location = payload["location"],
+            description = payload["description"]
         )
-        
-        # 5. Send and surface any HTTP errors
-        with urllib.request.urlopen(req) as resp:
-            # SendGrid will typically return 202 on success
-            if resp.status not in (200, 202):
-                raise urllib.error.HTTPError(url, resp.status, "Unexpected Status", resp.headers, None)
-            
+    with latency.span("send", listing_id):
+        send_email_sendgrid(
+            to_email = payload["user_email"],
+            subject = payload["subject"],
+            body_text = payload["body_text"],
+            ics_filename = ics_filename,
+            ics_text = ics_text,
+            from_email = SENDGRID_FROM_EMAIL
+        )
+
+@st.cache_resource(show_spinner = False)
+def get_invite_outbox() -> InviteOutbox:
+    return InviteOutbox(OUTBOX_PATH, deliver_invite, outbox_workers)
+
+# Showing slots offered to the reply bot; bookings, conflict checks and showing hours are in showings.py
+free_slot_count = 6          # free slots offered to the reply bot
+free_slot_days = 7           # how far ahead to look for free slots
+free_slot_lead_minutes = 120 # earliest offered slot is at least this far from now
+
+@st.cache_resource(show_spinner = False)
+def get_availability_store() -> AvailabilityStore:
+    return AvailabilityStore(SHOWINGS_PATH, default_tz)
+
+# Next open showing slots for a listing, starting a little after now
+def next_free_slots(listing: dict) -> list[datetime]:
+    now = local_now()
+    return get_availability_store().free_slots(
+        listing["id"], listing_agent(listing),
+        now + timedelta(minutes = free_slot_lead_minutes), now + timedelta(days = free_slot_days), free_slot_count,
+    )
+
+# e.g. "Tue Nov 4, 3:00 PM"
+def format_slot(slot: datetime) -> str:
+    return f"{slot:%a %b} {slot.day}, {slot.hour % 12 or 12}:{slot:%M %p}"
+
+# Compact list of open showing slots for the reply prompt
+def free_slots_for_llm(listing: dict) -> str:
+    slots = next_free_slots(listing)
+    if not slots:
+        return "Open showing slots: none in the next week. Offer to check with the agent for other times."
+    listed = "; ".join(format_slot(slot) for slot in slots)
+    return f"Open showing slots ({showing_minutes} min, {default_tz}). Only propose times from this list: {listed}"
+
+# Human readable invite status for the page and sidebar
+def describe_invite_status(row: dict | None, user_email: str) -> str:
+    if row is None:
+        return "Not queued"
+    if row["status"] == "sent":
+        return f"Sent to {user_email}"
+    if row["status"] == "dead":
+        return f"Failed after {row['attempts']} attempts: {row['last_error']}"
+    if row["attempts"]:
+        return f"Retrying (attempt {row['attempts'] + 1}) - last error: {row['last_error']}"
+    return f"Queued for {user_email}"
+
+# Shows the invite status and refreshes it until the outbox reaches a final state
+@st.fragment(run_every = 2)
+def poll_invite_status(outbox_key: str, user_email: str, invite_status_key: str):
+    row = get_invite_outbox().status(outbox_key)
+    status = describe_invite_status(row, user_email)
+    if row and row["status"] in ("sent", "dead"):
+        # Final state: store it and rerun the app once so the sidebar and page show it without polling
+        st.session_state[invite_status_key] = status
+        st.rerun()
+    st.info(status)
+
+profiler.mark("1D helpers")
 
 
 #-------------------------------------------------------------
@@ -624,21 +1446,38 @@ st.markdown(
         width: 100%; height: 160px; border-radius: 12px; object-fit: cover;
         background: #e9eef7;
       }
+      .grid {
+        display: grid; grid-template-columns: repeat(3, minmax(0, 1fr)); gap: 16px;
+        margin-bottom: 16px;
+      }
+      .pager {
+        display: flex; justify-content: space-between; align-items: center;
+        color: #6B7280; margin: 8px 0 16px 0;
+      }
+      .pager-link { font-weight: 700; color: #1E3A8A !important; text-decoration: none; }
+      .pager-off { color: #D1D5DB; }
       @media (max-width: 900px) {
         .thumb { height: 140px; }
+        .grid { grid-template-columns: repeat(2, minmax(0, 1fr)); }
+      }
+      @media (max-width: 600px) {
+        .grid { grid-template-columns: minmax(0, 1fr); }
       }
     </style>
     """,
     unsafe_allow_html=True,
 )
 
+profiler.mark("2 css")
+
+
 #-------------------------------------------------------------
 #-------------------------------------------------------------
 # 3. Fake data 
 # Creates dummy data to reference in page elements & code 
-# This is a Python list of dictionaries. Scalable solution would be to replace this with a real table (e.g., Supabase or Postgres)
+# Listings live in a SQLite listing repository (listing_repository.py); this list only seeds it when it is empty
 
-listings = [
+seed_listings = [
   {
     "id": "medford-1a",
     "address": "105 Burget Ave",
@@ -694,6 +1533,24 @@ listings = [
   },
 ]
 
+# One repository per process, seeded with the demo listings on first use. Reads come from its in-memory
+# index, which reloads whenever the repository's version changes (i.e. after any write)
+@st.cache_resource(show_spinner = False)
+def get_listing_repository() -> ListingRepository:
+    repo = ListingRepository(LISTINGS_PATH)
+    repo.seed(seed_listings)
+    return repo
+
+listing_repo = get_listing_repository()
+
+# One conversation store per process (conversation_store.py). Chat history lives there instead of in
+# st.session_state, so it survives refreshes and restarts and idle histories can leave memory
+@st.cache_resource(show_spinner = False)
+def get_conversation_store() -> ConversationStore:
+    return ConversationStore(CONVERSATIONS_PATH)
+
+profiler.mark("3 listings")
+
 
 #-------------------------------------------------------------
 #-------------------------------------------------------------
@@ -705,6 +1562,8 @@ params = st.query_params #creates a dictionary equal to the current URL paramete
 current_page = params.get("page", "home") #gets the current page from URL parameters. If none, defaults to "home"
 selected_id = params.get("id", None) #gets the current id from URL parameters. If non, defaults to "none"
 
+profiler.mark("4 routing")
+
 
 #-------------------------------------------------------------
 #-------------------------------------------------------------
@@ -718,31 +1577,482 @@ def go_to_chat(lid):
 def go_home():
   st.query_params.clear()
 
+profiler.mark("5 navigation")
+
 
 #-------------------------------------------------------------
 #-------------------------------------------------------------
 # 6. Card renderer
-# A single funciton that takes a "row" (l) from "Listings" and renders the styled card. Uses configurations by class as defined in section 2 above.
+# Builds the HTML for a single "row" (l) from "Listings" as one styled card. Uses configurations by class as defined in section 2 above.
+# Cards are cached per listing and a whole page of them is sent as one st.markdown block, instead of eight Streamlit elements per card.
+
+# Default and maximum number of cards per home page (page size can be set with ?size=)
+home_page_size = 9
+home_max_page_size = 60
+
+# Listing photos. Local image files (img = a file name in images/) are resized into content-hashed
+# thumbnails under static/thumbs (see thumbnails.py); remote URLs that take a width parameter (Unsplash's w=)
+# are asked for the same widths instead of the full-size photo. Listings without a photo get a placeholder.
+@st.cache_resource(show_spinner = False)
+def get_thumbnail_store() -> ThumbnailStore:
+    return ThumbnailStore()
+
+PLACEHOLDER_IMG = "data:image/svg+xml," + urllib.parse.quote(
+    '<svg xmlns="http://www.w3.org/2000/svg" width="640" height="320" viewBox="0 0 640 320">'
+    '<rect width="640" height="320" fill="#e9eef7"/>'
+    '<text x="320" y="168" font-family="sans-serif" font-size="22" fill="#9CA3AF" text-anchor="middle">No photo yet</text>'
+    '</svg>'
+)
 
-def render_card(l):
-    with st.container(border=False):
-        st.markdown('<div class="card">', unsafe_allow_html=True)
-        st.markdown(f'<img class="thumb" src="{l["img"]}" alt="Listing photo">', unsafe_allow_html=True)
-        st.markdown(f'<div class="addr">📍 {l["address"]}</div>', unsafe_allow_html=True)
-        st.markdown(f'<div class="neigh">{l["neighborhood"]}</div>', unsafe_allow_html=True)
-        st.markdown(f'<div class="price">${l["rent"]:,}/mo</div>', unsafe_allow_html=True)
-        st.markdown('<div class="meta">🛏️ ' + str(l["beds"]) + ' bed &nbsp; • &nbsp; 🛁 ' + str(l["baths"]) + ' bath</div>', unsafe_allow_html=True)
-        st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
+# How wide a card photo is drawn at each breakpoint of the .grid layout in section 2
+card_image_sizes = "(max-width: 600px) 100vw, (max-width: 900px) 50vw, 360px"
+
+# Returns the <img> (or <picture>) markup for a listing photo, with srcset, explicit dimensions and lazy loading
+def listing_image_html(l: dict, sizes: str = card_image_sizes, lazy: bool = True) -> str:
+    img = l.get("img")
+    loading = ' loading="lazy" decoding="async"' if lazy else ''
+    default_w, default_h = THUMBNAIL_WIDTHS[1], round(THUMBNAIL_WIDTHS[1] / THUMBNAIL_ASPECT)
+
+    thumbs = get_thumbnail_store().resolve(img)
+    if thumbs:
+        def srcset(ext):
+            return ", ".join(f"{THUMBNAIL_URL}{name} {w}w" for w, _, name in thumbs["variants"][ext])
+        w, h, name = next((v for v in thumbs["variants"]["jpg"] if v[0] >= default_w), thumbs["variants"]["jpg"][-1])
+        return (
+            '<picture>'
+            f'<source type="image/webp" srcset="{srcset("webp")}" sizes="{sizes}">'
+            f'<img class="thumb" src="{THUMBNAIL_URL}{name}" srcset="{srcset("jpg")}" sizes="{sizes}" '
+            f'width="{w}" height="{h}" alt="Listing photo"{loading}>'
+            '</picture>'
+        )
 
+    if img and img.startswith(("http://", "https://")):
+        parts = urllib.parse.urlsplit(img)
+        query = urllib.parse.parse_qs(parts.query)
+        if "w" in query:
+            def at_width(w):
+                return urllib.parse.urlunsplit(parts._replace(query = urllib.parse.urlencode({**query, "w": w}, doseq = True)))
+            srcset = ", ".join(f"{html.escape(at_width(w))} {w}w" for w in THUMBNAIL_WIDTHS)
+            return (f'<img class="thumb" src="{html.escape(at_width(default_w))}" srcset="{srcset}" sizes="{sizes}" '
+                    f'width="{default_w}" height="{default_h}" alt="Listing photo"{loading}>')
+        return f'<img class="thumb" src="{html.escape(img)}" width="{default_w}" height="{default_h}" alt="Listing photo"{loading}>'
+
+    return f'<img class="thumb" src="{PLACEHOLDER_IMG}" width="{default_w}" height="{default_h}" alt="No photo available">'
+
+@st.cache_data(max_entries = 5000, show_spinner = False)
+def card_html(l: dict) -> str:
+    # Single line on purpose: indented lines would be rendered by markdown as a code block
+    return (
+        '<div class="card">'
+        f'{listing_image_html(l)}'
+        f'<div class="addr">📍 {html.escape(l["address"])}</div>'
+        f'<div class="neigh">{html.escape(l["neighborhood"])}</div>'
+        f'<div class="price">${l["rent"]:,}/mo</div>'
+        f'<div class="meta">🛏️ {l["beds"]} bed &nbsp; • &nbsp; 🛁 {l["baths"]} bath</div>'
+        '<div class="divider"></div>'
         # Keep same blue button style (exact). This button is actually an HTML link to be able to format it in a custom way.
-        st.markdown(
-            f"""
-            <a class="btn" href="?page=chat&id={l['id']}" target="_self">Chat about this listing</a>
-            """,
-            unsafe_allow_html=True
+        f'<a class="btn" href="?page=chat&id={urllib.parse.quote(l["id"])}" target="_self">Chat about this listing</a>'
+        '</div>'
+    )
+
+# Renders one page of cards as a single HTML grid, plus previous / next links
+def render_listing_grid(listing_ids: list[str], page_number: int, page_size: int):
+    page_count = max(1, -(-len(listing_ids) // page_size))
+    page_number = min(max(1, page_number), page_count)
+    page_listings = [listing_repo.get(i) for i in listing_ids[(page_number - 1) * page_size : page_number * page_size]]
+
+    # Pager links keep every other query param (filters, page size) and only change the page number
+    current = {k: st.query_params.get_all(k) for k in st.query_params}
+
+    def page_link(n: int, label: str) -> str:
+        if n < 1 or n > page_count or n == page_number:
+            return f'<span class="pager-off">{label}</span>'
+        href = "?" + urllib.parse.urlencode({**current, "p": n, "size": page_size}, doseq = True)
+        return f'<a class="pager-link" href="{html.escape(href)}" target="_self">{label}</a>'
+
+    pager = (
+        '<div class="pager">'
+        f'{page_link(page_number - 1, "← Previous")}'
+        f'<span>Page {page_number} of {page_count} · {len(listing_ids):,} listings</span>'
+        f'{page_link(page_number + 1, "Next →")}'
+        '</div>'
+    )
+    if not page_listings:
+        st.info("No listings match these filters.")
+        return
+    st.markdown(
+        '<div class="grid">' + "".join(card_html(l) for l in page_listings if l) + '</div>' + (pager if page_count > 1 else ""),
+        unsafe_allow_html=True,
+    )
+
+# Columnar copy of the listings for the home page filters. Keyed by the repository version, so it is
+# rebuilt only when listings change. A shared resource rather than cache_data, which would unpickle a copy
+# of the whole frame on every rerun; filter_listing_ids only reads it
+@st.cache_resource(max_entries = 4, show_spinner = False)
+def listings_frame(version: int) -> pd.DataFrame:
+    df = pd.DataFrame(listing_repo.all(), columns = ["id", "neighborhood", "rent", "beds", "baths", "pets", "moveindate"])
+    df["neighborhood"] = df["neighborhood"].astype("category")
+    df["pets_allowed"] = df["pets"].str.lower().eq("yes")
+    df["moveindate"] = pd.to_datetime(df["moveindate"], format = "%m-%d-%Y", errors = "coerce")
+    df["position"] = range(len(df))
+    return df.drop(columns = ["pets"])
+
+LISTING_SORTS = {
+    "Featured": ("position", True),
+    "Rent: low to high": ("rent", True),
+    "Rent: high to low": ("rent", False),
+    "Move-in date": ("moveindate", True),
+}
+
+# Applies the home page filters as vectorized masks and returns the matching listing ids in sort order
+def filter_listing_ids(
+    df: pd.DataFrame,
+    *,
+    rent_range: tuple[int, int] | None = None,
+    min_beds: int = 0,
+    min_baths: float = 0,
+    neighborhoods: list[str] | None = None,
+    pets_only: bool = False,
+    move_in_before: date | None = None,
+    sort: str = "Featured") -> list[str]:
+        mask = np.ones(len(df), dtype = bool)
+        if rent_range:
+            rent = df["rent"].to_numpy()
+            mask &= (rent >= rent_range[0]) & (rent <= rent_range[1])
+        if min_beds:
+            mask &= df["beds"].to_numpy() >= min_beds
+        if min_baths:
+            mask &= df["baths"].to_numpy() >= min_baths
+        if neighborhoods:
+            mask &= df["neighborhood"].isin(neighborhoods).to_numpy()
+        if pets_only:
+            mask &= df["pets_allowed"].to_numpy()
+        if move_in_before:
+            mask &= (df["moveindate"] <= pd.Timestamp(move_in_before)).to_numpy()
+
+        column, ascending = LISTING_SORTS.get(sort, LISTING_SORTS["Featured"])
+        matches = df.loc[mask, ["id", column]]
+        if column != "position":
+            matches = matches.sort_values(column, ascending = ascending, kind = "stable")
+        return matches["id"].tolist()
+
+# Home page filters are kept in the URL like the rest of the routing, so pager links carry them.
+# Each widget writes its value back to the query params and resets the page number when it changes
+def sync_filter_param(key: str):
+    value = st.session_state[key]
+    param = key.removeprefix("f_")
+    if isinstance(value, (list, tuple)) and param == "rent":
+        st.query_params[param] = f"{value[0]}-{value[1]}"
+    elif isinstance(value, list):
+        st.query_params[param] = value
+    elif isinstance(value, date):
+        st.query_params[param] = value.isoformat()
+    elif isinstance(value, bool):
+        st.query_params[param] = "1" if value else "0"
+    elif value is None:
+        st.query_params.pop(param, None)
+    else:
+        st.query_params[param] = str(value)
+    st.query_params["p"] = "1"
+
+# Reads a filter's starting value from the query params, falling back to default on anything malformed
+def filter_param(param: str, parse, default):
+    try:
+        raw = st.query_params.get_all(param) if parse is list else st.query_params.get(param)
+        return parse(raw) if raw not in (None, "", []) else default
+    except (TypeError, ValueError):
+        return default
+
+# Filter bar above the grid; returns the ids of the matching listings
+def render_listing_filters(df: pd.DataFrame) -> list[str]:
+    rent_floor = int(df["rent"].min()) if len(df) else 0
+    rent_ceiling = int(df["rent"].max()) if len(df) else 0
+    neighborhoods = sorted(df["neighborhood"].cat.categories.tolist())
+
+    cols = st.columns([3, 1, 1, 2, 2, 2])
+    with cols[0]:
+        rent_range = st.slider(
+            "Rent ($/mo)", rent_floor, max(rent_ceiling, rent_floor + 1),
+            filter_param("rent", lambda v: tuple(int(x) for x in v.split("-", 1)), (rent_floor, max(rent_ceiling, rent_floor + 1))),
+            step = 50, key = "f_rent", on_change = sync_filter_param, args = ("f_rent",),
         )
+    with cols[1]:
+        min_beds = st.selectbox("Beds", [0, 1, 2, 3, 4], index = filter_param("beds", lambda v: [0, 1, 2, 3, 4].index(int(v)), 0),
+                                format_func = lambda n: "Any" if n == 0 else f"{n}+", key = "f_beds",
+                                on_change = sync_filter_param, args = ("f_beds",))
+    with cols[2]:
+        min_baths = st.selectbox("Baths", [0, 1, 2, 3], index = filter_param("baths", lambda v: [0, 1, 2, 3].index(int(v)), 0),
+                                 format_func = lambda n: "Any" if n == 0 else f"{n}+", key = "f_baths",
+                                 on_change = sync_filter_param, args = ("f_baths",))
+    with cols[3]:
+        chosen = st.multiselect("Neighborhood", neighborhoods,
+                                default = [n for n in filter_param("hood", list, []) if n in neighborhoods],
+                                key = "f_hood", on_change = sync_filter_param, args = ("f_hood",))
+    with cols[4]:
+        move_in_before = st.date_input("Move in by", value = filter_param("movein", date.fromisoformat, None),
+                                       key = "f_movein", on_change = sync_filter_param, args = ("f_movein",))
+        pets_only = st.checkbox("Pets allowed", value = filter_param("pets", lambda v: v == "1", False),
+                                key = "f_pets", on_change = sync_filter_param, args = ("f_pets",))
+    with cols[5]:
+        sorts = list(LISTING_SORTS)
+        sort = st.selectbox("Sort by", sorts, index = filter_param("sort", sorts.index, 0),
+                            key = "f_sort", on_change = sync_filter_param, args = ("f_sort",))
+
+    return filter_listing_ids(
+        df,
+        rent_range = rent_range if rent_range != (rent_floor, max(rent_ceiling, rent_floor + 1)) else None,
+        min_beds = min_beds,
+        min_baths = min_baths,
+        neighborhoods = chosen,
+        pets_only = pets_only,
+        move_in_before = move_in_before,
+        sort = sort,
+    )
+
+# Reruns only the chat area when it is running as a fragment. A chat message submitted during a whole-app run
+# (and every AppTest run) can't use scope="fragment", so that reruns the app instead
+def rerun_chat_area():
+    # The turn / chat_rerun spans end here; st.rerun() raises, which would leave them unrecorded
+    latency.finish_open_spans()
+    ctx = get_script_run_ctx()
+    st.rerun(scope = "fragment" if ctx and ctx.fragment_ids_this_run else "app")
+
+# Picks the conversation shown on a listing's chat page: the one in the URL (?c=...), else the one this
+# session already has for the listing, else a new one starting with the greeting. The id is put in the URL
+# so a refresh or a restart resumes the same chat
+def open_listing_conversation(l: dict) -> str:
+    store = get_conversation_store()
+    session_key = f"{chat_key(l['id'])}_conversation"
+    requested = st.query_params.get("c") or st.session_state.get(session_key)
+    conversation = store.open(requested, l["id"]) if requested else None
+    if conversation is None:
+        conversation = store.create(l["id"], [{
+            "role": "assistant",
+            "content": (
+                f"Hi! Thanks for your interest in **{l['address']}**.\n\n "
+                "Chat here to get started on scheduling a tour."
+            ),
+        }])
+    st.session_state[session_key] = conversation.id
+    if st.query_params.get("c") != conversation.id:
+        st.query_params["c"] = conversation.id
+    return conversation.id
+
+# Chat area for one listing: history, input, invite status and classifier debug.
+# Runs as a fragment, so sending a message only reruns this function instead of the whole script
+# (CSS, prompts, sidebar and listing header are left as they are). A finished background classifier
+# still reruns the whole app from poll_classifier.
+@st.fragment
+def chat_area(l: dict, conversation_id: str):
+    # Fragment reruns don't reach the end of the script, so they are timed here
+    with latency.span("chat_rerun", l["id"]):
+        render_chat_area(l, conversation_id)
+
+def render_chat_area(l: dict, conversation_id: str):
+    conversations = get_conversation_store()
+    # Loaded from disk again if it was evicted from memory since the last run
+    conversation = conversations.open(conversation_id, l["id"])
+    if conversation is None:
+        st.warning("This conversation is no longer available.")
+        return
+    history = conversation.messages
+
+    # Session state keys for this chat
+    key = chat_key(l["id"])
+    cls_key = f"{key}_classifier_result"             # latest classifier result
+    invite_key = f"{key}_invite_sent"                # whether the invite has been handed off
+    qual_key = f"{key}_qualification"                # lead qualification state (occupants, pets, move in date)
+    pregate_key = f"{key}_pregate"                   # scan state for the local classifier pre-gate
+    future_key = f"{key}_classifier_future"          # pending background classifier call (if any)
+    invite_status_key = f"{key}_invite_status"
+    outbox_key_key = f"{key}_invite_outbox_key"      # outbox idempotency key (and email) of the queued invite
+
+    # Start from the stored state the first time this conversation is shown in the session. Qualification and
+    # pre-gate state are rebuilt by rescanning the history
+    if st.session_state.get(f"{key}_loaded") != conversation.id:
+        saved = conversation.state
+        st.session_state[cls_key] = saved.get("classifier_result")
+        st.session_state[invite_key] = saved.get("invite_sent", False)
+        st.session_state[invite_status_key] = saved.get("invite_status")
+        st.session_state[outbox_key_key] = saved.get("invite_outbox_key")
+        st.session_state[qual_key] = new_qualification_state()
+        st.session_state[pregate_key] = {"scanned": 0, "has_email": False, "has_time": False}
+        st.session_state[future_key] = None
+        st.session_state[f"{key}_loaded"] = conversation.id
+
+    # Keeps the stored state in step with the session (only written when something changed)
+    def save_chat_state():
+        conversations.save_state(conversation, {
+            "classifier_result": st.session_state[cls_key],
+            "invite_sent": st.session_state[invite_key],
+            "invite_status": st.session_state[invite_status_key],
+            "invite_outbox_key": st.session_state[outbox_key_key],
+        })
+
+    # Picks up changes made just before the last rerun (classifier poller, invite status poller)
+    save_chat_state()
+
+    # Show all messages as chat bubbles
+    for msg in history:
+        #msg["role"] is either "assistant" or "user"
+        with st.chat_message(msg["role"]):
+            #msg["content"] is the text to display
+            st.markdown(msg["content"])
+
+    # Chat input at the bottom of the page
+    user_msg = st.chat_input(placeholder = "Hi, I'm interested in this apartment!")
+
+    # If the user types a message and hit enter
+    if user_msg:
+        # The whole turn, from the message to the rerun that shows the reply
+        with latency.span("turn", l["id"]), usage_tagged(listing_id = l["id"], conversation_id = conversation.id):
+            # 1 - Save the user's message to history
+            conversations.append(conversation, {"role": "user", "content": user_msg})
+            with st.chat_message("user"):
+                st.markdown(user_msg)
+
+            # 2 - Create the automatic reply & save to history
+            # Update what we know about the renter; a clear hard-requirement failure is declined locally
+            qualification = update_qualification(st.session_state[qual_key], history, local_now().date())
+            decline = qualification_decline(qualification, l)
+            known_facts = qualification_facts_for_llm(qualification, l) + "\n" + free_slots_for_llm(l)
+
+            # Simple listing-fact questions are answered locally, without an LLM call
+            routed_reply = None if decline else route_listing_question(user_msg, l)
+            if decline is not None:
+                assistant_reply = decline
+            elif routed_reply is not None:
+                assistant_reply = routed_reply
+            elif reply_backend == "combined":
+                # One call returns both the reply and the classifier result
+                with st.spinner("Typing..."), latency.span("generate_reply_and_classification", l["id"]):
+                    assistant_reply, cls_result = generate_reply_and_classification(user_msg, history, l, known_facts)
+                conversations.append(conversation, {"role": "assistant", "content": assistant_reply})
+                st.session_state[cls_key] = cls_result
+                rerun_chat_area()
+            elif stream_replies:
+                # Render partial tokens as they arrive, then keep the final text
+                with st.chat_message("assistant"), latency.span("generate_reply", l["id"]):
+                    reply_box = st.empty()
+                    assistant_reply = REPLY_FALLBACK
+                    reply_started = time.perf_counter()
+                    for partial in generate_reply_stream(user_msg, history, l, known_facts):
+                        if reply_started is not None:
+                            latency.observe("reply_first_token", time.perf_counter() - reply_started, l["id"])
+                            reply_started = None
+                        assistant_reply = partial
+                        reply_box.markdown(partial)
+            else:
+                with latency.span("generate_reply", l["id"]):
+                    assistant_reply = generate_reply(user_msg, history, l, known_facts)
+            conversations.append(conversation, {"role": "assistant", "content": assistant_reply})
+
+            # 3 - Run the classifier bot on the conversation to determine whether or not the user has confirmed a time
+            # Skip the LLM entirely while there is no email or no time to confirm
+            gated = pregate_confirmation(history, st.session_state[pregate_key], DEFAULT_CONFIRMATION)
+            if decline is not None:
+                # Disqualified leads don't get a showing, so there is nothing to classify
+                gated = DEFAULT_CONFIRMATION.copy()
+                gated.update({"notes": "lead_disqualified", "confidence": 1.0, "reason": decline})
+            if gated is not None:
+                st.session_state[cls_key] = gated
+            elif background_classifier:
+                # Picked up by poll_classifier below once it completes
+                st.session_state[future_key] = submit_classification(user_msg, history, l)
+            else:
+                try:
+                    with latency.span("classify", l["id"]):
+                        cls_result = classify_showing_confirmation(user_msg, history, l)
+                except Exception as e:
+                    cls_result = DEFAULT_CONFIRMATION
+
+                st.session_state[cls_key] = cls_result
+
+            # 4 - Immediately re-run the chat area so the new bubble appears above
+            rerun_chat_area()
+
+    # Wait for a background classifier result without blocking the rest of the page
+    if st.session_state[future_key] is not None:
+        poll_classifier(cls_key, future_key)
+
+    # Queue the email invitation if user is ready. The outbox workers send it; the page only shows status
+    result = st.session_state.get(cls_key)
+    if result and (result.get("ready") is True) and (st.session_state[invite_key] is False):
+        user_email = result.get("user_email")
+        start_iso = result.get("start_time_iso")
+        outbox_key = invite_idempotency_key(l["id"], user_email, start_iso)
+
+        # Book the slot first; if someone else got it, offer the next open times instead of sending
+        if not get_availability_store().book(l["id"], listing_agent(l), start_iso, result.get("end_time_iso"), outbox_key):
+            slots = next_free_slots(l)
+            alternatives = (f"The next open times are {'; '.join(format_slot(slot) for slot in slots)}. Would any of these work?"
+                            if slots else "I'll check with the agent for other times this week.")
+            conversations.append(conversation, {
+                "role": "assistant",
+                "content": f"Sorry, that time was just booked by someone else. {alternatives}",
+            })
+            st.session_state[cls_key] = None
+            rerun_chat_area()
+
+        try:
+            get_invite_outbox().enqueue(outbox_key, {
+                "listing_id": l["id"],
+                "user_email": user_email,
+                "start_time_iso": start_iso,
+                "end_time_iso": result.get("end_time_iso"),
+                "location": l["address"],
+                "title": "Test showing",
+                "description": "A calendar invite to demonstrate functionality",
+                "subject": "Test invite - Andres app",
+                "body_text": f"Your showing starts at {start_iso}",
+            })
+            st.session_state[outbox_key_key] = (outbox_key, user_email)
+            st.session_state[invite_status_key] = f"Queued for {user_email}"
+            # Track that the invite has been handed off. Only once queued: a failed enqueue is tried again on
+            # the next rerun (the booking and idempotency key are reused) and never counts as a sent invite
+            st.session_state[invite_key] = True
+        except Exception as e:
+            err = f"{type(e).__name__}: {str(e)[:300]}"
+            st.error(f"Invite faled to queue - {err}")
+            st.session_state[invite_status_key] = f"Failed: {err}"
+
+    # Keep showing the outbox status until the invite is sent or dead-lettered
+    queued = st.session_state.get(outbox_key_key)
+    if queued:
+        status = st.session_state.get(invite_status_key) or ""
+        if status.startswith("Sent"):
+            st.success(status)
+        elif status.startswith("Failed"):
+            st.error(f"Invite failed to send - {status}")
+        else:
+            poll_invite_status(queued[0], queued[1], invite_status_key)
+
+    # Classifier results for debugging. Shown under the chat rather than in the sidebar, since a
+    # fragment can only write to its own container
+    if st.session_state.get("show_cls_debug", True):
+        with st.expander("Showing confirmation (debug)", expanded = False):
+            latest = st.session_state.get(cls_key)
+            if latest:
+                st.code(json.dumps(latest, indent = 2, ensure_ascii = False), language = "json")
+            else:
+                st.caption("No classifier result yet.")
+            status = st.session_state.get(invite_status_key)
+            if status:
+                st.caption(f"Invite status: {status}")
+            st.caption("LLM cache: " + ", ".join(f"{k} {v}" for k, v in get_llm_cache().stats.items()))
+            st.caption("OpenAI queue: " + ", ".join(f"{k} {v}" for k, v in get_openai_scheduler().summary().items()))
+            st.caption("SendGrid: " + ", ".join(f"{k} {v}" for k, v in get_sendgrid_connection().stats().items()))
+            st.caption("Classifier prompt tokens: " + ", ".join(f"{k} {v}" for k, v in classifier_prompt_report().items()))
+            st.caption("Conversations: " + ", ".join(f"{k} {v}" for k, v in conversations.summary().items()))
+            usage = get_usage_ledger().summary()
+            if usage:
+                st.caption("OpenAI usage (this process)")
+                st.dataframe(usage, hide_index = True, use_container_width = True)
+
+    save_chat_state()
+
+profiler.mark("6 card renderer")
 
-        st.markdown('</div>', unsafe_allow_html=True)
 
 #-------------------------------------------------------------
 #-------------------------------------------------------------
@@ -787,24 +2097,30 @@ with st.sidebar.expander("DEV - Send a test invite", expanded = False):
                 st.error(f"Send failed: {type(e).__name__}: {str(e)[:300]}") 
  
 
+profiler.mark("sidebar")
+
+
 #-------------------------------------------------------------
 #-------------------------------------------------------------
 # 7A. Home page
-# Creates a 3-column grid, with two rows (top and bottom) each showing listings using render_card function defined above. Title and sub-title are HTML blocks styled by CSS
+# Creates a paginated 3-column grid of listing cards (render_listing_grid defined above). Title and sub-title are HTML blocks styled by CSS
 
 if current_page == "home":
     st.markdown('<div class="site-title">bostonrentals.com</div>', unsafe_allow_html=True)
     st.markdown('<div class="site-sub">Hand-picked apartments across Boston — mock demo</div>', unsafe_allow_html=True)
 
-    cols_top = st.columns(3)
-    for i, l in enumerate(listings[:3]):
-        with cols_top[i]:
-            render_card(l)
+    # Filter bar, backed by a cached DataFrame of the listings
+    listing_repo.refresh()
+    listing_ids = render_listing_filters(listings_frame(listing_repo.version))
 
-    cols_bottom = st.columns(3)
-    for i, l in enumerate(listings[3:]):
-        with cols_bottom[i]:
-            render_card(l)
+    # Page number and page size come from the URL (?p=2&size=9)
+    try:
+        page_number = int(params.get("p", 1))
+        page_size = min(max(1, int(params.get("size", home_page_size))), home_max_page_size)
+    except ValueError:
+        page_number, page_size = 1, home_page_size
+
+    render_listing_grid(listing_ids, page_number, page_size)
 
     st.caption(f"© {date.today().year} bostonrentals.com — mock UI for demo purposes only.")
 
@@ -815,7 +2131,7 @@ if current_page == "home":
 # Creates a chat page based on the listing which is clicked
 
 elif current_page == "chat" and selected_id: #if current_page = "chat" AND selected_id is not blank
-    l = next((x for x in listings if x["id"] == selected_id), None) #takes first listing for which id = selected_id
+    l = listing_repo.get(selected_id) #looks up the listing by id (None if it doesn't exist)
 
     if st.button("⬅ Back to listings"): #creates the button which runs the go home function.
         go_home()
@@ -823,7 +2139,7 @@ elif current_page == "chat" and selected_id: #if current_page = "chat" AND selec
 
     if l: # Renders the current chat page based on the CSS defined in section 2 and the data from Listings.
         st.markdown('<div class="card">', unsafe_allow_html=True)
-        st.markdown(f'<img class="thumb" src="{l["img"]}" alt="Listing photo">', unsafe_allow_html=True)
+        st.markdown(listing_image_html(l, sizes = "(max-width: 760px) 100vw, 720px", lazy = False), unsafe_allow_html=True)
         st.markdown(f'<div class="addr">📍 {l["address"]}</div>', unsafe_allow_html=True)
         st.markdown(f'<div class="neigh">{l["neighborhood"]}</div>', unsafe_allow_html=True)
         st.markdown(f'<div class="price">${l["rent"]:,}/mo</div>', unsafe_allow_html=True)
@@ -831,122 +2147,34 @@ elif current_page == "chat" and selected_id: #if current_page = "chat" AND selec
         st.markdown('</div>', unsafe_allow_html=True)
         st.markdown("### Inquire about your listing")
 
-        
-        # Create a unique key for this listing's chat
-        key = chat_key(l["id"])
-
-        # Create a unique key for this chat's classifier result
-        cls_key = f"{key}_classifier_result"
-        if cls_key not in st.session_state:
-            st.session_state[cls_key] = None
-
-        # Create a per-chat flag for whether an invite send has been attempted
-        invite_key = f"{key}_invite_sent"
-        if invite_key not in st.session_state:
-            st.session_state[invite_key] = False
-
-        invite_status_key = f"{key}_invite_status"
-        if invite_status_key not in st.session_state:
-            st.session_state[invite_status_key] = None
-
-        # If this is the first time opening this listing, start with a greeting message
-        if key not in st.session_state:
-            st.session_state[key] = [
-                {
-                    "role": "assistant",
-                    "content": (
-                        f"Hi! Thanks for your interest in **{l['address']}**.\n\n "
-                        "Chat here to get started on scheduling a tour."
-                    ),
-                }
-            ]
-
-        # Show all messages as chat bubbles
-        for msg in st.session_state[key]:
-            #msg["role"] is either "assistant" or "user"
-            with st.chat_message(msg["role"]):
-                #msg["content"] is the text to display
-                st.markdown(msg["content"])
-
-        # Chat input at the bottom of the page
-        user_msg = st.chat_input(placeholder = "Hi, I'm interested in this apartment!")
-
-        # If the user types a message and hit enter
-        if user_msg:
-            # 1 - Save the user's message to history
-            st.session_state[key].append({"role": "user", "content": user_msg})
-            with st.chat_message("user"):
-                st.markdown(user_msg)
-
-            # 2 - Create the automatic reply & save to history
-            assistant_reply = generate_reply(user_msg, st.session_state[key], l)
-            st.session_state[key].append({"role": "assistant", "content": assistant_reply})
-
-            # 3 - Run the classifier bot on the conversation to determine whether or not the user has confirmed a time
-            try:
-                cls_result = classify_showing_confirmation(user_msg, st.session_state[key], l)
-            except Exception as e:
-                cls_result = DEFAULT_CONFIRMATION
-            
-            st.session_state[cls_key] = cls_result
+        # Chat history, input and invite status (rerun on their own, see chat_area)
+        chat_area(l, open_listing_conversation(l))
 
-            # 4 - Immediately re-run so the new bubble appears above
-            st.rerun()
-            
-        # Send the email invitation if user is ready
-        result = st.session_state.get(cls_key)
-        if result and (result.get("ready") is True) and (st.session_state[invite_key] is False):
-            user_email = result.get("user_email")
-            start_iso = result.get("start_time_iso")
-            end_iso = result.get("end_time_iso")
-            location = l["address"]
-            tz = result.get("timezone")
-            
-            try:
-                with st.spinner("Preparing and sending your calendar invite..."):
-                    # Make the ics file
-                    ics_filename, ics_text = make_ics_invite(
-                        start_time_iso = start_iso,
-                        end_time_iso = end_iso,
-                        title = "Test showing",
-                        organizer_email = SENDGRID_FROM_EMAIL,
-                        attendee_email = user_email,
-                        location = location,
-                        description = "A calendar invite to demonstrate functionality"
-                    )
-                    # Trigger the email send
-                    send_email_sendgrid(
-                        to_email = user_email,
-                        subject = "Test invite - Andres app",
-                        body_text = f"Your showing starts at {start_iso}",
-                        ics_filename = ics_filename,
-                        ics_text = ics_text,
-                        from_email = SENDGRID_FROM_EMAIL
-                    )
-                    
-                st.success(f"Invite sent to {user_email}")
-                st.session_state[invite_status_key] = f"Sent to {user_email}"
-            except Exception as e:
-                err = f"{type(e).__name__}: {str(e)[:300]}"
-                st.error(f"Invite faled to send - {err}")
-                st.session_state[invite_status_key] = f"Failed: {err}"
-            finally:
-                # Track that email has been sent
-                st.session_state[invite_key] = True
-        
-        # Side panel to show classifier results
-        if st.session_state.get("show_cls_debug", True):
-            with st.sidebar.expander("Showing confirmation (debug)", expanded = True):
-                latest = st.session_state.get(cls_key)
-                if latest:
-                    st.code(json.dumps(latest, indent = 2, ensure_ascii = False), language = "json")
-                else:
-                    st.caption("No classifier result yet.")
-                    
-            status = st.session_state.get(invite_status_key)
-            if status:
-                st.sidebar.caption(f"Invite status: {status}")
 
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Rerun profile (PROFILE_RERUNS=1): this run's section times and the rolling p50 / p95 per section
 
+profiler.mark("7 page")
+if profiler.enabled:
+    this_run = profiler.finish()
+    with st.sidebar.expander("Rerun profile", expanded = False):
+        st.caption("This run: " + ", ".join(f"{name} {ms:.1f}ms" for name, ms in this_run))
+        st.dataframe(profiler.summary(), hide_index = True, use_container_width = True)
 
 
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Stage latency: p50 / p95 / p99 of every chat turn stage and of reruns in this process (see latency_metrics.py)
+
+# Labelled by listing only when the id is a real listing, so an arbitrary ?id= can't add label values
+latency_listing_id = l["id"] if current_page == "chat" and selected_id and l else ""
+latency.observe("rerun", time.perf_counter() - run_started, latency_listing_id)
+with st.sidebar.expander("Latency (this process)", expanded = False):
+    latency_scope = st.radio("Listings", ["All", "This listing"], horizontal = True, key = "latency_scope",
+                             disabled = not latency_listing_id)
+    latency_rows = latency.percentiles(latency_listing_id if latency_scope == "This listing" and latency_listing_id else None)
+    if latency_rows:
+        st.dataframe(latency_rows, hide_index = True, use_container_width = True)
+    else:
+        st.caption("No spans recorded yet.")
@@ -0,0 +1,83 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Rerun profiler
+# Times each section of page_mockup_v3.py on every script run when PROFILE_RERUNS=1 is set.
+# The page calls start() at the top, mark("section") at the end of each section and finish() at the bottom;
+# with the flag off all three return immediately.
+# Runs of different sessions happen on different threads, so the run in progress is kept per thread; finished
+# runs go into a shared rolling window that the sidebar (and the log) summarize as medians and p95s.
+# Has no Streamlit dependency; the app keeps one instance per process since this module is only imported once.
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+PROFILE_RERUNS = os.environ.get("PROFILE_RERUNS", "") not in ("", "0", "false")
+
+logger = logging.getLogger("rerun_profiler")
+if PROFILE_RERUNS and not logger.handlers:
+    # Streamlit only configures its own loggers, so give this one a handler of its own
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+class RerunProfiler:
+    def __init__(self, enabled: bool = PROFILE_RERUNS, window: int = 200):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.runs = deque(maxlen = window)
+        self.local = threading.local()
+
+    def start(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.local.started = now
+        self.local.last = now
+        self.local.sections = []
+
+    # Records the time since the previous mark (or start) under this section name
+    def mark(self, section: str):
+        if not self.enabled or getattr(self.local, "sections", None) is None:
+            return
+        now = time.perf_counter()
+        self.local.sections.append((section, (now - self.local.last) * 1000))
+        self.local.last = now
+
+    # Closes the current run and returns its sections as [(name, ms), ...] plus a "total" entry
+    def finish(self) -> list[tuple[str, float]]:
+        if not self.enabled or getattr(self.local, "sections", None) is None:
+            return []
+        sections = self.local.sections
+        sections.append(("total", (time.perf_counter() - self.local.started) * 1000))
+        self.local.sections = None
+        with self.lock:
+            self.runs.append(sections)
+        logger.info("rerun %s", " ".join(f"{name}={ms:.2f}ms" for name, ms in sections))
+        return sections
+
+    # Median and p95 (ms) per section over the rolling window, in the order sections appear
+    def summary(self) -> list[dict]:
+        with self.lock:
+            runs = list(self.runs)
+        samples = {}
+        for sections in runs:
+            for name, ms in sections:
+                samples.setdefault(name, []).append(ms)
+        out = []
+        for name, values in samples.items():
+            values.sort()
+            out.append({
+                "section": name,
+                "runs": len(values),
+                "p50_ms": round(values[len(values) // 2], 2),
+                "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))], 2),
+            })
+        return out
+
+
+profiler = RerunProfiler()
@@ -0,0 +1,134 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Showing availability
+# Confirmed showings are booked per listing and per agent into sorted interval indexes, so conflict checks are
+# a binary search and free slots can be found by skipping busy blocks. Bookings are persisted to SQLite and
+# loaded back into the indexes on startup.
+# Has no Streamlit dependency; the app shares one instance via st.cache_resource.
+
+import bisect
+import os
+import sqlite3
+import threading
+import zoneinfo
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+SHOWINGS_PATH = os.environ.get("SHOWINGS_PATH", ".showings.sqlite3")
+showing_minutes = 30
+showing_hours = (9, 19)      # showings must start and end within these local hours
+
+
+# Listings without an agent field (all of the demo data) get an agent of their own, so a booking on one
+# listing doesn't take that slot away from every other listing
+def listing_agent(listing: dict) -> str:
+    return listing.get("agent") or f"listing:{listing['id']}"
+
+
+# Non-overlapping (start, end, ref) intervals (epoch seconds) kept sorted by start; ref is the booking key.
+# Lookups are a binary search. Adding one is a binary search plus a list insert, which shifts the later
+# entries (O(n)); a listing or agent has a few hundred showings at most, so that is a short memmove
+class IntervalIndex:
+    def __init__(self):
+        self.intervals = []
+
+    # Returns an interval overlapping [start, end) that isn't `ref` itself, or None
+    def conflict(self, start: float, end: float, ref: str | None = None) -> tuple | None:
+        # (end,) sorts before every interval starting at `end`, so i is the first one starting at or after it
+        i = bisect.bisect_left(self.intervals, (end,))
+        # Intervals don't overlap each other, so only the last one starting before `end` can overlap
+        # (or the one before it, when the last one is `ref` itself)
+        for j in (i - 1, i - 2):
+            if j >= 0:
+                s, e, r = self.intervals[j]
+                if s < end and e > start and r != ref:
+                    return self.intervals[j]
+        return None
+
+    def add(self, start: float, end: float, ref: str):
+        bisect.insort(self.intervals, (start, end, ref))
+
+
+# Bookings by listing and by agent, persisted to SQLite and loaded back into the indexes on startup
+class AvailabilityStore:
+    def __init__(self, path: str, tz: str):
+        self.path = path
+        self.tz = zoneinfo.ZoneInfo(tz)
+        self.lock = threading.Lock()
+        self.by_listing = {}
+        self.by_agent = {}
+        self.refs = set()
+        with self.connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS showings ("
+                "ref TEXT PRIMARY KEY, listing_id TEXT NOT NULL, agent_id TEXT NOT NULL, "
+                "start_ts REAL NOT NULL, end_ts REAL NOT NULL)"
+            )
+            for ref, listing_id, agent_id, start, end in db.execute("SELECT ref, listing_id, agent_id, start_ts, end_ts FROM showings"):
+                self.index_booking(listing_id, agent_id, start, end, ref)
+
+    # Commits (or rolls back) and closes; sqlite3's own context manager only commits, leaving the connection open
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout = 30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def index_booking(self, listing_id: str, agent_id: str, start: float, end: float, ref: str):
+        self.by_listing.setdefault(listing_id, IntervalIndex()).add(start, end, ref)
+        self.by_agent.setdefault(agent_id, IntervalIndex()).add(start, end, ref)
+        self.refs.add(ref)
+
+    # Returns the conflicting interval for the listing or its agent, or None if the time is free
+    def conflict(self, listing_id: str, agent_id: str, start: float, end: float, ref: str | None = None) -> tuple | None:
+        for index in (self.by_listing.get(listing_id), self.by_agent.get(agent_id)):
+            hit = index.conflict(start, end, ref) if index else None
+            if hit:
+                return hit
+        return None
+
+    # Books a showing unless it overlaps another one. Booking the same ref again is a no-op that returns True
+    def book(self, listing_id: str, agent_id: str, start_time_iso: str, end_time_iso: str | None, ref: str) -> bool:
+        start = datetime.fromisoformat(start_time_iso).timestamp()
+        end = datetime.fromisoformat(end_time_iso).timestamp() if end_time_iso else start + showing_minutes * 60
+        with self.lock:
+            if ref in self.refs:
+                return True
+            if self.conflict(listing_id, agent_id, start, end, ref):
+                return False
+            with self.connect() as db:
+                db.execute(
+                    "INSERT OR IGNORE INTO showings (ref, listing_id, agent_id, start_ts, end_ts) VALUES (?, ?, ?, ?, ?)",
+                    (ref, listing_id, agent_id, start, end),
+                )
+            self.index_booking(listing_id, agent_id, start, end, ref)
+            return True
+
+    # Next k free showing slots between window_start and window_end, within showing_hours in the store's time zone
+    def free_slots(self, listing_id: str, agent_id: str, window_start: datetime, window_end: datetime, k: int) -> list[datetime]:
+        step = showing_minutes * 60
+        t = -(-window_start.timestamp() // step) * step   # round up to a whole slot
+        stop = window_end.timestamp()
+        slots = []
+        with self.lock:
+            while t < stop and len(slots) < k:
+                local = datetime.fromtimestamp(t, self.tz)
+                day_open = local.replace(hour = showing_hours[0], minute = 0, second = 0, microsecond = 0)
+                day_close = local.replace(hour = showing_hours[1], minute = 0, second = 0, microsecond = 0)
+                if local < day_open:
+                    t = day_open.timestamp()
+                    continue
+                if local + timedelta(seconds = step) > day_close:
+                    t = (day_open + timedelta(days = 1)).timestamp()
+                    continue
+                hit = self.conflict(listing_id, agent_id, t, t + step)
+                if hit:
+                    # Jump past the busy block, to the next whole slot
+                    t = -(-hit[1] // step) * step
+                    continue
+                slots.append(local)
+                t += step
+        return slots
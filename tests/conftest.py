@@ -0,0 +1,5 @@
+# Tests import the app's Streamlit-free modules (chat_rules.py, openai_scheduler.py, ...) from the repo root
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
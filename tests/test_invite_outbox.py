@@ -0,0 +1,112 @@
+import sqlite3
+import time
+
+import pytest
+
+import invite_outbox
+from invite_outbox import InviteOutbox, invite_idempotency_key
+
+PAYLOAD = {"listing_id": "x", "user_email": "alex@example.com", "start_time_iso": "2030-05-14T15:00:00-04:00"}
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return InviteOutbox(str(tmp_path / "outbox.sqlite3"), deliver = None, workers = 0)
+
+
+def next_attempt_at(outbox: InviteOutbox, key: str) -> float:
+    with outbox.connect() as db:
+        return db.execute("SELECT next_attempt_at FROM invite_outbox WHERE idempotency_key = ?", (key,)).fetchone()[0]
+
+
+def test_idempotency_key_normalizes_email_and_time_zone():
+    key = invite_idempotency_key("x", "Alex@Example.com ", "2030-05-14T15:00:00-04:00")
+    assert key == invite_idempotency_key("x", "alex@example.com", "2030-05-14T19:00:00+00:00")
+    assert key != invite_idempotency_key("y", "alex@example.com", "2030-05-14T19:00:00+00:00")
+    assert key != invite_idempotency_key("x", "alex@example.com", "2030-05-14T19:30:00+00:00")
+
+
+def test_enqueue_is_idempotent(outbox):
+    assert outbox.enqueue("k", PAYLOAD)
+    assert not outbox.enqueue("k", {**PAYLOAD, "user_email": "other@example.com"})
+    assert outbox.status("k") == {"status": "pending", "attempts": 0, "last_error": None}
+    assert outbox.claim() == ("k", PAYLOAD)
+    assert outbox.status("missing") is None
+
+
+def test_claim_then_sent(outbox):
+    outbox.enqueue("k", PAYLOAD)
+    assert outbox.claim()[0] == "k"
+    assert outbox.status("k")["status"] == "sending"
+    assert outbox.claim() is None
+    outbox.mark_sent("k")
+    assert outbox.status("k") == {"status": "sent", "attempts": 1, "last_error": None}
+
+
+def test_failed_send_is_retried_with_backoff(outbox, monkeypatch):
+    monkeypatch.setattr(invite_outbox, "outbox_retry_base", 10.0)
+    outbox.enqueue("k", PAYLOAD)
+    outbox.claim()
+    before = time.time()
+    outbox.mark_failed("k", "TimeoutError: slow")
+    assert outbox.status("k") == {"status": "pending", "attempts": 1, "last_error": "TimeoutError: slow"}
+    assert before + 8 <= next_attempt_at(outbox, "k") <= time.time() + 12
+    assert outbox.claim() is None    # not due yet
+
+    outbox.mark_failed("k", "TimeoutError: slow")
+    assert before + 16 <= next_attempt_at(outbox, "k") <= time.time() + 24
+
+
+def test_dead_after_max_attempts(outbox, monkeypatch):
+    monkeypatch.setattr(invite_outbox, "outbox_retry_base", 0.0)
+    outbox.enqueue("k", PAYLOAD)
+    for attempt in range(1, invite_outbox.outbox_max_attempts + 1):
+        assert outbox.claim()[0] == "k"
+        outbox.mark_failed("k", "boom")
+        assert outbox.status("k")["attempts"] == attempt
+    assert outbox.status("k")["status"] == "dead"
+    assert outbox.claim() is None
+
+
+def test_sending_rows_are_retried_after_a_restart(outbox):
+    outbox.enqueue("k", PAYLOAD)
+    outbox.claim()
+    restarted = InviteOutbox(outbox.path, deliver = None, workers = 0)
+    assert restarted.status("k")["status"] == "pending"
+    assert restarted.claim()[0] == "k"
+
+
+def test_worker_delivers_queued_invites(tmp_path):
+    delivered = []
+    outbox = InviteOutbox(str(tmp_path / "outbox.sqlite3"), deliver = delivered.append, workers = 1)
+    outbox.enqueue("k", PAYLOAD)
+    deadline = time.monotonic() + 5
+    while outbox.status("k")["status"] != "sent" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert outbox.status("k")["status"] == "sent"
+    assert delivered == [PAYLOAD]
+
+
+def test_connections_are_closed(outbox, monkeypatch):
+    opened = []
+
+    class TrackedConnection(sqlite3.Connection):
+        closed = False
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    connect = sqlite3.connect
+
+    def tracked_connect(*args, **kwargs):
+        db = connect(*args, factory = TrackedConnection, **kwargs)
+        opened.append(db)
+        return db
+
+    monkeypatch.setattr(invite_outbox.sqlite3, "connect", tracked_connect)
+    outbox.enqueue("k", PAYLOAD)
+    outbox.status("k")
+    outbox.claim()
+    outbox.mark_failed("k", "boom")
+    assert len(opened) == 4 and all(db.closed for db in opened)
@@ -0,0 +1,64 @@
+import pytest
+
+from listing_repository import ListingRepository, ListingValidationError, validate_listing
+
+LISTING = {
+    "id": "x", "address": "1 Main St", "neighborhood": "Medford", "rent": "3200", "beds": 2, "baths": "1.0",
+    "pets": " Yes ", "maxtenants": 2, "moveindate": "09-01-2030", "moveincost": 6600, "img": "", "agent": None,
+}
+
+
+def test_validate_normalizes():
+    out = validate_listing(LISTING)
+    assert out == {
+        "id": "x", "address": "1 Main St", "neighborhood": "Medford", "rent": 3200, "beds": 2, "baths": 1,
+        "pets": "yes", "maxtenants": 2, "moveindate": "09-01-2030", "moveincost": 6600,
+    }
+    assert validate_listing({**LISTING, "baths": 1.5, "agent": "pat"})["baths"] == 1.5
+    assert validate_listing({**LISTING, "agent": "pat"})["agent"] == "pat"
+
+
+def test_validate_does_not_change_its_input():
+    listing = dict(LISTING)
+    validate_listing(listing)
+    assert listing == LISTING
+
+
+@pytest.mark.parametrize("field", ["id", "address", "neighborhood", "rent", "pets", "moveindate"])
+def test_missing_required_field(field):
+    with pytest.raises(ListingValidationError, match = f"missing .*{field}"):
+        validate_listing({**LISTING, field: ""})
+
+
+@pytest.mark.parametrize("changes, message", [
+    ({"pets": "sometimes"}, "pets must be 'yes' or 'no'"),
+    ({"rent": "a lot"}, "rent must be a whole number"),
+    ({"rent": -1}, "rent out of range"),
+    ({"maxtenants": 0}, "maxtenants out of range"),
+    ({"baths": "two"}, "baths must be a number"),
+    ({"moveindate": "2030-09-01"}, "moveindate must be MM-DD-YYYY"),
+    ({"moveindate": "02-30-2030"}, "moveindate is not a real date"),
+])
+def test_invalid_values(changes, message):
+    with pytest.raises(ListingValidationError, match = message):
+        validate_listing({**LISTING, **changes})
+
+
+def test_validation_error_is_a_value_error():
+    assert issubclass(ListingValidationError, ValueError)
+
+
+def test_repository_round_trip(tmp_path):
+    repo = ListingRepository(str(tmp_path / "listings.sqlite3"))
+    repo.seed([LISTING, {**LISTING, "id": "y", "rent": 2500, "beds": 1, "neighborhood": "Somerville"}])
+    repo.seed([{**LISTING, "id": "z"}])    # only seeds an empty table
+    assert [l["id"] for l in repo.all()] == ["x", "y"]
+    assert repo.get("x") == validate_listing(LISTING)
+    assert [l["id"] for l in repo.search(max_rent = 3000)] == ["y"]
+    assert [l["id"] for l in repo.search(neighborhood = "Medford", min_beds = 2)] == ["x"]
+
+    with pytest.raises(ListingValidationError):
+        repo.upsert([{**LISTING, "id": "w", "pets": "maybe"}])
+    repo.upsert([{**LISTING, "rent": 3300}])
+    repo.delete("y")
+    assert [(l["id"], l["rent"]) for l in repo.all()] == [("x", 3300)]
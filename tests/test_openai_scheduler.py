@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+import openai_scheduler
+from openai_scheduler import OpenAIScheduler, SchedulerBusy, SchedulerTimeout, TokenBucket, Waiter
+
+
+def test_token_bucket_wait_for():
+    bucket = TokenBucket(60)    # one per second
+    assert bucket.wait_for(60) == 0.0
+    bucket.level = 10.0
+    assert bucket.wait_for(5) == 0.0
+    assert bucket.wait_for(15) == pytest.approx(5.0)
+    assert bucket.wait_for(600) == pytest.approx(50.0)    # more than capacity waits for a full bucket only
+
+
+def test_token_bucket_refill_is_capped():
+    bucket = TokenBucket(60)
+    bucket.level = 0.0
+    bucket.refill(bucket.updated + 2.0)
+    assert bucket.level == pytest.approx(2.0)
+    bucket.refill(bucket.updated + 600.0)
+    assert bucket.level == 60.0
+
+
+def test_next_waiter_by_class_then_round_robin_then_arrival():
+    scheduler = OpenAIScheduler()
+    now = time.monotonic()
+    classifier = Waiter(0, "a", openai_scheduler.CALL_PRIORITIES["classifier"], 10)
+    reply_a = Waiter(1, "a", openai_scheduler.CALL_PRIORITIES["reply"], 10)
+    reply_b = Waiter(2, "b", openai_scheduler.CALL_PRIORITIES["reply"], 10)
+    scheduler.waiting = [classifier, reply_a, reply_b]
+    assert scheduler.next_waiter(now) is reply_a
+    scheduler.last_served["a"] = now
+    assert scheduler.next_waiter(now) is reply_b
+    scheduler.waiting = []
+    assert scheduler.next_waiter(now) is None
+
+
+def test_aging_moves_a_waiter_up():
+    scheduler = OpenAIScheduler()
+    now = time.monotonic()
+    classifier = Waiter(0, "a", 2, 10)
+    classifier.queued_at = now - 2 * openai_scheduler.aging_seconds - 0.1
+    reply = Waiter(1, "b", 0, 10)
+    assert scheduler.effective_priority(classifier, now) == 0
+    scheduler.waiting = [classifier, reply]
+    assert scheduler.next_waiter(now) is classifier    # same class now, and it arrived first
+
+
+def test_grants_and_summary():
+    scheduler = OpenAIScheduler(rpm = 10, tpm = 1000)
+    assert scheduler.acquire("reply", "a", 300) < 0.1
+    summary = scheduler.summary()
+    assert summary["granted"] == 1 and summary["rpm_left"] == 9 and summary["tpm_left"] == 700
+
+
+def test_waiting_calls_are_granted_by_priority():
+    scheduler = OpenAIScheduler(rpm = 240, tpm = 100000)    # a request every 0.25s
+    scheduler.requests.level = 0.0
+    order = []
+
+    def call(call_type: str, session: str):
+        scheduler.acquire(call_type, session, 10)
+        order.append(call_type)
+
+    threads = []
+    for call_type, session in (("classifier", "a"), ("summary", "b"), ("reply", "c")):
+        threads.append(threading.Thread(target = call, args = (call_type, session)))
+        threads[-1].start()
+        while len(scheduler.waiting) < len(threads):
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join(5)
+    assert order == ["reply", "summary", "classifier"]
+
+
+def test_busy_when_the_queue_is_full(monkeypatch):
+    scheduler = OpenAIScheduler()
+    scheduler.waiting = [Waiter(i, "a", openai_scheduler.DEFAULT_PRIORITY, 10) for i in range(openai_scheduler.max_waiting_per_session)]
+    with pytest.raises(SchedulerBusy):
+        scheduler.acquire("reply", "a", 10)
+    assert scheduler.acquire("reply", "b", 10) < 0.1    # other sessions still get through
+    monkeypatch.setattr(openai_scheduler, "max_waiting", len(scheduler.waiting))
+    with pytest.raises(SchedulerBusy):
+        scheduler.acquire("reply", "b", 10)
+    assert scheduler.summary()["busy"] == 2
+
+
+def test_timeout_after_the_class_max_wait(monkeypatch):
+    monkeypatch.setitem(openai_scheduler.MAX_WAIT_SECONDS, 2, 0.05)
+    scheduler = OpenAIScheduler(rpm = 1)
+    scheduler.requests.level = 0.0
+    started = time.monotonic()
+    with pytest.raises(SchedulerTimeout):
+        scheduler.acquire("classifier", "a", 10)
+    assert 0.04 <= time.monotonic() - started < 1.0
+    assert scheduler.waiting == [] and scheduler.summary()["timeouts"] == 1
+
+
+def test_throttle_pauses_grants():
+    scheduler = OpenAIScheduler()
+    scheduler.throttle(0.1)
+    assert scheduler.acquire("reply", "a", 10) >= 0.09
+    assert scheduler.summary()["throttled"] == 1
+
+
+def test_settle_returns_unused_tokens():
+    scheduler = OpenAIScheduler(tpm = 1000)
+    scheduler.acquire("reply", "a", 500)
+    assert scheduler.tokens.level == pytest.approx(500, abs = 1)
+    scheduler.settle(500, 200)
+    assert scheduler.tokens.level == pytest.approx(800, abs = 1)
+    scheduler.settle(100, 400)
+    assert scheduler.tokens.level == pytest.approx(500, abs = 1)
+    scheduler.settle(100, None)
+    assert scheduler.tokens.level == pytest.approx(500, abs = 1)
+    scheduler.settle(5000, 0)
+    assert scheduler.tokens.level == 1000.0    # never above capacity
@@ -0,0 +1,66 @@
+import pytest
+
+from chat_rules import EMAIL_RE, TIME_RE, pregate_confirmation
+
+DEFAULT = {"version": "1.0", "ready": False, "status": "not_ready", "notes": None, "confidence": 0.0, "reason": None}
+
+
+def new_scan_state() -> dict:
+    return {"scanned": 0, "has_email": False, "has_time": False}
+
+
+@pytest.mark.parametrize("text", [
+    "3pm", "10:30 AM", "at 3", "14:00", "tomorrow", "next week", "Tuesday", "tues", "Nov 4", "november 14", "11/4",
+])
+def test_time_re_matches(text):
+    assert TIME_RE.search(f"could I come {text}?")
+
+
+@pytest.mark.parametrize("text", ["Are pets allowed?", "What is the move in cost?", "We are 2 people"])
+def test_time_re_ignores(text):
+    assert not TIME_RE.search(text)
+
+
+def test_email_re():
+    assert EMAIL_RE.search("reach me at alex.renter+apt@example.co.uk please")
+    assert not EMAIL_RE.search("reach me at alex at example dot com")
+
+
+def test_gates_until_email_and_time():
+    state = new_scan_state()
+    history = [{"role": "user", "content": "Is it still available?"}]
+    gated = pregate_confirmation(history, state, DEFAULT)
+    assert gated["status"] == "not_ready" and gated["notes"] == "local_pregate"
+    assert "email address or date/time" in gated["reason"]
+
+    history.append({"role": "user", "content": "Could I see it tomorrow at 3pm?"})
+    assert "email address" in pregate_confirmation(history, state, DEFAULT)["reason"]
+
+    history.append({"role": "user", "content": "My email is alex@example.com"})
+    assert pregate_confirmation(history, state, DEFAULT) is None
+
+
+def test_does_not_change_default():
+    pregate_confirmation([{"role": "user", "content": "hi"}], new_scan_state(), DEFAULT)
+    assert DEFAULT["notes"] is None
+
+
+def test_email_must_come_from_renter():
+    state = new_scan_state()
+    history = [
+        {"role": "assistant", "content": "You can also write to agent@example.com. Does 3pm tomorrow work?"},
+        {"role": "user", "content": "Sure"},
+    ]
+    gated = pregate_confirmation(history, state, DEFAULT)
+    assert gated is not None and gated["reason"] == "No email address in the conversation yet."
+
+
+def test_scans_only_new_messages():
+    state = new_scan_state()
+    history = [{"role": "user", "content": "alex@example.com"}]
+    pregate_confirmation(history, state, DEFAULT)
+    assert state == {"scanned": 1, "has_email": True, "has_time": False}
+    # Already-scanned messages aren't looked at again, even if they change
+    history[0]["content"] = "tomorrow at 3pm"
+    pregate_confirmation(history, state, DEFAULT)
+    assert state["has_time"] is False
@@ -0,0 +1,89 @@
+from datetime import date
+
+import pytest
+
+from chat_rules import (
+    check_qualification, extract_qualification_facts, new_qualification_state, qualification_decline,
+    qualification_facts_for_llm, update_qualification
+)
+
+TODAY = date(2030, 5, 10)
+LISTING = {"id": "x", "address": "1 Main St", "pets": "no", "maxtenants": 2, "moveincost": 6600, "moveindate": "09-01-2030"}
+
+
+@pytest.mark.parametrize("message, occupants", [
+    ("It's just me", 1),
+    ("Me and my partner are looking", 2),
+    ("We are 3 people", 3),
+    ("family of four", 4),
+    ("me and two roommates", 3),
+])
+def test_occupants_from_statements(message, occupants):
+    assert extract_qualification_facts(message, TODAY) == {"occupants": occupants}
+
+
+@pytest.mark.parametrize("message", ["Can 5 people live there?", "Would it work for 5 people", "Is it ok for 5 adults?"])
+def test_occupants_from_questions_are_only_asked(message):
+    assert extract_qualification_facts(message, TODAY) == {"occupants_asked": 5}
+
+
+def test_statement_next_to_a_question_is_still_a_statement():
+    assert extract_qualification_facts("We are 3 people. Is parking included?", TODAY) == {"occupants": 3}
+
+
+@pytest.mark.parametrize("message, has_pets", [
+    ("I have a small dog", True),
+    ("our cat is very quiet", True),
+    ("We don't have any pets", False),
+    ("no pets here", False),
+    ("I have a cat allergy", None),
+    ("my dog allergy is bad", None),
+])
+def test_pets(message, has_pets):
+    assert extract_qualification_facts(message, TODAY).get("has_pets") is has_pets
+
+
+def test_move_in_date_rolls_to_next_year():
+    assert extract_qualification_facts("We'd like to move in Sept 1st", TODAY) == {"move_in": "2030-09-01"}
+    assert extract_qualification_facts("hoping to start the lease march 3", TODAY) == {"move_in": "2031-03-03"}
+    assert extract_qualification_facts("I'm free on sept 1", TODAY) == {}
+    assert extract_qualification_facts("move in feb 30", TODAY) == {}
+
+
+def test_update_only_scans_new_renter_messages():
+    state = new_qualification_state()
+    history = [{"role": "assistant", "content": "Is it just you?"}, {"role": "user", "content": "me and my partner"}]
+    update_qualification(state, history, TODAY)
+    assert state["occupants"] == 2 and state["scanned"] == 2
+    history += [{"role": "assistant", "content": "We have 3 people max"}, {"role": "user", "content": "we are 3 people actually"}]
+    update_qualification(state, history, TODAY)
+    assert state["occupants"] == 3 and state["scanned"] == 4
+
+
+def test_stated_household_over_max_declines():
+    state = {**new_qualification_state(), "occupants": 3}
+    failures, _ = check_qualification(state, LISTING)
+    assert failures
+    assert qualification_decline(state, LISTING).startswith("Thanks for letting me know. Unfortunately 1 Main St allows at most 2")
+
+
+def test_asked_household_and_pets_are_concerns_only():
+    state = {**new_qualification_state(), "occupants_asked": 5, "has_pets": True}
+    failures, concerns = check_qualification(state, LISTING)
+    assert failures == [] and len(concerns) == 2
+    assert qualification_decline(state, LISTING) is None
+    assert check_qualification(state, {**LISTING, "maxtenants": 6, "pets": "yes"}) == ([], [])
+
+
+def test_early_move_in_is_a_concern():
+    _, concerns = check_qualification({**new_qualification_state(), "move_in": "2030-06-01"}, LISTING)
+    assert concerns == ["renter wants to move in 2030-06-01 but the unit is available September 1, 2030"]
+    assert check_qualification({**new_qualification_state(), "move_in": "2030-08-15"}, LISTING) == ([], [])
+
+
+def test_facts_for_llm():
+    text = qualification_facts_for_llm({**new_qualification_state(), "occupants": 2, "has_pets": False}, LISTING)
+    assert " - occupants: 2 (max allowed 2)" in text
+    assert " - pets: no pets" in text
+    assert " - desired move in date: unknown" in text
+    assert "concern" not in text
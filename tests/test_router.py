@@ -0,0 +1,57 @@
+import pytest
+
+from chat_rules import format_move_in_date, intent_is_negated, route_listing_question, score_listing_intents
+
+LISTING = {"id": "x", "address": "1 Main St", "pets": "no", "maxtenants": 2, "moveincost": 6600, "moveindate": "09-01-2030"}
+
+
+def test_pets_answer_follows_listing():
+    assert route_listing_question("Are pets allowed?", LISTING).startswith("Unfortunately 1 Main St doesn't allow pets")
+    assert route_listing_question("Are pets allowed?", {**LISTING, "pets": "yes"}).startswith("Yes, pets are allowed")
+
+
+def test_move_in_cost():
+    assert "$6,600" in route_listing_question("What is the move in cost?", LISTING)
+
+
+def test_move_in_date():
+    assert "September 1, 2030" in route_listing_question("What is the move in date?", LISTING)
+
+
+def test_max_tenants():
+    assert route_listing_question("How many people can live there?", LISTING).startswith("Up to 2 people")
+
+
+@pytest.mark.parametrize("message", [
+    "I don't have pets, is that okay?",
+    "We have no pets, are pets allowed for visitors?",
+])
+def test_negated_intent_goes_to_llm(message):
+    assert route_listing_question(message, LISTING) is None
+
+
+def test_negation_after_keyword_still_answers():
+    assert not intent_is_negated("Are pets allowed or not?", "pets")
+
+
+@pytest.mark.parametrize("message", [
+    "Are pets allowed? my email is alex@example.com",
+    "Are pets allowed? could I come tomorrow",
+    "Are pets allowed in the building because we have a small dog and a cat and we would love to bring them along",
+])
+def test_email_time_and_long_messages_go_to_llm(message):
+    assert route_listing_question(message, LISTING) is None
+
+
+def test_multi_intent_goes_to_llm():
+    scores = score_listing_intents("Are pets allowed and what is the move in cost?")
+    assert scores["pets"] >= 0.8 and scores["moveincost"] >= 0.8
+    assert route_listing_question("Are pets allowed and what is the move in cost?", LISTING) is None
+
+
+def test_unrelated_message_goes_to_llm():
+    assert route_listing_question("Hi, is the apartment still available?", LISTING) is None
+
+
+def test_format_move_in_date_passes_through_bad_values():
+    assert format_move_in_date("soon") == "soon"
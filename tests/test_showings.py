@@ -0,0 +1,73 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from showings import AvailabilityStore, IntervalIndex, listing_agent
+
+TZ = ZoneInfo("America/New_York")
+
+
+def at(day: int, hour: int, minute: int = 0) -> datetime:
+    return datetime(2030, 5, day, hour, minute, tzinfo = TZ)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AvailabilityStore(str(tmp_path / "showings.sqlite3"), "America/New_York")
+
+
+def test_listing_agent_defaults_to_the_listing():
+    assert listing_agent({"id": "x"}) == "listing:x"
+    assert listing_agent({"id": "x", "agent": "pat"}) == "pat"
+
+
+def test_interval_index_conflicts():
+    index = IntervalIndex()
+    for start, ref in ((30, "b"), (10, "a"), (50, "c")):
+        index.add(start, start + 10, ref)
+    assert index.intervals == [(10, 20, "a"), (30, 40, "b"), (50, 60, "c")]
+    assert index.conflict(15, 25) == (10, 20, "a")
+    assert index.conflict(35, 55) == (50, 60, "c")
+    assert index.conflict(0, 10) is None       # touching is not overlapping
+    assert index.conflict(20, 30) is None
+    assert index.conflict(60, 70) is None
+    assert index.conflict(0, 100) == (50, 60, "c")
+
+
+def test_interval_index_ignores_its_own_ref():
+    index = IntervalIndex()
+    index.add(10, 20, "a")
+    index.add(20, 30, "b")
+    assert index.conflict(15, 25, "b") == (10, 20, "a")
+    assert index.conflict(20, 25, "b") is None
+
+
+def test_book_conflicts_per_listing_and_agent(store):
+    assert store.book("x", "pat", at(14, 15).isoformat(), None, "r1")
+    assert not store.book("x", "sam", at(14, 15, 15).isoformat(), None, "r2")    # same listing
+    assert not store.book("y", "pat", at(14, 15, 15).isoformat(), None, "r3")    # same agent
+    assert store.book("y", "sam", at(14, 15, 15).isoformat(), None, "r4")
+    assert store.book("x", "pat", at(14, 15, 30).isoformat(), at(14, 16).isoformat(), "r5")
+
+
+def test_book_is_idempotent_and_persisted(store):
+    assert store.book("x", "pat", at(14, 15).isoformat(), None, "r1")
+    assert store.book("x", "pat", at(14, 15).isoformat(), None, "r1")
+    assert store.by_listing["x"].intervals == [(at(14, 15).timestamp(), at(14, 15, 30).timestamp(), "r1")]
+    reopened = AvailabilityStore(store.path, "America/New_York")
+    assert reopened.conflict("x", "pat", at(14, 15, 10).timestamp(), at(14, 15, 20).timestamp()) is not None
+    assert reopened.book("x", "pat", at(14, 15).isoformat(), None, "r1")
+
+
+def test_free_slots_round_up_and_skip_busy_blocks(store):
+    store.book("x", "pat", at(14, 10).isoformat(), at(14, 11, 10).isoformat(), "r1")
+    slots = store.free_slots("x", "pat", at(14, 9, 10), at(15, 0), 4)
+    assert slots == [at(14, 9, 30), at(14, 11, 30), at(14, 12), at(14, 12, 30)]
+    assert all(slot.tzinfo == TZ for slot in slots)
+
+
+def test_free_slots_stay_within_showing_hours(store):
+    slots = store.free_slots("x", "pat", at(14, 18), at(16, 0), 3)
+    assert slots == [at(14, 18), at(14, 18, 30), at(15, 9)]
+    assert store.free_slots("x", "pat", at(14, 19), at(14, 23), 3) == []
@@ -0,0 +1,120 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# Listing thumbnails
+# Turns local listing photos into small, content-hashed WebP and JPEG variants at a few widths, written to
+# Streamlit's static folder (static/thumbs, served at app/static/thumbs/ when enableStaticServing is on).
+# File names are the hash of the source image, so an unchanged photo is never resized twice and a changed
+# one gets new URLs that browsers can cache forever.
+# Has no Streamlit dependency so it can also be run as a script to build thumbnails ahead of time:
+#   python thumbnails.py [images_dir]
+
+import hashlib
+import os
+import sys
+import threading
+
+from PIL import Image, ImageOps
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LISTING_IMAGES_DIR = os.environ.get("LISTING_IMAGES_DIR", os.path.join(HERE, "images"))
+THUMBNAIL_DIR = os.environ.get("THUMBNAIL_DIR", os.path.join(HERE, "static", "thumbs"))
+THUMBNAIL_URL = "app/static/thumbs/"
+
+# Card photos are shown 160px tall and at most ~400px wide (full width on the chat page), so three widths
+# cover 1x and 2x screens. Images are center-cropped to this width / height ratio.
+THUMBNAIL_WIDTHS = (320, 640, 960)
+THUMBNAIL_ASPECT = 2.0
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif")
+
+
+def is_local_image(img: str | None) -> bool:
+    return bool(img) and not img.startswith(("http://", "https://", "data:", "//"))
+
+
+# Resolves a listing's img value to a file path (relative values are looked up in LISTING_IMAGES_DIR)
+def local_image_path(img: str, images_dir: str = LISTING_IMAGES_DIR) -> str:
+    return img if os.path.isabs(img) else os.path.join(images_dir, img)
+
+
+def content_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+# Resizes one source image into every width and format that doesn't exist yet.
+# Returns {"width", "height", "variants": {ext: [(width, height, file name), ...]}} with widths ascending;
+# widths larger than the source are skipped (the smallest one is always produced).
+def build_thumbnails(path: str, out_dir: str = THUMBNAIL_DIR, widths: tuple[int, ...] = THUMBNAIL_WIDTHS) -> dict:
+    digest = content_hash(path)
+    os.makedirs(out_dir, exist_ok = True)
+    with Image.open(path) as src:
+        src = ImageOps.exif_transpose(src).convert("RGB")
+        usable = [w for w in widths if w <= src.width] or [min(widths)]
+        variants = {ext: [] for ext in THUMBNAIL_FORMATS}
+        for width in usable:
+            height = round(width / THUMBNAIL_ASPECT)
+            resized = None
+            for ext, (fmt, options) in THUMBNAIL_FORMATS.items():
+                name = f"{digest}-{width}.{ext}"
+                target = os.path.join(out_dir, name)
+                if not os.path.exists(target):
+                    if resized is None:
+                        resized = ImageOps.fit(src, (width, height), Image.LANCZOS)
+                    # Write then rename, so a half-written file is never served
+                    tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    resized.save(tmp, fmt, **options)
+                    os.replace(tmp, target)
+                variants[ext].append((width, height, name))
+    return {"width": usable[-1], "height": round(usable[-1] / THUMBNAIL_ASPECT), "variants": variants}
+
+
+# Thread-safe front for build_thumbnails. Results are remembered per (path, mtime, size), so the source file
+# is only hashed again when it changes; missing or unreadable images resolve to None.
+class ThumbnailStore:
+    def __init__(self, images_dir: str = LISTING_IMAGES_DIR, out_dir: str = THUMBNAIL_DIR):
+        self.images_dir = images_dir
+        self.out_dir = out_dir
+        self.lock = threading.Lock()
+        self.known = {}
+
+    def resolve(self, img: str | None) -> dict | None:
+        if not is_local_image(img):
+            return None
+        path = local_image_path(img, self.images_dir)
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        key = (path, info.st_mtime_ns, info.st_size)
+        with self.lock:
+            if key in self.known:
+                return self.known[key]
+            try:
+                thumbs = build_thumbnails(path, self.out_dir)
+            except (OSError, ValueError):
+                thumbs = None
+            self.known[key] = thumbs
+            return thumbs
+
+
+def main():
+    images_dir = sys.argv[1] if len(sys.argv) > 1 else LISTING_IMAGES_DIR
+    store = ThumbnailStore(images_dir)
+    built = 0
+    for name in sorted(os.listdir(images_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            thumbs = store.resolve(name)
+            print(f"{name}: {'failed' if thumbs is None else ', '.join(v[2] for v in thumbs['variants']['webp'])}")
+            built += thumbs is not None
+    print(f"{built} images -> {store.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#-------------------------------------------------------------
+#-------------------------------------------------------------
+# OpenAI usage ledger
+# Records the token usage OpenAI reports for every chat completion (prompt, completion and cached prompt
+# tokens, model) together with the call site, prompt version, listing and conversation it was made for.
+# Listing and conversation come from the caller's context: code wraps a chat turn in
+# `with usage_tagged(listing_id=..., conversation_id=...):` and every call made inside it (including the
+# rolling summary) is tagged. Work handed to another thread keeps the tags if it runs in a copied context
+# (contextvars.copy_context().run).
+# Rows are kept in memory totals per call site for the sidebar and written to SQLite in batches by a
+# background thread, so recording never waits on disk.
+# Has no Streamlit dependency, so the report can be run from the command line:
+#   python usage_ledger.py [--days 7] [--usage .usage_ledger.sqlite3] [--conversations .conversations.sqlite3]
+# It prints token use and cost per call site, prompt version and listing, and tokens per confirmed showing
+# (conversations whose invite was handed off, from the conversation store).
+
+import argparse
+import atexit
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+USAGE_PATH = os.environ.get("USAGE_PATH", ".usage_ledger.sqlite3")
+
+flush_interval = 2.0       # seconds between background flushes
+flush_batch_size = 200     # flush early once this many rows are queued
+
+# USD per 1M tokens: (input, cached input, output). Dated model names match by prefix
+MODEL_PRICES = {
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+}
+
+usage_tags = contextvars.ContextVar("usage_tags", default = {})
+
+
+# Tags every usage row recorded inside the block (nested blocks add to / override the outer tags)
+@contextmanager
+def usage_tagged(**tags):
+    token = usage_tags.set({**usage_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        usage_tags.reset(token)
+
+
+def model_prices(model: str) -> tuple[float, float, float] | None:
+    for name in sorted(MODEL_PRICES, key = len, reverse = True):
+        if model.startswith(name):
+            return MODEL_PRICES[name]
+    return None
+
+
+# Cost in USD of one call; cached prompt tokens are billed at the cached input price. None for unknown models
+def call_cost(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float | None:
+    prices = model_prices(model or "")
+    if prices is None:
+        return None
+    return ((prompt_tokens - cached_tokens) * prices[0] + cached_tokens * prices[1] + completion_tokens * prices[2]) / 1e6
+
+
+class UsageLedger:
+    def __init__(self, path: str = USAGE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = []     # rows not yet written
+        self.totals = {}      # call type -> running totals since the process started
+        self.wake = threading.Event()
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                "created_at REAL NOT NULL, call_type TEXT NOT NULL, model TEXT NOT NULL, prompt_version TEXT NOT NULL, "
+                "listing_id TEXT NOT NULL, conversation_id TEXT NOT NULL, prompt_tokens INTEGER NOT NULL, "
+                "completion_tokens INTEGER NOT NULL, cached_tokens INTEGER NOT NULL, llm_cache_hit INTEGER NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS usage_created ON usage (created_at)")
+        threading.Thread(target = self.run, name = "usage-ledger", daemon = True).start()
+        atexit.register(self.flush)
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout = 30)
+
+    # Records resp.usage of one completion. llm_cache_hit marks a response served from the LLM cache: its
+    # tokens were not billed again and are reported as saved
+    def record(self, call_type: str, model: str, usage, prompt_version: str = "", llm_cache_hit: bool = False):
+        if usage is None:
+            return
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+        tags = usage_tags.get()
+        row = (time.time(), call_type, model or "", prompt_version, tags.get("listing_id") or "",
+               tags.get("conversation_id") or "", prompt, completion, cached, int(llm_cache_hit))
+        with self.lock:
+            self.pending.append(row)
+            totals = self.totals.setdefault(call_type, {"calls": 0, "llm_cache_hits": 0, "prompt_tokens": 0,
+                                                        "completion_tokens": 0, "cached_tokens": 0, "cost_usd": 0.0})
+            if llm_cache_hit:
+                totals["llm_cache_hits"] += 1
+            else:
+                totals["calls"] += 1
+                totals["prompt_tokens"] += prompt
+                totals["completion_tokens"] += completion
+                totals["cached_tokens"] += cached
+                totals["cost_usd"] += call_cost(model, prompt, cached, completion) or 0.0
+            queued = len(self.pending)
+        if queued >= flush_batch_size:
+            self.wake.set()
+
+    # Writes the queued rows in one transaction; they are put back if the write fails
+    def flush(self):
+        with self.lock:
+            rows, self.pending = self.pending, []
+        if not rows:
+            return
+        try:
+            with self.connect() as db:
+                db.executemany("INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error:
+            with self.lock:
+                self.pending = rows + self.pending
+            raise
+
+    def run(self):
+        while True:
+            self.wake.wait(flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                time.sleep(flush_interval)
+
+    # Per call type totals since the process started, with average prompt tokens per billed call
+    def summary(self) -> list[dict]:
+        with self.lock:
+            totals = {call_type: dict(t) for call_type, t in self.totals.items()}
+        out = []
+        for call_type, t in sorted(totals.items()):
+            t["avg_prompt_tokens"] = round(t["prompt_tokens"] / t["calls"]) if t["calls"] else 0
+            t["cost_usd"] = round(t["cost_usd"], 4)
+            out.append({"call_type": call_type, **t})
+        return out
+
+
+# Aggregates the ledger (optionally only rows newer than `since`) and joins it with the conversation store
+def usage_report(usage_path: str, conversations_path: str | None, since: float = 0.0) -> dict:
+    with sqlite3.connect(usage_path) as db:
+        rows = db.execute(
+            "SELECT call_type, model, prompt_version, listing_id, conversation_id, prompt_tokens, completion_tokens, "
+            "cached_tokens, llm_cache_hit FROM usage WHERE created_at >= ?", (since,)
+        ).fetchall()
+
+    # Conversations whose invite was handed off count as confirmed showings
+    confirmed = {}
+    if conversations_path and os.path.exists(conversations_path):
+        with sqlite3.connect(conversations_path) as db:
+            for conversation_id, listing_id, state in db.execute(
+                    "SELECT id, listing_id, state FROM conversations WHERE updated_at >= ?", (since,)):
+                if json.loads(state or "{}").get("invite_sent"):
+                    confirmed[conversation_id] = listing_id
+
+    def bucket():
+        return {"calls": 0, "llm_cache_hits": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+                "saved_tokens": 0, "cost_usd": 0.0}
+
+    def add(group: dict, model, prompt, completion, cached, hit):
+        if hit:
+            group["llm_cache_hits"] += 1
+            group["saved_tokens"] += prompt + completion
+            return
+        group["calls"] += 1
+        group["prompt_tokens"] += prompt
+        group["completion_tokens"] += completion
+        group["cached_tokens"] += cached
+        group["cost_usd"] += call_cost(model, prompt, cached, completion) or 0.0
+
+    total, by_call, by_version, by_listing = bucket(), {}, {}, {}
+    confirmed_tokens = 0
+    for call_type, model, version, listing_id, conversation_id, prompt, completion, cached, hit in rows:
+        for group in (total, by_call.setdefault(call_type, bucket()), by_version.setdefault(version or "-", bucket()),
+                      by_listing.setdefault(listing_id or "-", bucket())):
+            add(group, model, prompt, completion, cached, hit)
+        if not hit and conversation_id in confirmed:
+            confirmed_tokens += prompt + completion
+
+    showings_by_listing = {}
+    for listing_id in confirmed.values():
+        showings_by_listing[listing_id] = showings_by_listing.get(listing_id, 0) + 1
+    for listing_id, group in by_listing.items():
+        group["confirmed_showings"] = showings_by_listing.get(listing_id, 0)
+
+    showings = len(confirmed)
+    billed = total["prompt_tokens"] + total["completion_tokens"]
+    return {
+        "total": total,
+        "by_call_type": by_call,
+        "by_prompt_version": by_version,
+        "by_listing": by_listing,
+        "confirmed_showings": showings,
+        # Every billed token, converted or not, divided by the showings it produced
+        "tokens_per_confirmed_showing": round(billed / showings) if showings else None,
+        "cost_per_confirmed_showing": round(total["cost_usd"] / showings, 4) if showings else None,
+        # Only the tokens of the conversations that reached a showing
+        "tokens_per_confirmed_conversation": round(confirmed_tokens / showings) if showings else None,
+    }
+
+
+def print_table(title: str, groups: dict, extra: tuple[str, ...] = ()):
+    columns = ("calls", "llm_cache_hits", "prompt_tokens", "completion_tokens", "cached_tokens", "saved_tokens", "cost_usd") + extra
+    print(f"\n{title}")
+    print(f"{'':<24}" + "".join(f"{c:>19}" for c in columns))
+    for name, group in sorted(groups.items()):
+        print(f"{name[:24]:<24}" + "".join(
+            f"{group[c]:>19.4f}" if isinstance(group[c], float) else f"{group[c]:>19,}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Report OpenAI token use and tokens per confirmed showing")
+    parser.add_argument("--usage", default = USAGE_PATH, help = "usage ledger database")
+    parser.add_argument("--conversations", default = os.environ.get("CONVERSATIONS_PATH", ".conversations.sqlite3"),
+                        help = "conversation store database, for counting confirmed showings")
+    parser.add_argument("--days", type = float, help = "only include the last N days")
+    parser.add_argument("--json", action = "store_true", help = "print the report as JSON")
+    args = parser.parse_args()
+
+    since = time.time() - args.days * 86400 if args.days else 0.0
+    report = usage_report(args.usage, args.conversations, since)
+    if args.json:
+        print(json.dumps(report, indent = 2))
+        return
+    print_table("By call type", report["by_call_type"])
+    print_table("By prompt version", report["by_prompt_version"])
+    print_table("By listing", report["by_listing"], ("confirmed_showings",))
+    print_table("Total", {"all": report["total"]})
+    print(f"\nConfirmed showings: {report['confirmed_showings']}")
+    print(f"Tokens per confirmed showing: {report['tokens_per_confirmed_showing']}")
+    print(f"Cost per confirmed showing (USD): {report['cost_per_confirmed_showing']}")
+    print(f"Tokens per confirmed conversation: {report['tokens_per_confirmed_conversation']}")
+
+
+if __name__ == "__main__":
+    main()